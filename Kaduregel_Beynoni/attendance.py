@@ -0,0 +1,139 @@
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+
+import instrument
+
+# Attendance index: player name -> sorted array of game day ordinals (date.toordinal()), overall and
+# per day of week. Dates are parsed once when a game enters the index, so lookups, pairwise diffs and
+# date-range queries work on sorted integer arrays instead of scanning data['games'].
+#
+# One index is cached per data dict (see index_for) and kept current by stats.apply_game, which every
+# game write goes through.
+
+ALL_DAYS = None
+
+
+class AttendanceIndex:
+    def __init__(self, games=()):
+        self._dates = {}     # (player_name, day_of_week or None) -> array of ordinals
+        self._labels = {}    # ordinal -> 'DD/MM/YY'
+        for game in games:
+            self.add_game(game)
+
+    @staticmethod
+    def _ordinal(game):
+        return date.fromisoformat(game['date']).toordinal()
+
+    def _keys(self, player_name, game):
+        return (player_name, ALL_DAYS), (player_name, game.get('day_of_week'))
+
+    def add_game(self, game):
+        if 'date' not in game:
+            return
+        ordinal = self._ordinal(game)
+        for player_name in game.get('players', []):
+            for key in self._keys(player_name, game):
+                insort(self._dates.setdefault(key, array('i')), ordinal)
+
+    def remove_game(self, game):
+        if 'date' not in game:
+            return
+        ordinal = self._ordinal(game)
+        for player_name in game.get('players', []):
+            for key in self._keys(player_name, game):
+                dates = self._dates.get(key)
+                if dates:
+                    i = bisect_left(dates, ordinal)
+                    if i < len(dates) and dates[i] == ordinal:
+                        del dates[i]
+
+    def dates(self, player_name, day_of_week=ALL_DAYS):
+        """
+        :param player_name: The player's name
+        :param day_of_week: Optional, specify the day (Tuesday/Thursday/Saturday)
+        :return: Sorted array of date ordinals the player played on
+        """
+        return self._dates.get((player_name, day_of_week), array('i'))
+
+    def between(self, player_name, start, end, day_of_week=ALL_DAYS):
+        """
+        Dates a player played on within [start, end].
+        :param start: datetime.date (inclusive)
+        :param end: datetime.date (inclusive)
+        :return: Sorted array of date ordinals
+        """
+        dates = self.dates(player_name, day_of_week)
+        return dates[bisect_left(dates, start.toordinal()):bisect_right(dates, end.toordinal())]
+
+    def count_between(self, player_name, start, end, day_of_week=ALL_DAYS):
+        dates = self.dates(player_name, day_of_week)
+        return bisect_right(dates, end.toordinal()) - bisect_left(dates, start.toordinal())
+
+    def label(self, ordinal):
+        # Format each date once
+        text = self._labels.get(ordinal)
+        if text is None:
+            text = self._labels[ordinal] = date.fromordinal(ordinal).strftime('%d/%m/%y')
+        return text
+
+
+def unique(dates):
+    result = array('i')
+    for ordinal in dates:
+        if not result or result[-1] != ordinal:
+            result.append(ordinal)
+    return result
+
+
+# Merge two sorted arrays: values only in a, values only in b
+def sorted_difference(a, b):
+    a_only, b_only = array('i'), array('i')
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            a_only.append(a[i])
+            i += 1
+        elif a[i] > b[j]:
+            b_only.append(b[j])
+            j += 1
+        else:
+            i += 1
+            j += 1
+    a_only.extend(a[i:])
+    b_only.extend(b[j:])
+    return a_only, b_only
+
+
+# ################################ per-data cache ################################ #
+
+# id(data) -> (data, index); the data reference keeps the id from being reused
+_indexes = {}
+
+
+def index_for(data):
+    """
+    Get the attendance index for a data dict, building it on first use.
+    :param data: The JSON data
+    :return: AttendanceIndex
+    """
+    cached = _indexes.get(id(data))
+    if cached is None or cached[0] is not data:
+        instrument.count('games_scanned', len(data['games']))
+        cached = _indexes[id(data)] = (data, AttendanceIndex(data['games']))
+    return cached[1]
+
+
+# Called for every game write; only updates an index that has already been built
+def apply_game(data, game, sign=1):
+    cached = _indexes.get(id(data))
+    if cached is None or cached[0] is not data:
+        return
+    if sign > 0:
+        cached[1].add_game(game)
+    else:
+        cached[1].remove_game(game)
+
+
+def forget(data):
+    _indexes.pop(id(data), None)
@@ -0,0 +1,299 @@
+import math
+import random
+import time
+
+import instrument
+
+# Team balancer: simulated annealing over player swaps between teams.
+#
+# The objective (lower is better) is
+#   balance    - variance of the teams' total ratings
+#   positions  - how unevenly goalkeepers / Defensive / Offensive players are spread
+#                (a spread of one between teams is free, every extra player costs POSITION_PENALTY)
+#   diversity  - pairs of teammates that already played on a team together (coplay teammate masks),
+#                times diversity_weight
+# A swap only changes two teams, so each move is scored from those two teams alone.
+
+POSITION_PENALTY = 10.0
+QUOTA_POSITIONS = ('goalkeeper', 'defensive', 'offensive')
+
+
+def player_position(player):
+    # Ratings store 'Goalkeeper', 'Defensive', ...; older entries use lowercase 'both'
+    return str(player.get('position', 'both')).strip().lower()
+
+
+class _State:
+    def __init__(self, players, num_teams, teammates, diversity_weight):
+        self.players = players
+        self.num_teams = num_teams
+        self.teammates = teammates
+        self.diversity_weight = diversity_weight
+        # reverse[i]: players who have i among their past teammates
+        self.reverse = None
+        if teammates is not None:
+            self.reverse = [0] * len(players)
+            for i, mask in enumerate(teammates):
+                for j in range(mask.bit_length()):
+                    if mask >> j & 1:
+                        self.reverse[j] |= 1 << i
+        self.ratings = [float(p.get('rating', 3.0)) for p in players]
+        self.positions = [player_position(p) for p in players]
+        self.teams = [[] for _ in range(num_teams)]
+
+    def assign(self, assignment):
+        self.teams = [[] for _ in range(self.num_teams)]
+        for i, team in enumerate(assignment):
+            self.teams[team].append(i)
+
+    def team_sum(self, team):
+        return sum(self.ratings[i] for i in team)
+
+    def team_diversity(self, team):
+        if self.teammates is None:
+            return 0
+        mask = 0
+        for i in team:
+            mask |= 1 << i
+        return sum((self.teammates[i] & mask).bit_count() for i in team)
+
+    def balance(self, sums):
+        mean = sum(sums) / len(sums)
+        return sum((s - mean) ** 2 for s in sums) / len(sums)
+
+    def position_counts(self, teams):
+        return {position: [sum(1 for i in team if self.positions[i] == position) for team in teams]
+                for position in QUOTA_POSITIONS}
+
+    def position_penalty(self, counts):
+        penalty = 0.0
+        for per_team in counts.values():
+            penalty += max(0, max(per_team) - min(per_team) - 1) * POSITION_PENALTY
+        return penalty
+
+    def score(self, teams=None):
+        teams = self.teams if teams is None else teams
+        balance = self.balance([self.team_sum(team) for team in teams])
+        positions = self.position_penalty(self.position_counts(teams))
+        diversity = sum(self.team_diversity(team) for team in teams)
+        return {
+            'balance': balance,
+            'positions': positions,
+            'diversity': diversity,
+            'total': balance + positions + self.diversity_weight * diversity,
+        }
+
+
+def _initial_assignment(state, rng):
+    # Snake draft by rating (ties broken randomly), goalkeepers dealt first so each team gets one
+    order = list(range(len(state.players)))
+    rng.shuffle(order)
+    order.sort(key=lambda i: (state.positions[i] != 'goalkeeper', -state.ratings[i]))
+    assignment = [0] * len(order)
+    for rank, i in enumerate(order):
+        lap, step = divmod(rank, state.num_teams)
+        assignment[i] = step if lap % 2 == 0 else state.num_teams - 1 - step
+    return assignment
+
+
+def _anneal(state, rng, iterations, deadline):
+    teams = state.teams
+    num_teams = state.num_teams
+    ratings, positions = state.ratings, state.positions
+    sums = [state.team_sum(team) for team in teams]
+    counts = state.position_counts(teams)
+    weight = state.diversity_weight if state.teammates is not None else 0
+    diversity = sum(state.team_diversity(team) for team in teams)
+    masks = [sum(1 << i for i in team) for team in teams]
+
+    def moved(player, source, target):
+        per_team = counts.get(positions[player])
+        if per_team is not None:
+            per_team[source] -= 1
+            per_team[target] += 1
+
+    def contribution(player, mask):
+        # Repeated pairs a player adds to a team with this mask (in both directions)
+        return (state.teammates[player] & mask).bit_count() + (state.reverse[player] & mask).bit_count()
+
+    def total():
+        return state.balance(sums) + state.position_penalty(counts) + weight * diversity
+
+    current = total()
+    best, best_teams = current, [list(team) for team in teams]
+    temperature = max(1.0, current)
+    cooling = (0.001 / temperature) ** (1.0 / max(1, iterations))
+
+    steps = 0
+    for step in range(iterations):
+        if step % 256 == 0 and time.perf_counter() > deadline:
+            break
+        steps += 1
+        a = rng.randrange(num_teams)
+        b = rng.randrange(num_teams - 1)
+        if b >= a:
+            b += 1
+        if not teams[a] or not teams[b]:
+            continue
+        ia, ib = rng.randrange(len(teams[a])), rng.randrange(len(teams[b]))
+        pa, pb = teams[a][ia], teams[b][ib]
+
+        # Apply the swap, then undo it if it is rejected
+        change = ratings[pb] - ratings[pa]
+        sums[a] += change
+        sums[b] -= change
+        moved(pa, a, b)
+        moved(pb, b, a)
+        diversity_change = 0
+        if weight:
+            bit_a, bit_b = 1 << pa, 1 << pb
+            diversity_change = (contribution(pb, masks[a] ^ bit_a) - contribution(pa, masks[a])
+                                + contribution(pa, masks[b] ^ bit_b) - contribution(pb, masks[b]))
+        diversity += diversity_change
+        candidate = total()
+
+        delta = candidate - current
+        if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+            current = candidate
+            teams[a][ia], teams[b][ib] = pb, pa
+            if weight:
+                masks[a] ^= bit_a | bit_b
+                masks[b] ^= bit_a | bit_b
+            if current < best:
+                best, best_teams = current, [list(team) for team in teams]
+        else:
+            sums[a] -= change
+            sums[b] += change
+            moved(pa, b, a)
+            moved(pb, a, b)
+            diversity -= diversity_change
+        temperature *= cooling
+
+    instrument.count('swaps_evaluated', steps)
+    return best, best_teams
+
+
+def _teammate_masks(players, teammates):
+    # Past teammates as bitmasks over the positions in `players`
+    if teammates is None:
+        return None
+    index = {p['name']: i for i, p in enumerate(players)}
+    masks = []
+    for p in players:
+        mask = 0
+        for name in teammates(p['name']):
+            if name in index and name != p['name']:
+                mask |= 1 << index[name]
+        masks.append(mask)
+    return masks
+
+
+def evaluate_teams(teams, teammates=None, diversity_weight=0.1):
+    """
+    Score a given split with the optimizer's objective.
+    :param teams: List of teams, each a list of player dicts with 'name', 'rating' and 'position'
+    :param teammates: Optional, function from player name to a set of past teammate names
+    :param diversity_weight: Cost of every repeated teammate pair, relative to rating variance
+    :return: Score dict with 'balance', 'positions', 'diversity' and 'total' (see optimize_teams)
+    """
+    players = [p for team in teams for p in team]
+    state = _State(players, len(teams), _teammate_masks(players, teammates), diversity_weight)
+    indexes = iter(range(len(players)))
+    return state.score([[next(indexes) for _ in team] for team in teams])
+
+
+def optimize_teams(players, num_teams=3, seed=None, iterations=2000, restarts=6, time_budget=0.5,
+                   teammates=None, diversity_weight=0.1):
+    """
+    Split players into balanced teams.
+    :param players: List of player dicts with 'name', 'rating' and 'position'
+    :param num_teams: Number of teams to create
+    :param seed: Optional, seed for reproducible splits
+    :param iterations: Annealing steps per restart
+    :param restarts: Number of independent starting splits; the best result over all of them is kept
+    :param time_budget: Maximum seconds to spend in total (a safety cap on top of the iteration budget)
+    :param teammates: Optional, function from player name to a set of past teammate names
+    :param diversity_weight: Cost of every repeated teammate pair, relative to rating variance
+    :return: (teams, score) where teams is a list of lists of player dicts and score is a dict with
+             'balance', 'positions', 'diversity' and 'total'
+    """
+    rng = random.Random(seed)
+    deadline = time.perf_counter() + time_budget
+
+    state = _State(players, num_teams, _teammate_masks(players, teammates), diversity_weight)
+    best_total, best_teams = None, None
+    for restart in range(max(1, restarts)):
+        state.assign(_initial_assignment(state, rng))
+        total, teams = _anneal(state, rng, iterations, deadline)
+        if best_total is None or total < best_total:
+            best_total, best_teams = total, teams
+        if time.perf_counter() > deadline:
+            break
+
+    return [[players[i] for i in team] for team in best_teams], state.score(best_teams)
+
+
+# ################################ multi-start search ################################ #
+
+# Order-independent identity of a split, used to drop duplicate lineups
+def lineup_fingerprint(teams):
+    return tuple(sorted(tuple(sorted(p['name'] for p in team)) for team in teams))
+
+
+def _run_candidates(players, num_teams, seed, indexes, iterations, teammates, diversity_weight, top_k):
+    # Each candidate gets its own seed derived from (seed, index), so results don't depend on which
+    # worker runs it; no time budget here for the same reason
+    teammate_lookup = teammates.__getitem__ if teammates is not None else None
+    best = {}
+    for index in indexes:
+        teams, score = optimize_teams(players, num_teams=num_teams, seed=f'{seed}:{index}',
+                                      iterations=iterations, restarts=1, time_budget=float('inf'),
+                                      teammates=teammate_lookup, diversity_weight=diversity_weight)
+        fingerprint = lineup_fingerprint(teams)
+        if fingerprint not in best or score['total'] < best[fingerprint][0]['total']:
+            best[fingerprint] = (score, teams)
+    ranked = sorted(best.items(), key=lambda item: (item[1][0]['total'], item[0]))
+    return ranked[:top_k]
+
+
+def generate_lineups(players, candidates=2000, top_k=5, num_teams=3, seed=0, workers=None,
+                     iterations=500, teammates=None, diversity_weight=0.1, chunk_size=50):
+    """
+    Run many independently seeded team splits, spread over a process pool, and keep the best ones.
+    :param players: List of player dicts with 'name', 'rating' and 'position'
+    :param candidates: Number of candidate splits to generate
+    :param top_k: Number of distinct lineups to return
+    :param num_teams: Number of teams per lineup
+    :param seed: Seed for the whole run; the same seed gives the same lineups for any number of workers
+    :param workers: Number of worker processes (None = one per core, 1 = run in this process)
+    :param iterations: Annealing steps per candidate
+    :param teammates: Optional, function from player name to a set of past teammate names
+    :param diversity_weight: Cost of every repeated teammate pair, relative to rating variance
+    :param chunk_size: Candidates per task sent to a worker
+    :return: List of (teams, score) pairs, best first
+    """
+    # Workers get plain data: past teammates restricted to the players at hand
+    teammate_sets = None
+    if teammates is not None:
+        teammate_sets = {p['name']: set(teammates(p['name'])) for p in players}
+
+    instrument.count('candidates_evaluated', candidates)
+    chunks = [range(start, min(start + chunk_size, candidates)) for start in range(0, candidates, chunk_size)]
+    args = (players, num_teams, seed)
+    options = (iterations, teammate_sets, diversity_weight, top_k)
+
+    if workers == 1:
+        results = [_run_candidates(*args, chunk, *options) for chunk in chunks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_run_candidates, *args, chunk, *options) for chunk in chunks]
+            results = [future.result() for future in futures]
+
+    merged = {}
+    for ranked in results:
+        for fingerprint, (score, teams) in ranked:
+            if fingerprint not in merged or score['total'] < merged[fingerprint][0]['total']:
+                merged[fingerprint] = (score, teams)
+    ranked = sorted(merged.items(), key=lambda item: (item[1][0]['total'], item[0]))
+    return [(teams, score) for fingerprint, (score, teams) in ranked[:top_k]]
@@ -0,0 +1,373 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Performance checks. Run from this directory: python benchmark.py [--sizes real,medium,large]
+#   startup budget  - cold `import main` and first prioritized list, in fresh interpreters
+#   suite           - the main data operations on seeded synthetic leagues (see synthetic.py) of growing
+#                     size: cold time (caches dropped), warm median, and peak memory of the cold run
+#   service         - with --service, p50/p99 latency of the HTTP service under concurrent clients
+#   storage         - a batch whose middle entry fails leaves memory, disk and the change log in step,
+#                     for the JSON journal and the SQLite backend alike
+# --json saves the suite results; --compare checks them against a saved baseline.
+# Exits with status 1 when a budget is exceeded or a case regressed. The same checks run under pytest
+# (tests/test_benchmarks.py, with --bench-baseline for --compare), next to the behavior tests.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# ################################ startup budget ################################ #
+
+# Bots import main.py and answer one message per process, so cold start is the latency that matters.
+# Both numbers are measured inside a fresh interpreter (interpreter startup itself is not counted).
+IMPORT_BUDGET = 0.05          # seconds to `import main`
+FIRST_LIST_BUDGET = 0.25      # seconds from `import main` to the first prioritized signup list
+STARTUP_RUNS = 7
+
+_STARTUP_SCRIPT = '''
+import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+data = main.get_data()
+signups = list(data['games'][0]['players']) if data['games'] else []
+main.prioritize_signups(data, signups, 'tuesday_games')
+done = time.perf_counter()
+print(imported - start, done - start)
+'''
+
+
+def measure_startup(runs=STARTUP_RUNS):
+    # Like a deployed bot, measure with bytecode caches in place: one uncounted warm-up run writes them
+    env = {key: value for key, value in os.environ.items() if key != 'PYTHONDONTWRITEBYTECODE'}
+    import_times, first_list_times = [], []
+    for run in range(runs + 1):
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], cwd=HERE, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        if run == 0:
+            continue
+        import_time, first_list_time = map(float, output.split())
+        import_times.append(import_time)
+        first_list_times.append(first_list_time)
+    return statistics.median(import_times), statistics.median(first_list_times)
+
+
+def check_startup():
+    import_time, first_list_time = measure_startup()
+    print(f"import main:          {import_time * 1000:7.1f} ms (budget {IMPORT_BUDGET * 1000:.0f} ms)")
+    print(f"first prioritized list: {first_list_time * 1000:5.1f} ms (budget {FIRST_LIST_BUDGET * 1000:.0f} ms)")
+    return import_time <= IMPORT_BUDGET and first_list_time <= FIRST_LIST_BUDGET
+
+
+# ################################ synthetic suite ################################ #
+
+# name -> (games, players)
+SIZES = {
+    'real': (117, 99),
+    'medium': (1000, 500),
+    'large': (10000, 5000),
+}
+DEFAULT_SIZES = ('real', 'medium')
+SUITE_REPEAT = 5
+TEAMS_SHARE = 0.3             # share of synthetic games with teams and a winner
+# A case regressed when it is this much slower than the baseline, and by more than the noise floor
+REGRESSION_FACTOR = 1.5
+NOISE_FLOOR = 0.002
+
+
+def _drop_caches(data):
+    import attendance
+    import coplay
+    import ratings
+    import rollups
+    import stats
+    import team_cache
+
+    for module in (stats, attendance, coplay, ratings, rollups, team_cache):
+        module.forget(data)
+
+
+def _cases(data):
+    import main
+    import models
+
+    newest = data['games'][0]
+    signups = list(newest['players'])
+    regulars = sorted(data['players'], key=lambda name: -data['players'][name]['total_games'])[:2]
+    lineup = models.lineup(data, signups)
+    split = [signups[i::3] for i in range(3)]
+
+    def sync_player_stats():
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                main.sync_player_stats(data)
+            finally:
+                sys.stdout = stdout
+
+    # sort_players_only without the prompts: resolve the pasted names, then rank them
+    def sort_players_only():
+        main.prioritize_signups(data, main.resolve_player_names(data, signups, 'error'), 'tuesday_games')
+
+    return {
+        'sync_player_stats': sync_player_stats,
+        'sort_players_only': sort_players_only,
+        'compare_players': lambda: main.compare_players(data, *regulars),
+        'calculate_diversity_score': lambda: main.calculate_diversity_score(split, data),
+        'create_teams': lambda: main.create_teams(lineup, data=data, seed=0),
+    }
+
+
+def run_suite(sizes=DEFAULT_SIZES, repeat=SUITE_REPEAT):
+    """
+    Time every case on a synthetic league of each size.
+    :return: Dict of '<size>/<case>' -> {'cold', 'warm', 'peak_kb'} (seconds, KiB)
+    """
+    import main
+    import synthetic
+
+    results = {}
+    cwd, data_file = os.getcwd(), main.DATA_FILE
+    with tempfile.TemporaryDirectory() as workdir:
+        # sync_player_stats saves, and the name resolver looks for its alias file: keep both out of the repo
+        os.chdir(workdir)
+        main.DATA_FILE = os.path.join(workdir, 'soccer_team.json')
+        try:
+            for size in sizes:
+                games, players = SIZES[size]
+                data = synthetic.generate_league(games, players, seed=0, teams_share=TEAMS_SHARE)
+                for case, run in _cases(data).items():
+                    _drop_caches(data)
+                    tracemalloc.start()
+                    run()
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+
+                    _drop_caches(data)
+                    start = time.perf_counter()
+                    run()
+                    cold = time.perf_counter() - start
+                    warm = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        run()
+                        warm.append(time.perf_counter() - start)
+                    results[f'{size}/{case}'] = {'cold': cold, 'warm': statistics.median(warm),
+                                                 'peak_kb': peak / 1024}
+        finally:
+            os.chdir(cwd)
+            main.DATA_FILE = data_file
+    return results
+
+
+def print_suite(results):
+    print(f"{'case':<40} {'cold ms':>10} {'warm ms':>10} {'peak KiB':>10}")
+    for case, result in results.items():
+        print(f"{case:<40} {result['cold'] * 1000:10.2f} {result['warm'] * 1000:10.2f} {result['peak_kb']:10.0f}")
+
+
+def compare_suite(results, baseline):
+    """
+    :return: List of (case, metric, baseline seconds, current seconds) for every regression
+    """
+    regressions = []
+    for case, result in results.items():
+        previous = baseline.get(case)
+        if previous is None:
+            continue
+        for metric in ('cold', 'warm'):
+            if result[metric] > previous[metric] * REGRESSION_FACTOR + NOISE_FLOOR:
+                regressions.append((case, metric, previous[metric], result[metric]))
+    return regressions
+
+
+# ################################ service latency ################################ #
+
+SERVICE_CLIENTS = 50
+SERVICE_REQUESTS = 40         # per client
+SERVICE_P99_BUDGET = 0.1      # seconds, for reads and signup rankings under concurrent load
+WRITE_SHARE = 0.05            # share of requests that record a game
+
+
+async def _service_load(service, clients, requests):
+    import asyncio
+    import random
+    from datetime import date, timedelta
+
+    import service as service_module
+
+    server = await service_module.start(service, port=0)
+    port = server.sockets[0].getsockname()[1]
+    roster = list(service.data['players'])
+    latencies = {'read': [], 'write': []}
+    next_day = [date(2100, 1, 5)]
+
+    async def client(index):
+        rng = random.Random(index)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for _ in range(requests):
+            kind = 'write' if rng.random() < WRITE_SHARE else 'read'
+            if kind == 'write':
+                next_day[0] += timedelta(days=7)
+                body = {'date': next_day[0].isoformat(), 'day': 'T', 'players': rng.sample(roster, 15)}
+                method, path = 'POST', '/games'
+            elif rng.random() < 0.5:
+                body = {'day': rng.choice('THSA'), 'players': roster[:20] if rng.random() < 0.8 else
+                        rng.sample(roster, 20), 'unknown': 'keep'}
+                method, path = 'POST', '/prioritize'
+            else:
+                body, method, path = None, 'GET', f'/players/{service_module.quote(rng.choice(roster))}'
+            payload = json.dumps(body).encode('utf-8') if body is not None else b''
+            start = time.perf_counter()
+            writer.write(f'{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Length: {len(payload)}\r\n\r\n'
+                         .encode('latin-1') + payload)
+            await writer.drain()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            latencies[kind].append(time.perf_counter() - start)
+        writer.close()
+
+    async with server:
+        await asyncio.gather(*(client(i) for i in range(clients)))
+    return latencies
+
+
+def measure_service(clients=SERVICE_CLIENTS, requests=SERVICE_REQUESTS, size='real'):
+    """
+    Run the HTTP service in-process on a synthetic league and hit it with concurrent keep-alive clients.
+    :return: Dict of 'read' / 'write' -> {'p50', 'p99', 'count'} (seconds)
+    """
+    import asyncio
+
+    import journal
+    import service
+    import synthetic
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'soccer_team.json')
+        journal.write_snapshot(synthetic.generate_league(*SIZES[size], seed=0), path)
+        league = service.Service(path, team_workers=0)
+        try:
+            latencies = asyncio.run(_service_load(league, clients, requests))
+        finally:
+            league.close()
+    return {kind: {'p50': statistics.median(values), 'p99': statistics.quantiles(values, n=100)[98],
+                   'count': len(values)} for kind, values in latencies.items() if len(values) > 1}
+
+
+def check_service():
+    results = measure_service()
+    for kind, result in results.items():
+        print(f"service {kind:5}  p50 {result['p50'] * 1000:6.2f} ms  p99 {result['p99'] * 1000:6.2f} ms  "
+              f"({result['count']} requests, {SERVICE_CLIENTS} clients)")
+    return results['read']['p99'] <= SERVICE_P99_BUDGET
+
+
+# ################################ storage consistency ################################ #
+
+def _partial_batch(path, storage):
+    # A batch whose middle entry fails: the entries before it are kept in memory and on disk alike, and the
+    # next write continues the change log without a gap
+    import journal
+
+    data = storage.load(path)
+    start = journal.version(data)
+    newest = data['games'][0]
+    names = list(data['players'])[:14]
+    batch = [{'op': 'add_game', 'game': {'date': '2030-01-01', 'day_of_week': 'Tuesday', 'players': names}},
+             {'op': 'remove_game', 'date': '1999-01-01', 'day_of_week': 'Tuesday'},
+             {'op': 'add_game', 'game': {'date': '2030-01-04', 'day_of_week': 'Saturday', 'players': names}}]
+    try:
+        storage.commit(data, batch, path)
+        return "the failing entry was accepted"
+    except ValueError:
+        pass
+    stored = storage.load(path)
+    if (journal.version(stored), len(stored['games'])) != (journal.version(data), len(data['games'])):
+        return (f"memory has {len(data['games'])} games at version {journal.version(data)}, the file "
+                f"{len(stored['games'])} at version {journal.version(stored)}")
+    storage.record(data, {'op': 'edit_game', 'date': newest['date'], 'day_of_week': newest['day_of_week'],
+                          'changes': {'winner': 'draw'}}, path)
+    seqs = [entry['seq'] for entry in storage.changes_since(path, start) or []]
+    if seqs != list(range(start + 1, journal.version(data) + 1)):
+        return f"change log after version {start}: {seqs}"
+    return None
+
+
+def check_storage():
+    import journal
+    import sqlite_store
+    import synthetic
+
+    ok = True
+    with tempfile.TemporaryDirectory() as workdir:
+        league = synthetic.generate_league(*SIZES['real'], seed=0)
+        for name, storage in (('soccer_team.json', journal), ('soccer_team.db', sqlite_store)):
+            path = os.path.join(workdir, name)
+            if storage is journal:
+                journal.write_snapshot(league, path)
+            else:
+                sqlite_store.compact(league, path)
+            problem = _partial_batch(path, storage)
+            print(f"partial batch ({storage.__name__}): {problem or 'ok'}")
+            ok = ok and problem is None
+    return ok
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Startup budget and synthetic benchmark suite.")
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                        help=f"comma-separated, from {', '.join(SIZES)} (empty: startup check only)")
+    parser.add_argument('--repeat', type=int, default=SUITE_REPEAT, help="warm runs per case")
+    parser.add_argument('--json', help="save the suite results to this file")
+    parser.add_argument('--compare', help="fail on regressions against results saved with --json")
+    parser.add_argument('--skip-startup', action='store_true')
+    parser.add_argument('--service', action='store_true', help="also load-test the HTTP service")
+    args = parser.parse_args(argv)
+
+    ok = True
+    if not args.skip_startup:
+        ok = check_startup()
+        if not ok:
+            print("Startup budget exceeded.")
+
+    if not check_storage():
+        print("Storage left memory and disk out of step.")
+        ok = False
+
+    sizes = [size for size in args.sizes.split(',') if size]
+    if sizes:
+        results = run_suite(sizes, args.repeat)
+        print_suite(results)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as write_file:
+                json.dump(results, write_file, indent=4)
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as read_file:
+                regressions = compare_suite(results, json.load(read_file))
+            for case, metric, before, after in regressions:
+                print(f"Regression: {case} {metric} {before * 1000:.2f} ms -> {after * 1000:.2f} ms")
+            ok = ok and not regressions
+
+    if args.service and not check_service():
+        print("Service p99 budget exceeded.")
+        ok = False
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
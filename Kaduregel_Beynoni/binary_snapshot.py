@@ -0,0 +1,451 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import date
+
+# Compact binary snapshot of the dataset, readable through mmap without parsing.
+#
+# Layout (little-endian): an 8-byte magic, a section count, then a table of
+# (16-byte name, offset, byte length) entries, then the 8-byte aligned sections:
+#   str.offsets / str.blob      interned strings (names, days, positions, winners) as one UTF-8 blob
+#   t.members                   the distinct teams, each a run of string ids
+#   p.*                         one fixed-width column per player field, in data['players'] order
+#   p.teams                     each player's past_teams as a run of team ids
+#   g.date / g.day / g.winner   one entry per game, in data['games'] order (date as a day ordinal)
+#   g.players                   each game's player list as a run of string ids
+#   g.teams                     each game's teams as a run of team ids
+#   p.extra / g.extra           per record, the string id of a small JSON object with whatever the columns
+#                               don't cover (unusual types, app team names/colors, key orders), or -1
+#   top                         JSON of the other top-level keys (such as journal_seq)
+# A run column <name> comes with <name>.start: the offset of each record's run, plus the end.
+# Every record is read from its own slice of the columns, so opening the file and reading one player or game
+# costs the same however long the history is. Converting JSON -> binary -> JSON gives back the exact same
+# data, including key order.
+#
+# journal.storage_for loads .kbs files like the other data files, read-only: compact() (main.save_data) writes
+# a new snapshot, but single changes can't be recorded; convert the file to .json or .db for that.
+
+MAGIC = b'KBSNAP\x00\x02'
+SUFFIX = '.kbs'
+_HEADER = struct.Struct('<8sI')
+_SECTION = struct.Struct('<16sQQ')
+
+# Player columns: data key -> (section name, array typecode, presence flag)
+PLAYER_COLUMNS = {
+    'tuesday_games': ('p.tuesday', 'i', 1),
+    'thursday_games': ('p.thursday', 'i', 2),
+    'saturday_games': ('p.saturday', 'i', 4),
+    'total_games': ('p.total', 'i', 8),
+    'rating': ('p.rating', 'd', 16),
+}
+POSITION_FLAG, PAST_TEAMS_FLAG = 32, 64
+GAME_DATE, GAME_DAY, GAME_PLAYERS, GAME_TEAMS, GAME_WINNER = 1, 2, 4, 8, 16
+_COLUMN_TYPES = {'i': int, 'd': float}
+
+
+class _Strings:
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def intern(self, value):
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return string_id
+
+
+def _iso_ordinal(value):
+    # Only dates that format back to exactly the same text go into the date column
+    try:
+        parsed = date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed.toordinal() if parsed.isoformat() == value else None
+
+
+def _is_string_list(value):
+    return type(value) is list and all(type(item) is str for item in value)
+
+
+def _is_team_list(value):
+    return type(value) is list and all(_is_string_list(team) for team in value)
+
+
+def _is_app_team_list(value):
+    # Teams from the app: {'name', 'players', 'color'} objects
+    return type(value) is list and all(type(team) is dict and _is_string_list(team.get('players')) for team in value)
+
+
+# ################################ writing ################################ #
+
+def encode(data):
+    """
+    Encode the JSON data into the binary snapshot format.
+    :param data: The JSON data
+    :return: bytes
+    """
+    strings = _Strings()
+    team_ids, team_start, team_members = {}, array('I', [0]), array('I')
+
+    def team_id(names):
+        members = tuple(map(strings.intern, names))
+        found = team_ids.get(members)
+        if found is None:
+            found = team_ids[members] = len(team_start) - 1
+            team_members.extend(members)
+            team_start.append(len(team_members))
+        return found
+
+    def extra_id(record, stored, extra):
+        rest = {key: value for key, value in record.items() if key not in stored}
+        if rest:
+            extra['rest'] = rest
+        if list(record) != stored + list(rest):
+            extra['order'] = list(record)
+        return strings.intern(json.dumps(extra, ensure_ascii=False, separators=(',', ':'))) if extra else -1
+
+    top_level = {key: value for key, value in data.items() if key not in ('games', 'players')}
+    top = {'top': top_level, 'top_order': list(data)} if top_level or list(data) != ['games', 'players'] else {}
+
+    columns = {section: array(typecode) for section, typecode, _ in PLAYER_COLUMNS.values()}
+    player_names, player_positions, player_flags, player_extras = array('I'), array('i'), array('B'), array('i')
+    player_team_start, player_teams = array('I', [0]), array('I')
+    for name, player in data.get('players', {}).items():
+        player_names.append(strings.intern(name))
+        flags = 0
+        for key, (section, typecode, flag) in PLAYER_COLUMNS.items():
+            value = player.get(key)
+            if type(value) is _COLUMN_TYPES[typecode]:
+                columns[section].append(value)
+                flags |= flag
+            else:
+                columns[section].append(0)
+        position = player.get('position')
+        if type(position) is str:
+            player_positions.append(strings.intern(position))
+            flags |= POSITION_FLAG
+        else:
+            player_positions.append(-1)
+        if _is_team_list(player.get('past_teams')):
+            player_teams.extend(map(team_id, player['past_teams']))
+            flags |= PAST_TEAMS_FLAG
+        player_team_start.append(len(player_teams))
+        player_flags.append(flags)
+        player_extras.append(extra_id(player, _decoded_player_keys(flags), {}))
+
+    game_dates, game_days, game_winners, game_flags, game_extras = (array('i'), array('i'), array('i'),
+                                                                    array('B'), array('i'))
+    game_start, game_players = array('I', [0]), array('I')
+    game_team_start, game_teams = array('I', [0]), array('I')
+    for game in data.get('games', []):
+        flags, extra = 0, {}
+        ordinal = _iso_ordinal(game.get('date'))
+        game_dates.append(ordinal or 0)
+        if ordinal is not None:
+            flags |= GAME_DATE
+        day = game.get('day_of_week')
+        game_days.append(strings.intern(day) if type(day) is str else -1)
+        if type(day) is str:
+            flags |= GAME_DAY
+        players = game.get('players')
+        if _is_string_list(players):
+            game_players.extend(strings.intern(name) for name in players)
+            flags |= GAME_PLAYERS
+        game_start.append(len(game_players))
+        teams = game.get('teams')
+        if _is_team_list(teams) or _is_app_team_list(teams):
+            game_teams.extend(team_id(team['players'] if type(team) is dict else team) for team in teams)
+            flags |= GAME_TEAMS
+            if teams and type(teams[0]) is dict:
+                # 'players' stays as a placeholder so the team's key order survives
+                extra['teams'] = [{key: None if key == 'players' else value for key, value in team.items()}
+                                  for team in teams]
+        game_team_start.append(len(game_teams))
+        winner = game.get('winner')
+        game_winners.append(strings.intern(winner) if type(winner) is str else -1)
+        if type(winner) is str:
+            flags |= GAME_WINNER
+        game_flags.append(flags)
+        game_extras.append(extra_id(game, _decoded_game_keys(flags), extra))
+
+    blob = bytearray()
+    string_offsets = array('I', [0])
+    for value in strings.values:
+        blob += value.encode('utf-8')
+        string_offsets.append(len(blob))
+
+    sections = [
+        ('str.offsets', string_offsets),
+        ('str.blob', bytes(blob)),
+        ('t.members.start', team_start),
+        ('t.members', team_members),
+        ('p.name', player_names),
+        *((section, columns[section]) for section, _, _ in PLAYER_COLUMNS.values()),
+        ('p.position', player_positions),
+        ('p.flags', player_flags),
+        ('p.teams.start', player_team_start),
+        ('p.teams', player_teams),
+        ('p.extra', player_extras),
+        ('g.date', game_dates),
+        ('g.day', game_days),
+        ('g.winner', game_winners),
+        ('g.flags', game_flags),
+        ('g.players.start', game_start),
+        ('g.players', game_players),
+        ('g.teams.start', game_team_start),
+        ('g.teams', game_teams),
+        ('g.extra', game_extras),
+        ('top', json.dumps(top, ensure_ascii=False, separators=(',', ':')).encode('utf-8')),
+    ]
+    return _pack(sections)
+
+
+def _pack(sections):
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    table, payloads = [], []
+    for name, payload in sections:
+        if isinstance(payload, array):
+            if sys.byteorder != 'little':
+                payload = array(payload.typecode, payload)
+                payload.byteswap()
+            payload = payload.tobytes()
+        offset += -offset % 8
+        table.append(_SECTION.pack(name.encode('ascii'), offset, len(payload)))
+        payloads.append((offset, payload))
+        offset += len(payload)
+
+    out = bytearray(offset)
+    out[:_HEADER.size] = _HEADER.pack(MAGIC, len(sections))
+    out[_HEADER.size:_HEADER.size + _SECTION.size * len(sections)] = b''.join(table)
+    for start, payload in payloads:
+        out[start:start + len(payload)] = payload
+    return bytes(out)
+
+
+def write(data, path):
+    # Atomic, like the JSON snapshot: write a temporary file and swap it in
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as write_file:
+        write_file.write(encode(data))
+        write_file.flush()
+        os.fsync(write_file.fileno())
+    os.replace(tmp_path, path)
+
+
+def _decoded_player_keys(flags):
+    keys = [key for key, (_, _, flag) in PLAYER_COLUMNS.items() if flags & flag]
+    if flags & POSITION_FLAG:
+        keys.append('position')
+    if flags & PAST_TEAMS_FLAG:
+        keys.append('past_teams')
+    return keys
+
+
+def _decoded_game_keys(flags):
+    return [key for key, flag in (('date', GAME_DATE), ('day_of_week', GAME_DAY), ('players', GAME_PLAYERS),
+                                  ('teams', GAME_TEAMS), ('winner', GAME_WINNER)) if flags & flag]
+
+
+# ################################ reading ################################ #
+
+class Snapshot:
+    """
+    Zero-copy reader over a binary snapshot. Columns are memoryviews into the mapped file, so opening
+    costs the same however long the history is; strings, teams and extras are decoded on first use.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as read_file:
+            self._mmap = mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+        magic, count = _HEADER.unpack_from(self._buffer)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a binary snapshot (or one from an older version: convert it "
+                             f"again from the JSON)")
+
+        self._sections = {}
+        for i in range(count):
+            name, offset, length = _SECTION.unpack_from(self._buffer, _HEADER.size + i * _SECTION.size)
+            self._sections[name.rstrip(b'\x00').decode('ascii')] = self._buffer[offset:offset + length]
+
+        self.closed = False
+        self._strings = {}
+        self._teams = {}
+        self._player_index = None
+        self._top = None
+        self.player_count = len(self.column('p.name', 'I'))
+        self.game_count = len(self.column('g.date', 'i'))
+
+    def column(self, name, typecode='B'):
+        view = self._sections[name]
+        if sys.byteorder != 'little' and typecode != 'B':
+            swapped = array(typecode, view.tobytes())
+            swapped.byteswap()
+            return memoryview(swapped)
+        return view.cast(typecode)
+
+    def _run(self, name, index):
+        # Zero-copy view of one record's run in a '<name>' / '<name>.start' column pair
+        start = self.column(name + '.start', 'I')
+        return self.column(name, 'I')[start[index]:start[index + 1]]
+
+    def close(self):
+        """
+        Unmap the file. Views from column() and game_player_ids() point into the mapping: release them (or
+        drop them) first. While any is still held the mapping stays open, and is unmapped along with the
+        last of them instead.
+        """
+        self._sections = {}
+        self.closed = True
+        try:
+            self._buffer.release()
+            self._mmap.close()
+        except BufferError:
+            # Views handed out are still alive; they keep the mapping until they are freed
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def string(self, string_id):
+        value = self._strings.get(string_id)
+        if value is None:
+            offsets = self.column('str.offsets', 'I')
+            value = bytes(self._sections['str.blob'][offsets[string_id]:offsets[string_id + 1]]).decode('utf-8')
+            self._strings[string_id] = value
+        return value
+
+    def team(self, team_id):
+        # One list per distinct team, shared by everyone who reads it (like models.compact); don't change it
+        members = self._teams.get(team_id)
+        if members is None:
+            members = self._teams[team_id] = [self.string(string_id) for string_id in self._run('t.members', team_id)]
+        return members
+
+    def _extra(self, section, index):
+        string_id = self.column(section, 'i')[index]
+        return json.loads(self.string(string_id)) if string_id >= 0 else {}
+
+    @property
+    def top(self):
+        # Top-level keys other than games and players, with the key order when it isn't the usual one
+        if self._top is None:
+            self._top = json.loads(bytes(self._sections['top']).decode('utf-8'))
+        return self._top
+
+    # Players
+
+    def player_name(self, index):
+        return self.string(self.column('p.name', 'I')[index])
+
+    def player_index(self, name):
+        if self._player_index is None:
+            self._player_index = {self.player_name(i): i for i in range(self.player_count)}
+        return self._player_index[name]
+
+    def player_stat(self, index, key):
+        section, typecode, flag = PLAYER_COLUMNS[key]
+        if not self.column('p.flags')[index] & flag:
+            return None
+        return self.column(section, typecode)[index]
+
+    def player(self, index):
+        flags = self.column('p.flags')[index]
+        player = {key: self.column(section, typecode)[index]
+                  for key, (section, typecode, flag) in PLAYER_COLUMNS.items() if flags & flag}
+        if flags & POSITION_FLAG:
+            player['position'] = self.string(self.column('p.position', 'i')[index])
+        if flags & PAST_TEAMS_FLAG:
+            player['past_teams'] = [self.team(team_id) for team_id in self._run('p.teams', index)]
+        extra = self._extra('p.extra', index)
+        player.update(extra.get('rest', {}))
+        if 'order' in extra:
+            player = {key: player[key] for key in extra['order']}
+        return player
+
+    # Games
+
+    def game_player_ids(self, index):
+        # Zero-copy view of the game's string ids
+        return self._run('g.players', index)
+
+    def game_players(self, index):
+        return [self.string(string_id) for string_id in self.game_player_ids(index)]
+
+    def game_ordinal(self, index):
+        return self.column('g.date', 'i')[index] if self.column('g.flags')[index] & GAME_DATE else None
+
+    def game(self, index):
+        flags = self.column('g.flags')[index]
+        extra = self._extra('g.extra', index)
+        game = {}
+        if flags & GAME_DATE:
+            game['date'] = date.fromordinal(self.column('g.date', 'i')[index]).isoformat()
+        if flags & GAME_DAY:
+            game['day_of_week'] = self.string(self.column('g.day', 'i')[index])
+        if flags & GAME_PLAYERS:
+            game['players'] = self.game_players(index)
+        if flags & GAME_TEAMS:
+            teams = [list(self.team(team_id)) for team_id in self._run('g.teams', index)]
+            if 'teams' in extra:
+                teams = [{**meta, 'players': members} for meta, members in zip(extra['teams'], teams)]
+            game['teams'] = teams
+        if flags & GAME_WINNER:
+            game['winner'] = self.string(self.column('g.winner', 'i')[index])
+        game.update(extra.get('rest', {}))
+        if 'order' in extra:
+            game = {key: game[key] for key in extra['order']}
+        return game
+
+    def to_data(self):
+        """
+        :return: The dataset in the regular JSON schema
+        """
+        data = {
+            'games': [self.game(i) for i in range(self.game_count)],
+            'players': {self.player_name(i): self.player(i) for i in range(self.player_count)},
+        }
+        if 'top_order' in self.top:
+            data.update(self.top['top'])
+            data = {key: data[key] for key in self.top['top_order']}
+        return data
+
+
+# ################################ storage ################################ #
+
+# The storage interface of journal.storage_for (see journal.py and sqlite_store.py), read-only
+
+def load(path):
+    with Snapshot(path) as snapshot:
+        return snapshot.to_data()
+
+
+def compact(data, path):
+    # Store the whole dataset: a new snapshot
+    write(data, path)
+
+
+def commit(data, entries, path, expected_version=None):
+    raise ValueError(f"{path} is a read-only binary snapshot; convert it to .json or .db to record changes")
+
+
+def record(data, entry, path, expected_version=None):
+    return commit(data, [entry], path, expected_version)
+
+
+def changes_since(path, since):
+    """
+    :return: No changes when the client is at the snapshot's version, otherwise None (no change log is kept)
+    """
+    with Snapshot(path) as snapshot:
+        current = snapshot.top.get('top', {}).get('journal_seq', 0)
+    return [] if since == current else None
@@ -0,0 +1,181 @@
+import instrument
+
+# Player x game attendance matrix and co-play analytics.
+#
+# Each player's row is a bit-packed Python int with bit j set when they played game j, and each player
+# also gets a bitmask over player ids of everyone they shared a team with. Pairwise questions then become
+# a single AND plus a popcount instead of rebuilding sets per player:
+#   played together  -> (rows[a] & rows[b]).bit_count()
+#   attendance rate  -> (rows[a] & day_mask).bit_count() / day_mask.bit_count()
+#   diversity score  -> (teammates[a] & team_mask).bit_count()
+#
+# One matrix is cached per data dict (see matrix_for). New games are appended as new columns, and teams
+# given to a game that had none are added on top; other edits, removals and team changes drop the cached
+# matrix so it is rebuilt on next use.
+
+ALL_DAYS = None
+
+
+# Teams are lists of names in the Python data and {'name', 'players', 'color'} objects in the app data
+def team_members(team):
+    return team['players'] if isinstance(team, dict) else team
+
+
+class AttendanceMatrix:
+    def __init__(self, data):
+        self.names = []
+        self.ids = {}
+        self.rows = []           # player id -> bitmask over game columns
+        self.teammates = []      # player id -> bitmask over player ids
+        self.same_team = {}      # (id, id) with low id first -> number of games on the same team
+        self.day_masks = {ALL_DAYS: 0}
+        self.columns = 0
+
+        for name in data['players']:
+            self.player_id(name)
+        # Oldest first, so column order follows the history
+        for game in reversed(data['games']):
+            self.add_game(game)
+
+    def player_id(self, name):
+        player_id = self.ids.get(name)
+        if player_id is None:
+            player_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.rows.append(0)
+            self.teammates.append(0)
+        return player_id
+
+    def add_game(self, game):
+        players = game.get('players')
+        if players:
+            bit = 1 << self.columns
+            self.columns += 1
+            for name in players:
+                self.rows[self.player_id(name)] |= bit
+            self.day_masks[ALL_DAYS] |= bit
+            day = game.get('day_of_week')
+            self.day_masks[day] = self.day_masks.get(day, 0) | bit
+        self.add_teams(game)
+
+    def add_teams(self, game):
+        for team in game.get('teams', []):
+            ids = [self.player_id(name) for name in team_members(team)]
+            team_mask = self.mask(ids)
+            for i in ids:
+                self.teammates[i] |= team_mask & ~(1 << i)
+            for a in ids:
+                for b in ids:
+                    if a < b:
+                        self.same_team[a, b] = self.same_team.get((a, b), 0) + 1
+
+    def mask(self, ids):
+        result = 0
+        for player_id in ids:
+            result |= 1 << player_id
+        return result
+
+    # ################################ queries ################################ #
+
+    def games_played(self, name, day_of_week=ALL_DAYS):
+        return (self.rows[self.ids[name]] & self.day_masks.get(day_of_week, 0)).bit_count()
+
+    def played_together(self, name1, name2, day_of_week=ALL_DAYS):
+        """
+        :return: Number of games both players attended
+        """
+        return (self.rows[self.ids[name1]] & self.rows[self.ids[name2]]
+                & self.day_masks.get(day_of_week, 0)).bit_count()
+
+    def on_same_team(self, name1, name2):
+        a, b = sorted((self.ids[name1], self.ids[name2]))
+        return self.same_team.get((a, b), 0)
+
+    def teammates_of(self, name):
+        # Names of everyone who shared a team with this player
+        player_id = self.ids.get(name)
+        if player_id is None:
+            return set()
+        mask = self.teammates[player_id]
+        return {self.names[i] for i in range(mask.bit_length()) if mask >> i & 1}
+
+    def played_together_matrix(self, names=None, day_of_week=ALL_DAYS):
+        """
+        Co-occurrence counts for every pair of players; the diagonal is each player's own game count.
+        :param names: Optional, restrict to these players (in this order)
+        :param day_of_week: Optional, specify the day (Tuesday/Thursday/Saturday)
+        :return: List of rows, in the order of names
+        """
+        names = self.names if names is None else names
+        day_mask = self.day_masks.get(day_of_week, 0)
+        rows = [self.rows[self.ids[name]] & day_mask for name in names]
+        return [[(row & other).bit_count() for other in rows] for row in rows]
+
+    def same_team_matrix(self, names=None):
+        names = self.names if names is None else names
+        return [[self.on_same_team(a, b) if a != b else 0 for b in names] for a in names]
+
+    def attendance_rates(self, day_of_week=ALL_DAYS):
+        """
+        :return: Dict of player name -> share of the day's games they played
+        """
+        day_mask = self.day_masks.get(day_of_week, 0)
+        total = day_mask.bit_count()
+        if not total:
+            return {name: 0.0 for name in self.names}
+        return {name: (row & day_mask).bit_count() / total for name, row in zip(self.names, self.rows)}
+
+    def diversity_score(self, teams):
+        """
+        Number of (player, teammate) pairs in the given teams that already shared a team before.
+        Lower means more new combinations.
+        :param teams: List of teams, each a list of player dicts with 'name' or a list of names
+        """
+        score = 0
+        for team in teams:
+            ids = [self.ids.get(p['name'] if isinstance(p, dict) else p) for p in team]
+            ids = [i for i in ids if i is not None]
+            team_mask = self.mask(ids)
+            for i in ids:
+                score += (self.teammates[i] & team_mask).bit_count()
+        return score
+
+
+# ################################ per-data cache ################################ #
+
+# id(data) -> (data, matrix); the data reference keeps the id from being reused
+_matrices = {}
+
+
+def matrix_for(data):
+    cached = _matrices.get(id(data))
+    if cached is None or cached[0] is not data:
+        instrument.count('games_scanned', len(data['games']))
+        cached = _matrices[id(data)] = (data, AttendanceMatrix(data))
+    return cached[1]
+
+
+# Called for every game write; new games are appended, anything else forces a rebuild
+def apply_game(data, game, sign=1):
+    cached = _matrices.get(id(data))
+    if cached is None or cached[0] is not data:
+        return
+    if sign > 0 and data['games'] and data['games'][0] is game:
+        cached[1].add_game(game)
+    else:
+        forget(data)
+
+
+# Teams given to a recorded game: added on top when it had none, otherwise the matrix is rebuilt
+def set_teams(data, game, had_teams):
+    cached = _matrices.get(id(data))
+    if cached is None or cached[0] is not data:
+        return
+    if had_teams:
+        forget(data)
+    else:
+        cached[1].add_teams(game)
+
+
+def forget(data):
+    _matrices.pop(id(data), None)
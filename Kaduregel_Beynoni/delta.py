@@ -0,0 +1,210 @@
+import gzip
+import json
+import os
+
+import journal
+from coplay import team_members
+
+# Delta bundles: what changed since a client's version, instead of the whole dataset.
+#
+# The journal's sequence number is the dataset version, and compacted journals are kept as a change log
+# (journal.changes_since / sqlite_store.changes_since). A bundle for a client at version `since` carries
+# the current state of everything those changes touched, so the client applies it without replaying
+# journal operations or recomputing any counters:
+#   {"format": "delta", "base": 120, "version": 131,
+#    "games": [[0, {...}], [7, {...}]],       touched games as stored, with their index in data['games']
+#    "removed": [["2025-03-18", "Tuesday"]],  (date, day_of_week) of touched games that are gone
+#    "players": {"name": {...}}}             records of the players whose counters or fields moved
+# The client drops every touched game and puts the bundle's games back at their indexes (ascending), which
+# gives exactly the server's history order, backfills and saved teams included. Player records are merged
+# into the client's; 'past_teams' (the bulk of a regular's record) is only sent when it grew.
+# When the change log doesn't reach back to `since` (compacted away, or another dataset altogether), or the
+# delta would touch most of the history anyway, the bundle is the snapshot instead:
+#   {"format": "snapshot", "version": 131, "data": {...}}
+#
+# FileClient is a local stand-in for the app's storage, for trying the protocol end to end without the app.
+
+DELTA = 'delta'
+SNAPSHOT = 'snapshot'
+
+# A delta touching more than this share of the games goes out as the snapshot
+SNAPSHOT_SHARE = 0.5
+
+
+def _game_key(game):
+    return game.get('date'), game.get('day_of_week')
+
+
+def touched(entries):
+    """
+    What a list of journal entries changed.
+    :param entries: Stamped journal entries
+    :return: (set of game keys, set of player names, names whose past_teams changed,
+              whether any player's counters may have changed)
+    """
+    keys, names, past_teams, all_players = set(), set(), set(), False
+    for entry in entries:
+        op = entry['op']
+        if op in ('add_game', 'save_teams'):
+            game = entry['game']
+            keys.add(_game_key(game))
+            names.update(game.get('players', []))
+            for team in game.get('teams', []) if op == 'save_teams' else ():
+                past_teams.update(team_members(team))
+        elif op == 'update_player':
+            names.add(entry['name'])
+            if 'past_teams' in entry['fields']:
+                past_teams.add(entry['name'])
+        elif op in ('edit_game', 'remove_game', 'set_teams'):
+            key = entry['date'], entry['day_of_week']
+            changes = entry.get('changes', {})
+            keys.add(key)
+            keys.add((changes.get('date', key[0]), changes.get('day_of_week', key[1])))
+            if op == 'remove_game' or 'players' in changes:
+                if 'players_before' in entry:
+                    names.update(entry['players_before'])
+                else:
+                    # Journaled before entries said whose game it was
+                    all_players = True
+    return keys, names | past_teams, past_teams, all_players
+
+
+def snapshot_bundle(data):
+    return {'format': SNAPSHOT, 'version': journal.version(data), 'data': data}
+
+
+def export_delta(data, changes, since):
+    """
+    Build the bundle that brings a client at version `since` up to the data.
+    :param data: The JSON data; its version is the bundle's
+    :param changes: Journal entries after `since` (see journal.changes_since), or None when unavailable
+    :param since: The client's version
+    :return: A delta bundle, or the snapshot bundle when a delta isn't possible or wouldn't be smaller
+    """
+    current = journal.version(data)
+    if changes is None or since > current:
+        return snapshot_bundle(data)
+    # The change log can be ahead of a data that was loaded a moment earlier
+    changes = [entry for entry in changes if entry['seq'] <= current]
+    if len(changes) != current - since:
+        return snapshot_bundle(data)
+
+    keys, names, past_teams, all_players = touched(changes)
+    if len(keys) > SNAPSHOT_SHARE * max(len(data['games']), 1):
+        return snapshot_bundle(data)
+    games = [[i, game] for i, game in enumerate(data['games']) if _game_key(game) in keys] if keys else []
+    # A game's current players moved too when its day changed
+    for _, game in games:
+        names.update(game.get('players', []))
+    players = data['players']
+    if all_players:
+        names = set(players)
+    return {
+        'format': DELTA,
+        'base': since,
+        'version': current,
+        'games': games,
+        'removed': sorted(keys - {_game_key(game) for _, game in games}, key=str),
+        'players': {name: players[name] if name in past_teams else
+                    {key: value for key, value in players[name].items() if key != 'past_teams'}
+                    for name in names if name in players},
+    }
+
+
+def apply_bundle(data, bundle):
+    """
+    Apply a bundle to a client's copy of the data, in place.
+    :param data: The client's JSON data; its 'journal_seq' is its version
+    :param bundle: A bundle from export_delta
+    :return: The data
+    """
+    if bundle['format'] == SNAPSHOT:
+        data.clear()
+        data.update(bundle['data'])
+        data['journal_seq'] = bundle['version']
+        return data
+    if bundle['format'] != DELTA:
+        raise ValueError(f"Unknown bundle format {bundle['format']!r}")
+    if journal.version(data) != bundle['base']:
+        raise journal.ConflictError(f"Bundle is based on version {bundle['base']}, the data is at version "
+                                    f"{journal.version(data)}", bundle['base'], journal.version(data))
+
+    keys = {tuple(key) for key in bundle['removed']} | {_game_key(game) for _, game in bundle['games']}
+    games = [game for game in data['games'] if _game_key(game) not in keys]
+    for i, game in bundle['games']:
+        games.insert(i, game)
+    data['games'] = games
+    for name, record in bundle['players'].items():
+        data['players'].setdefault(name, {}).update(record)
+    data['journal_seq'] = bundle['version']
+    return data
+
+
+def encode_bundle(bundle):
+    return json.dumps(bundle, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def bundle_size(bundle):
+    return len(encode_bundle(bundle))
+
+
+def write_bundle(bundle, path):
+    # Compact JSON, gzipped when the path ends in .gz; returns the bytes written
+    payload = encode_bundle(bundle)
+    if path.endswith('.gz'):
+        payload = gzip.compress(payload)
+    with open(path, 'wb') as write_file:
+        write_file.write(payload)
+    return len(payload)
+
+
+def read_bundle(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as read_file:
+        return json.load(read_file)
+
+
+# ################################ client stand-in ################################ #
+
+class FileClient:
+    """
+    A local stand-in for the app's storage: one JSON file with the client's copy of the data, kept up to
+    date by pulling bundles the way the app would from the service's /changes endpoint.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as read_file:
+                self.data = json.load(read_file)
+
+    @property
+    def version(self):
+        # -1 when there is no copy yet, which no change log reaches back to, so the first pull is a snapshot
+        return journal.version(self.data) if self.data is not None else -1
+
+    def pull(self, fetch):
+        """
+        Bring the copy up to date.
+        :param fetch: Function from the client's version to a bundle (e.g. local_fetch, or an HTTP GET)
+        :return: The bundle that was applied
+        """
+        bundle = fetch(self.version)
+        if bundle['format'] == DELTA and bundle['version'] == self.version:
+            return bundle
+        self.data = apply_bundle(self.data if self.data is not None else {}, bundle)
+        journal.write_snapshot(self.data, self.path)
+        return bundle
+
+
+def local_fetch(data_file, storage):
+    """
+    A fetch function for FileClient that reads the data file directly, like the service does per request.
+    :param data_file: Path of the data file
+    :param storage: Its storage module (journal or sqlite_store, see journal.storage_for)
+    """
+    def fetch(since):
+        data = storage.load(data_file)
+        return export_delta(data, storage.changes_since(data_file, since), since)
+    return fetch
@@ -0,0 +1,21 @@
+import tkinter as tk
+from tkinter import messagebox
+
+# GUI actions (work in progress). Kept out of main.py so the command line and the bots never pay for
+# importing tkinter.
+
+
+def show_players():
+    messagebox.showinfo("Info", "Showing players...")
+
+
+def prioritize_players():
+    messagebox.showinfo("Info", "Prioritizing players...")
+
+
+def add_new_game():
+    messagebox.showinfo("Info", "Adding new game...")
+
+
+def view_calendar():
+    messagebox.showinfo("Info", "Viewing calendar...")
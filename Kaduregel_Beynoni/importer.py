@@ -0,0 +1,290 @@
+import csv
+import re
+import sys
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+# Streaming bulk import of game history from WhatsApp chat exports and CSV files.
+#
+# Everything is a generator pipeline over the input lines, so a chat export of several years is read in
+# one pass and only the signup lists still open are held in memory:
+#   chat_messages   lines -> Message(time, author, lines), joining multi-line messages
+#   chat_games      messages -> ImportedGame, one per game: the last version of its signup list posted
+#                   before the game day ended (lists are reposted every time someone signs up)
+#   csv_games       CSV rows -> ImportedGame (one row per player, or a 'players' column per game)
+#   game_entries    resolves the names against the roster once per game and drops games already recorded,
+#                   by the same date + day of week key main() uses, and games repeated in the input
+# The resulting add_game entries are committed by the caller in one batched write (one lock, one fsync),
+# so an import either goes in completely or, when a name can't be resolved, not at all.
+#
+# A signup list is a message with a header line naming the date (DD.MM, DD/MM, optionally with the year)
+# and/or the day ('שלישי', 'Tuesday', ...), followed by at least MIN_LIST_PLAYERS numbered names. Names
+# after a waitlist line ('ממתינים', 'המתנה', 'waitlist', ...) are not imported.
+
+MIN_LIST_PLAYERS = 8
+
+# Weekday (date.weekday()) of each game day, and the ways a day is written in headers and CSV files
+GAME_WEEKDAYS = {1: 'Tuesday', 3: 'Thursday', 5: 'Saturday'}
+DAY_NAMES = {
+    't': 'Tuesday', 'tue': 'Tuesday', 'tues': 'Tuesday', 'tuesday': 'Tuesday', 'שלישי': 'Tuesday', "ג'": 'Tuesday',
+    'h': 'Thursday', 'thu': 'Thursday', 'thurs': 'Thursday', 'thursday': 'Thursday', 'חמישי': 'Thursday',
+    "ה'": 'Thursday',
+    's': 'Saturday', 'sat': 'Saturday', 'saturday': 'Saturday', 'שבת': 'Saturday', "ש'": 'Saturday',
+}
+WAITLIST_MARKERS = ('ממתינים', 'המתנה', 'מחליפים', 'waitlist', 'waiting', 'reserves')
+CSV_DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%y', '%d.%m.%Y', '%d/%m/%y', '%d/%m/%Y')
+
+Message = namedtuple('Message', ['time', 'author', 'lines'])
+# date: 'YYYY-MM-DD'; names: the names as written, in list order; source: where it came from, for messages
+ImportedGame = namedtuple('ImportedGame', ['date', 'day_of_week', 'names', 'source'])
+
+# '[18/03/2025, 10:15:32] Author: text' (iPhone) and '18/03/2025, 10:15 - Author: text' (Android)
+_CHAT_LINE = re.compile(
+    r'^\u200e?(?:\[(?P<date1>\d{1,2}[./]\d{1,2}[./]\d{2,4}),? (?P<time1>\d{1,2}:\d{2}(?::\d{2})?)(?:\s?(?P<ampm1>[AaPp][Mm]))?\]'
+    r'|(?P<date2>\d{1,2}[./]\d{1,2}[./]\d{2,4}),? (?P<time2>\d{1,2}:\d{2})(?:\s?(?P<ampm2>[AaPp][Mm]))? -)'
+    r' (?:(?P<author>[^:]+): )?(?P<text>.*)$')
+_HEADER_DATE = re.compile(r'(?<![\d:])(\d{1,2})[./](\d{1,2})(?:[./](\d{4}|\d{2}))?(?![\d:])')
+_NUMBERED = re.compile(r'^\s*\u200e?(\d{1,2})\s*[.)\-:](?!\d)\s*(.*)$')
+_WORD = re.compile(r"[\w'׳]+")
+
+
+class ImportDataError(ValueError):
+    pass
+
+
+# ################################ chat exports ################################ #
+
+def _chat_time(day_text, time_text, ampm, month_first):
+    day, month, year = (int(part) for part in re.split(r'[./]', day_text))
+    if month_first:
+        day, month = month, day
+    year += 2000 if year < 100 else 0
+    hour, minute = (int(part) for part in time_text.split(':')[:2])
+    if ampm:
+        hour = hour % 12 + (12 if ampm.lower() == 'pm' else 0)
+    return datetime(year, month, day, hour, minute)
+
+
+def chat_messages(lines, month_first=False):
+    """
+    :param lines: Lines of a WhatsApp chat export
+    :param month_first: Timestamps are M/D/Y (US phones) rather than D/M/Y
+    :return: Generator of Message tuples; system messages have author None
+    """
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = _CHAT_LINE.match(line)
+        if match is None:
+            if current is not None:
+                current.lines.append(line)
+            continue
+        if current is not None:
+            yield current
+        day_text, time_text = match['date1'] or match['date2'], match['time1'] or match['time2']
+        try:
+            time = _chat_time(day_text, time_text, match['ampm1'] or match['ampm2'], month_first)
+        except ValueError:
+            # A line that only looks like a timestamp belongs to the message before it
+            if current is not None:
+                current.lines.append(line)
+            continue
+        current = Message(time, match['author'], [match['text']])
+    if current is not None:
+        yield current
+
+
+def parse_day(text):
+    """
+    :param text: A day as written ('T', 'Tue', 'שלישי', ...)
+    :return: 'Tuesday', 'Thursday', 'Saturday' or None
+    """
+    return DAY_NAMES.get(text.strip().casefold().replace('׳', "'"))
+
+
+def _header_game(header, posted):
+    # (date, day_of_week) named by a list header, with the year and the day filled in from the post time
+    day_of_week = None
+    for word in _WORD.findall(header.casefold()):
+        if len(word) > 1:       # single letters ('T', 'S') only count in CSV day columns
+            day_of_week = day_of_week or parse_day(word)
+
+    game_date = None
+    match = _HEADER_DATE.search(header)
+    if match:
+        day, month, year = match.groups()
+        try:
+            if year:
+                game_date = date(int(year) + (2000 if len(year) == 2 else 0), int(month), int(day))
+            else:
+                # The year of the post, or the next/previous one for lists posted across new year
+                candidates = [date(posted.year + offset, int(month), int(day)) for offset in (-1, 0, 1)]
+                game_date = min(candidates, key=lambda d: abs((d - posted.date()).days))
+        except ValueError:
+            game_date = None
+    if game_date is None and day_of_week is not None:
+        # Only the day: its next occurrence from the post date on
+        weekday = next(weekday for weekday, name in GAME_WEEKDAYS.items() if name == day_of_week)
+        game_date = posted.date() + timedelta(days=(weekday - posted.weekday()) % 7)
+    if game_date is None:
+        return None
+
+    # The date decides the day; a header that names a different day is taken at its date
+    day_of_week = GAME_WEEKDAYS.get(game_date.weekday(), day_of_week)
+    return (game_date.isoformat(), day_of_week) if day_of_week else None
+
+
+def signup_list(message):
+    """
+    :param message: A chat Message
+    :return: ImportedGame if the message is a signup list, else None
+    """
+    header, raw_names = [], []
+    for line in message.lines:
+        match = _NUMBERED.match(line)
+        if match is None:
+            if raw_names and any(marker in line.casefold() for marker in WAITLIST_MARKERS):
+                break
+            if not raw_names:
+                header.append(line)
+            continue
+        if match.group(2).strip():
+            raw_names.append(match.group(2).strip())
+    if len(raw_names) < MIN_LIST_PLAYERS or not header:
+        return None
+    game = _header_game(' '.join(header), message.time)
+    if game is None:
+        return None
+    return ImportedGame(*game, raw_names, f"message of {message.time:%d.%m.%y %H:%M} by {message.author}")
+
+
+def chat_games(messages):
+    """
+    :param messages: Messages in chat order (see chat_messages)
+    :return: Generator of ImportedGame, one per game, each once the chat has moved past its day
+    """
+    pending = {}      # (date, day_of_week) -> latest list posted for it
+    for message in messages:
+        today = message.time.date().isoformat()
+        for key in sorted(key for key in pending if key[0] < today):
+            yield pending.pop(key)
+        game = signup_list(message) if message.author is not None else None
+        if game is not None:
+            pending[game.date, game.day_of_week] = game
+    yield from sorted(pending.values())
+
+
+# ################################ CSV ################################ #
+
+def _csv_date(text):
+    for date_format in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), date_format).date()
+        except ValueError:
+            continue
+    raise ImportDataError(f"Unrecognized date {text!r}")
+
+
+def csv_games(lines):
+    """
+    Games from CSV: a header row with 'date', optionally 'day' (or 'day_of_week'), and either 'player'
+    (or 'name', one row per player, rows of a game next to each other) or 'players' (names separated by ';').
+    :param lines: Lines of the CSV file
+    :return: Generator of ImportedGame
+    """
+    rows = csv.reader(lines)
+    header = [column.strip().casefold() for column in next(rows, [])]
+    columns = {name: i for i, name in enumerate(header)}
+    day_column = columns.get('day', columns.get('day_of_week'))
+    player_column = columns.get('player', columns.get('name'))
+    players_column = columns.get('players')
+    if 'date' not in columns or (player_column is None and players_column is None):
+        raise ImportDataError(f"CSV needs a 'date' column and a 'player' or 'players' column, got {header}")
+
+    def game_key(numbered_row):
+        number, row = numbered_row
+        game_date = _csv_date(row[columns['date']])
+        day_text = row[day_column] if day_column is not None and day_column < len(row) else ''
+        day_of_week = parse_day(day_text) if day_text.strip() else GAME_WEEKDAYS.get(game_date.weekday())
+        if day_of_week is None:
+            raise ImportDataError(f"Line {number}: no game day for {row[columns['date']]!r}")
+        return game_date.isoformat(), day_of_week
+
+    numbered = ((number, row) for number, row in enumerate(rows, start=2) if any(cell.strip() for cell in row))
+    for (game_date, day_of_week), group in groupby(numbered, key=game_key):
+        group = list(group)
+        if players_column is not None:
+            raw_names = [name for _, row in group for name in row[players_column].split(';')]
+        else:
+            raw_names = [row[player_column] for _, row in group]
+        yield ImportedGame(game_date, day_of_week, [name.strip() for name in raw_names if name.strip()],
+                           f"line {group[0][0]}")
+
+
+# ################################ resolving and deduplicating ################################ #
+
+def game_entries(data, games, on_unknown='error', stats_out=None):
+    """
+    Turn imported games into add_game journal entries.
+    :param data: The JSON data
+    :param games: Iterable of ImportedGame
+    :param on_unknown: Names not on the roster: 'keep' (new player), 'skip' or 'error' (ImportDataError)
+    :param stats_out: Optional dict, filled with counts of 'games', 'duplicates' and 'unknown' names
+    :return: Generator of journal entries, oldest game first
+    """
+    import names
+
+    counts = stats_out if stats_out is not None else {}
+    counts.update(games=0, duplicates=0, unknown=0)
+    resolver = names.NameResolver(data['players'], names.load_aliases())
+    # The date + day of week key, as in main(); includes games earlier in this import
+    recorded = {(game.get('date'), game.get('day_of_week')) for game in data['games']}
+
+    for game in games:
+        if (game.date, game.day_of_week) in recorded:
+            counts['duplicates'] += 1
+            continue
+        players, seen = [], set()
+        for raw in game.names:
+            name = resolver.resolve(raw).name
+            if name is None:
+                counts['unknown'] += 1
+                if on_unknown == 'error':
+                    raise ImportDataError(f"Unknown player {raw!r} ({game.source})")
+                if on_unknown == 'skip':
+                    continue
+                name = ' '.join(raw.split())
+                resolver.add_name(name)
+            if name not in seen:
+                seen.add(name)
+                players.append(name)
+        recorded.add((game.date, game.day_of_week))
+        counts['games'] += 1
+        yield {'op': 'add_game', 'game': {'date': game.date, 'day_of_week': game.day_of_week, 'players': players}}
+
+
+def read_games(lines, file_format, month_first=False):
+    """
+    :param lines: Input lines
+    :param file_format: 'chat' or 'csv'
+    :return: Generator of ImportedGame
+    """
+    if file_format == 'csv':
+        return csv_games(lines)
+    if file_format == 'chat':
+        return chat_games(chat_messages(lines, month_first))
+    raise ImportDataError(f"Unknown import format {file_format!r}")
+
+
+def detect_format(path):
+    return 'csv' if str(path).lower().endswith('.csv') else 'chat'
+
+
+def open_lines(path):
+    # Lines of a file (or stdin for '-'), read lazily; a UTF-8 BOM from exports is dropped
+    if path == '-':
+        yield from sys.stdin
+        return
+    with open(path, 'r', encoding='utf-8-sig', newline='') as input_file:
+        yield from input_file
@@ -0,0 +1,180 @@
+import functools
+import os
+import time
+from contextlib import contextmanager
+
+# Lightweight timing and counting for the hot paths, with an opt-in per-run JSON report.
+#
+# Timers and counters are always collected (a perf_counter call and a dict update per use, so they go
+# around whole operations, never inside inner loops):
+#   with instrument.timer('load_data'): ...       @instrument.timed('sync_player_stats')
+#   instrument.count('games_scanned', len(games))
+# A report is only written when asked for, with `main.py --report run.json [--profile] [--trace-memory]`
+# or the KADUREGEL_REPORT environment variable. cProfile and tracemalloc are imported only then.
+
+REPORT_ENV = 'KADUREGEL_REPORT'
+PROFILE_TOP = 25              # functions listed in the report, by cumulative time
+MEMORY_TOP = 10               # allocation sites listed in the report
+
+# name -> [calls, total seconds, max seconds]
+timers = {}
+counters = {}
+
+_session = None
+
+
+def record_time(name, seconds):
+    entry = timers.get(name)
+    if entry is None:
+        timers[name] = [1, seconds, seconds]
+    else:
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[2]:
+            entry[2] = seconds
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, time.perf_counter() - start)
+
+
+def timed(name=None):
+    # Decorator form of timer; the name defaults to the function's name
+    def decorate(function):
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record_time(label, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def count(name, amount=1):
+    counters[name] = counters.get(name, 0) + amount
+
+
+def reset():
+    timers.clear()
+    counters.clear()
+
+
+def snapshot():
+    """
+    :return: Dict with the current 'timers' (calls, total and max seconds) and 'counters'
+    """
+    return {
+        'timers': {name: {'calls': calls, 'total': total, 'max': longest}
+                   for name, (calls, total, longest) in sorted(timers.items())},
+        'counters': dict(sorted(counters.items())),
+    }
+
+
+# ################################ per-run report ################################ #
+
+class _Session:
+    def __init__(self, path, command, profile, trace_memory):
+        self.path = path
+        self.command = command
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.profiler = None
+        self.trace_memory = trace_memory
+        if profile:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+        if trace_memory:
+            import tracemalloc
+
+            tracemalloc.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def finish(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        report = {
+            'command': self.command,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'wall': time.perf_counter() - self.start,
+            'pid': os.getpid(),
+            **snapshot(),
+        }
+        if self.trace_memory:
+            report['memory'] = _memory_report()
+        if self.profiler is not None:
+            report['profile'] = _profile_report(self.profiler, self.path + '.prof')
+        _write_json(report, self.path)
+        return report
+
+
+def _memory_report():
+    import tracemalloc
+
+    current, peak = tracemalloc.get_traced_memory()
+    top = tracemalloc.take_snapshot().statistics('lineno')[:MEMORY_TOP]
+    tracemalloc.stop()
+    return {
+        'current_kb': current / 1024,
+        'peak_kb': peak / 1024,
+        'top': [{'site': str(stat.traceback), 'kb': stat.size / 1024, 'blocks': stat.count} for stat in top],
+    }
+
+
+def _profile_report(profiler, dump_path):
+    import pstats
+
+    profiler.dump_stats(dump_path)
+    profile_stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, function), (_, calls, own, cumulative, _) in profile_stats.stats.items():
+        rows.append({'function': f'{os.path.basename(filename)}:{line}({function})', 'calls': calls,
+                     'own': own, 'cumulative': cumulative})
+    rows.sort(key=lambda row: -row['cumulative'])
+    return {'file': dump_path, 'top': rows[:PROFILE_TOP]}
+
+
+def _write_json(report, path):
+    import json
+
+    with open(path, 'w', encoding='utf-8') as write_file:
+        json.dump(report, write_file, ensure_ascii=False, indent=4)
+
+
+def start_report(path=None, command=None, profile=False, trace_memory=False):
+    """
+    Start collecting a report for this run; it is written by finish_report.
+    :param path: Report file (JSON), default from the KADUREGEL_REPORT environment variable
+    :param command: Label for the run, e.g. the subcommand
+    :param profile: Also run cProfile (the raw stats go to '<path>.prof')
+    :param trace_memory: Also record peak memory and the top allocation sites with tracemalloc
+    :return: True when a report is being collected
+    """
+    global _session
+    path = path or os.environ.get(REPORT_ENV)
+    if not path:
+        return False
+    reset()
+    _session = _Session(path, command, profile, trace_memory)
+    return True
+
+
+def finish_report():
+    """
+    :return: The report dict, or None when no report was started
+    """
+    global _session
+    if _session is None:
+        return None
+    session, _session = _session, None
+    return session.finish()
@@ -0,0 +1,484 @@
+import json
+import os
+import sys
+from contextlib import contextmanager
+
+import attendance
+import coplay
+import instrument
+import models
+import ratings
+import rollups
+import stats
+import team_cache
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+    import msvcrt
+
+# Append-only journal next to the JSON snapshot.
+#
+# Every mutation (a new game, a player edit, teams for a game) is written as one JSON line to
+# '<snapshot>.journal.jsonl' instead of re-serializing the whole snapshot, so recording a game costs
+# the same no matter how long the league history is. Each entry carries a sequence number, and the
+# snapshot stores the last sequence number folded into it ('journal_seq'). Loading reads the snapshot
+# and replays only the newer journal entries; compaction writes a new snapshot atomically and then
+# drops the journal. A crash at any point leaves either the old or the new state, never a mix.
+#
+# Several organizers may write to the same files at once. Every write takes an advisory lock on
+# '<snapshot>.lock' and first catches up with entries other writers appended since this process last
+# looked, so changes merge instead of overwriting each other. The sequence number doubles as the dataset
+# version (see version / etag): record(..., expected_version=v) is a compare-and-swap that raises
+# ConflictError when someone else wrote first. See writer.py for batching many writers' changes.
+#
+# Compaction doesn't throw the journal away: it is renamed to a change log segment
+# ('<snapshot>.changes.<last seq>.jsonl') and the newest RETAIN_SEGMENTS segments are kept, so
+# changes_since can hand out the changes after any recent version (see delta.py).
+
+JOURNAL_SUFFIX = '.journal.jsonl'
+
+# Fold the journal into the snapshot once it holds this many entries
+COMPACT_EVERY = 200
+
+# Compacted journals kept as the change log, i.e. about RETAIN_SEGMENTS * COMPACT_EVERY changes
+CHANGES_INFIX = '.changes.'
+RETAIN_SEGMENTS = 10
+
+# Number of entries currently sitting in each journal file (filled in by load / record)
+_journal_sizes = {}
+
+# snapshot path -> ((mtime_ns, size, inode), journal_seq) of the snapshot file as last read or written,
+# so writers only re-parse the snapshot when another process compacted it
+_snapshot_seqs = {}
+
+
+class ConflictError(ValueError):
+    """A write was based on an outdated version of the data."""
+
+    def __init__(self, message, expected=None, actual=None):
+        super().__init__(message)
+        self.expected = expected
+        self.actual = actual
+
+
+def journal_path(snapshot_path):
+    return os.path.splitext(snapshot_path)[0] + JOURNAL_SUFFIX
+
+
+def file_signature(path):
+    # (mtime, size) of a data file and of its journal (None when missing); any write changes it
+    signature = []
+    for file_path in (path, journal_path(path)):
+        try:
+            stat = os.stat(file_path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+# Storage backend for a data file: the JSON snapshot + journal (this module), SQLite for .db files
+# (sqlite_store.py), or the read-only binary snapshot for .kbs files (binary_snapshot.py). All offer
+# load(path), record(data, entry, path), commit(data, entries, path), compact(data, path) and
+# changes_since(path, version).
+def storage_for(path):
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        import sqlite_store
+
+        return sqlite_store
+    if path.endswith('.kbs'):
+        import binary_snapshot
+
+        return binary_snapshot
+    return sys.modules[__name__]
+
+
+def segment_paths(snapshot_path):
+    # Change log segments, oldest first, as (last seq, path)
+    prefix = os.path.basename(os.path.splitext(snapshot_path)[0]) + CHANGES_INFIX
+    directory = os.path.dirname(os.path.abspath(snapshot_path))
+    segments = []
+    for file_name in os.listdir(directory):
+        last = file_name[len(prefix):-len('.jsonl')]
+        if file_name.startswith(prefix) and file_name.endswith('.jsonl') and last.isdigit():
+            segments.append((int(last), os.path.join(directory, file_name)))
+    return sorted(segments)
+
+
+def lock_path(snapshot_path):
+    return os.path.splitext(snapshot_path)[0] + '.lock'
+
+
+def version(data):
+    # The sequence number of the last change folded into this data
+    return data.get('journal_seq', 0)
+
+
+def etag(data):
+    return f'"{version(data)}"'
+
+
+@contextmanager
+def locked(snapshot_path, shared=False):
+    """
+    Hold the advisory lock of a snapshot (exclusive for writers, shared for readers where supported).
+    Not reentrant: functions called with the lock held use the unlocked _helpers.
+    """
+    with open(lock_path(snapshot_path), 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# ################################ applying entries ################################ #
+
+def _apply_add_game(data, entry):
+    stats.record_game(data, entry['game'])
+
+
+# Games are identified by date + day of week, the same key main() uses
+def _find_entry_game(data, entry):
+    game = stats.find_game(data, entry['date'], entry['day_of_week'])
+    if game is None:
+        raise ValueError(f"No game on {entry['date']} ({entry['day_of_week']})")
+    return game
+
+
+def _apply_edit_game(data, entry):
+    stats.edit_game(data, _find_entry_game(data, entry), **entry['changes'])
+
+
+def _apply_remove_game(data, entry):
+    stats.remove_game(data, _find_entry_game(data, entry))
+
+
+def _apply_update_player(data, entry):
+    data['players'].setdefault(entry['name'], {}).update(entry['fields'])
+    if 'rating' in entry['fields']:
+        ratings.forget(data)     # learned ratings start from the manual ones
+
+
+def _apply_set_teams(data, entry):
+    stats.edit_game(data, _find_entry_game(data, entry), teams=entry['teams'])
+
+
+def _apply_save_teams(data, entry):
+    game = entry['game']
+    data['games'].insert(0, game)
+    for team in game['teams']:
+        # One list per team, shared by its members' past_teams
+        members = list(team)
+        for name in team:
+            data['players'].setdefault(name, {}).setdefault('past_teams', []).append(members)
+    coplay.apply_game(data, game)
+    ratings.apply_game(data, game)
+
+
+_APPLY = {
+    'add_game': _apply_add_game,
+    'edit_game': _apply_edit_game,
+    'remove_game': _apply_remove_game,
+    'update_player': _apply_update_player,
+    'set_teams': _apply_set_teams,
+    'save_teams': _apply_save_teams,
+}
+
+
+def apply_entry(data, entry):
+    """
+    Apply one journal entry to the in-memory data.
+    :param data: The JSON data
+    :param entry: A journal entry dict with an 'op' key
+    """
+    try:
+        apply = _APPLY[entry['op']]
+    except KeyError:
+        raise ValueError(f"Unknown journal operation: {entry.get('op')!r}")
+    apply(data, entry)
+
+
+# ################################ reading and writing ################################ #
+
+def _fsync_dir(path):
+    # Make the rename itself durable; directories can't be opened this way on Windows
+    if os.name != 'posix':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_snapshot(data, snapshot_path):
+    # Write to a temporary file in the same directory, then atomically swap it in
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as write_file:
+        json.dump(data, write_file, ensure_ascii=False, indent=4)
+        write_file.flush()
+        os.fsync(write_file.fileno())
+    os.replace(tmp_path, snapshot_path)
+    _fsync_dir(snapshot_path)
+
+
+def _signature(stat):
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _snapshot_seq(snapshot_path):
+    # journal_seq stored in the snapshot file, parsed again only when the file changed
+    try:
+        signature = _signature(os.stat(snapshot_path))
+    except FileNotFoundError:
+        return 0
+    cached = _snapshot_seqs.get(snapshot_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(snapshot_path, 'r', encoding='utf-8') as read_file:
+        signature = _signature(os.fstat(read_file.fileno()))
+        seq = version(json.load(read_file))
+    _snapshot_seqs[snapshot_path] = (signature, seq)
+    return seq
+
+
+def _read_entries(path):
+    # (complete entries, byte length they take up) of a journal file
+    entries = []
+    good_offset = 0
+    with open(path, 'rb') as journal_file:
+        for line in journal_file:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+            good_offset += len(line)
+    return entries, good_offset
+
+
+def read_journal(snapshot_path, repair=True):
+    """
+    Read all complete entries from the journal.
+    A torn last line (crash in the middle of an append) is cut off so later appends stay valid; only do
+    that (repair=True) while holding the write lock, otherwise it may be another writer's append in flight.
+    :param snapshot_path: Path of the JSON snapshot the journal belongs to
+    :return: List of journal entries, oldest first
+    """
+    path = journal_path(snapshot_path)
+    if not os.path.exists(path):
+        return []
+
+    entries, good_offset = _read_entries(path)
+    if repair and good_offset != os.path.getsize(path):
+        with open(path, 'r+b') as journal_file:
+            journal_file.truncate(good_offset)
+    return entries
+
+
+def load(snapshot_path):
+    """
+    Load the snapshot and replay the journal on top of it.
+    :param snapshot_path: Path of the JSON snapshot
+    :return: The JSON data
+    """
+    # The shared lock keeps a compaction from swapping the snapshot between the two reads
+    with locked(snapshot_path, shared=True):
+        with open(snapshot_path, 'r', encoding='utf-8') as read_file:
+            signature = _signature(os.fstat(read_file.fileno()))
+            data = json.load(read_file)
+        entries = read_journal(snapshot_path, repair=False)
+    models.compact(data)
+
+    snapshot_seq = version(data)
+    _snapshot_seqs[snapshot_path] = (signature, snapshot_seq)
+    _replay(data, entries)
+    _journal_sizes[snapshot_path] = len(entries)
+    return data
+
+
+def _replay(data, entries):
+    for entry in entries:
+        if entry['seq'] > version(data):
+            apply_entry(data, entry)
+            data['journal_seq'] = entry['seq']
+            instrument.count('journal_entries_replayed')
+
+
+def append(entries, snapshot_path):
+    # One line per entry and a single fsync for the batch, before we report success
+    lines = ''.join(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n' for entry in entries)
+    with open(journal_path(snapshot_path), 'a', encoding='utf-8') as journal_file:
+        journal_file.write(lines)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    _journal_sizes[snapshot_path] = _journal_sizes.get(snapshot_path, 0) + len(entries)
+
+
+# ################################ concurrent writers ################################ #
+
+def forget_indexes(data):
+    for module in (stats, attendance, coplay, rollups, ratings, team_cache):
+        module.forget(data)
+    # The name resolver, if anything imported names (it isn't imported here to keep startup cheap)
+    names = sys.modules.get('names')
+    if names is not None:
+        names.forget(data)
+
+
+def catch_up(data, snapshot_path, reload=True):
+    """
+    Bring the data up to date with what other writers stored. Call with the write lock held.
+    :param data: The JSON data (updated in place)
+    :param snapshot_path: Path of the JSON snapshot
+    :param reload: When another writer compacted past our version, reload the data in place (dropping
+                   changes that were never journaled); with reload=False raise ConflictError instead
+    :return: Number of changes picked up
+    """
+    ours = version(data)
+    entries = read_journal(snapshot_path)
+    _journal_sizes[snapshot_path] = len(entries)
+    if _snapshot_seq(snapshot_path) > ours:
+        if not reload:
+            raise ConflictError("The data file was rewritten by another writer; reload and try again",
+                                ours, _snapshot_seq(snapshot_path))
+        with open(snapshot_path, 'r', encoding='utf-8') as read_file:
+            fresh = json.load(read_file)
+        models.compact(fresh)
+        data.clear()
+        data.update(fresh)
+        forget_indexes(data)
+    _replay(data, entries)
+    return version(data) - ours
+
+
+def _check_entry(data, entry):
+    # Conflicts the entry itself can't express: the same game recorded twice by two organizers
+    if entry['op'] in ('add_game', 'save_teams'):
+        game = entry['game']
+        if 'day_of_week' in game and stats.find_game(data, game.get('date'), game['day_of_week']) is not None:
+            raise ConflictError(f"Game on {game.get('date')} ({game['day_of_week']}) is already recorded")
+
+
+def stamp(data, entry):
+    """
+    Check a new entry against the (caught up) data, give it the next sequence number and apply it.
+    Call with the write lock held, and pass the result to flush.
+    :return: The stamped entry
+    """
+    _check_entry(data, entry)
+    entry = {'seq': version(data) + 1, **entry}
+    if entry['op'] == 'remove_game' or (entry['op'] == 'edit_game' and 'players' in entry['changes']):
+        # For the change log: whose counters the change moves (see delta.py)
+        game = stats.find_game(data, entry['date'], entry['day_of_week'])
+        if game is not None:
+            entry['players_before'] = list(game.get('players', []))
+    apply_entry(data, entry)
+    data['journal_seq'] = entry['seq']
+    return entry
+
+
+def flush(data, stamped, snapshot_path):
+    # Append stamped entries (one fsync) and compact if the journal grew large; write lock held
+    if stamped:
+        append(stamped, snapshot_path)
+    if _journal_sizes.get(snapshot_path, 0) >= COMPACT_EVERY:
+        _compact(data, snapshot_path)
+
+
+def commit(data, entries, snapshot_path, expected_version=None):
+    """
+    Apply several entries and append them with one write, under the write lock, after catching up.
+    :param data: The JSON data
+    :param entries: Journal entry dicts with an 'op' key (sequence numbers are assigned here)
+    :param snapshot_path: Path of the JSON snapshot
+    :param expected_version: Optional, the version the changes are based on; ConflictError if the stored
+                             data moved on since (compare-and-swap). None merges with other writers.
+    :return: The new version
+    """
+    with locked(snapshot_path):
+        catch_up(data, snapshot_path)
+        if expected_version is not None and version(data) != expected_version:
+            raise ConflictError(f"Expected version {expected_version}, the data is at version {version(data)}",
+                                expected_version, version(data))
+        stamped = []
+        try:
+            for entry in entries:
+                stamped.append(stamp(data, entry))
+        finally:
+            # Entries applied before a failing one are kept, in memory and on disk alike
+            flush(data, stamped, snapshot_path)
+    return version(data)
+
+
+def record(data, entry, snapshot_path, expected_version=None):
+    """
+    Apply an entry to the data and append it to the journal, compacting when the journal grows large.
+    :param data: The JSON data
+    :param entry: A journal entry dict with an 'op' key (the sequence number is assigned here)
+    :param snapshot_path: Path of the JSON snapshot
+    :param expected_version: Optional, see commit
+    :return: The new version
+    """
+    return commit(data, [entry], snapshot_path, expected_version)
+
+
+def changes_since(snapshot_path, since):
+    """
+    The journal entries after a version, from the change log segments and the journal.
+    :param snapshot_path: Path of the JSON snapshot
+    :param since: A version (journal_seq)
+    :return: Entries with seq > since, oldest first, or None when the change log no longer goes back that far
+    """
+    with locked(snapshot_path, shared=True):
+        sources = [path for last, path in segment_paths(snapshot_path) if last > since]
+        entries = [entry for path in sources for entry in _read_entries(path)[0]]
+        entries += read_journal(snapshot_path, repair=False)
+        current = max(_snapshot_seq(snapshot_path), entries[-1]['seq'] if entries else 0)
+
+    changes, seq = [], since
+    for entry in entries:
+        # Entries at or below the snapshot can repeat after a crash during compaction
+        if entry['seq'] > seq:
+            if entry['seq'] != seq + 1:
+                return None
+            changes.append(entry)
+            seq = entry['seq']
+    return changes if seq == current else None
+
+
+def compact(data, snapshot_path):
+    """
+    Write the data as the new snapshot and drop the journal. Changes other writers journaled meanwhile are
+    merged in first; if another writer compacted meanwhile, ConflictError (our unjournaled changes can't
+    be merged into their snapshot).
+    """
+    with locked(snapshot_path):
+        catch_up(data, snapshot_path, reload=False)
+        _compact(data, snapshot_path)
+
+
+def _compact(data, snapshot_path):
+    # The snapshot records the last folded sequence number, so a crash before the journal is removed
+    # only means those entries get skipped on the next load
+    write_snapshot(data, snapshot_path)
+    _snapshot_seqs[snapshot_path] = (_signature(os.stat(snapshot_path)), version(data))
+    path = journal_path(snapshot_path)
+    if os.path.exists(path):
+        # Keep the journal as a change log segment, and only the newest few of those
+        os.replace(path, f'{os.path.splitext(snapshot_path)[0]}{CHANGES_INFIX}{version(data):010d}.jsonl')
+        for _, segment in segment_paths(snapshot_path)[:-RETAIN_SEGMENTS]:
+            os.remove(segment)
+    _journal_sizes[snapshot_path] = 0
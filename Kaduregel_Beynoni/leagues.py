@@ -0,0 +1,238 @@
+import json
+import os
+from collections import OrderedDict
+
+import journal
+import stats
+
+# Many leagues (groups) side by side, each a shard with its own games, players and indexes.
+#
+# A leagues directory holds one data file per league - '<league>.json' with its journal, or '<league>.db' -
+# so every command works on a single league through main's --league option, and the per-data indexes
+# (stats, coplay, ratings, team_cache, ...) stay per shard. Leagues loads shards lazily and keeps the
+# most recently used ones in memory up to a memory cap, evicting the least recently used shard (and its
+# indexes) beyond it. A shard's weight is an estimate of its data's size in memory (estimated_size), from
+# its record counts; the indexes built on it come on top.
+#
+# Cross-league questions (a player's games everywhere) are answered from per-shard aggregates in
+# 'leagues.json': for each league its version, game count, newest game and each player's counters, with
+# the signature of the shard's files. An aggregate whose files changed since is recomputed by loading
+# that one shard; the rest are read as they are, so a fresh directory answers without loading any shard.
+#
+# The same person can play in several leagues. By default a player's identity is their name; names that
+# differ between leagues are mapped in 'identities.json': {"<league>": {"<name there>": "<identity>"}}.
+
+MANIFEST_FILE = 'leagues.json'
+IDENTITIES_FILE = 'identities.json'
+DEFAULT_DIRECTORY = 'leagues'
+
+# Loaded shards are evicted once their estimated in-memory size adds up to more than this
+MEMORY_CAP = 64 << 20
+
+# Bytes held per record by loaded data (tracemalloc over synthetic leagues, within about 10%): a player
+# with their counters, a name on a game's list, and a game's teams, winner and past_teams entries
+PLAYER_BYTES = 450
+SEAT_BYTES = 35
+TEAMS_BYTES = 1100
+
+SHARD_SUFFIXES = ('.json', '.db', '.sqlite', '.sqlite3')
+
+
+def _is_shard(file_name):
+    if file_name in (MANIFEST_FILE, IDENTITIES_FILE) or not file_name.endswith(SHARD_SUFFIXES):
+        return False
+    # Journals and change log segments belong to a shard
+    return not file_name.endswith(journal.JOURNAL_SUFFIX) and journal.CHANGES_INFIX not in file_name
+
+
+def shard_path(directory, league):
+    """
+    Data file of a league: its existing .db (or .sqlite) file if there is one, otherwise '<league>.json'.
+    """
+    for suffix in SHARD_SUFFIXES[1:]:
+        path = os.path.join(directory, league + suffix)
+        if os.path.exists(path):
+            return path
+    return os.path.join(directory, league + '.json')
+
+
+def estimated_size(data):
+    """
+    Rough size of a league's data in memory, in bytes (see PLAYER_BYTES); one pass over the games.
+    """
+    size = PLAYER_BYTES * len(data['players'])
+    for game in data['games']:
+        size += SEAT_BYTES * len(game.get('players', ()))
+        if game.get('teams'):
+            size += TEAMS_BYTES
+    return size
+
+
+def summarize(data):
+    """
+    The aggregate of one league: version, game count, newest game and each player's counters.
+    """
+    return {
+        'version': journal.version(data),
+        'games': len(data['games']),
+        'last_game': data['games'][0].get('date') if data['games'] else None,
+        'players': {name: [player.get(key, 0) for key in stats.STAT_KEYS]
+                    for name, player in data['players'].items() if player.get('total_games', 0)},
+    }
+
+
+class Leagues:
+    """
+    The leagues in a directory, loaded on demand (see the module comment).
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, memory_cap=MEMORY_CAP):
+        self.directory = directory
+        self.memory_cap = memory_cap
+        # league -> (data, weight), least recently used first
+        self.loaded = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+        self.manifest = self._read_json(MANIFEST_FILE)
+        self._manifest_dirty = False
+        self.identities = self._read_json(IDENTITIES_FILE)
+
+    def _read_json(self, file_name):
+        path = os.path.join(self.directory, file_name)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as read_file:
+            return json.load(read_file)
+
+    def names(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted({os.path.splitext(file_name)[0] for file_name in os.listdir(self.directory)
+                       if _is_shard(file_name)})
+
+    def path(self, league):
+        return shard_path(self.directory, league)
+
+    def create(self, league):
+        # A new, empty league
+        path = self.path(league)
+        if os.path.exists(path):
+            raise ValueError(f"League '{league}' already exists")
+        os.makedirs(self.directory, exist_ok=True)
+        journal.write_snapshot({'games': [], 'players': {}}, path)
+        return path
+
+    # ################################ shards ################################ #
+
+    def data(self, league):
+        """
+        A league's data, loaded on first use; may evict other shards to stay under the memory cap.
+        Changes to it must go through record / commit below (or the storage functions) to be kept.
+        """
+        cached = self.loaded.get(league)
+        if cached is not None:
+            self.loaded.move_to_end(league)
+            return cached[0]
+        path = self.path(league)
+        if not os.path.exists(path):
+            raise KeyError(f"No league '{league}' in {self.directory}")
+        signature = journal.file_signature(path)
+        data = journal.storage_for(path).load(path)
+        self.loads += 1
+        self.loaded[league] = (data, estimated_size(data))
+        self._set_summary(league, data, signature)
+        self._evict(keep=league)
+        return data
+
+    def _evict(self, keep=None):
+        while sum(weight for _, weight in self.loaded.values()) > self.memory_cap:
+            league = next(iter(self.loaded))
+            if league == keep:
+                # The shard in use stays, even on its own over the cap
+                break
+            self.evict(league)
+
+    def evict(self, league):
+        cached = self.loaded.pop(league, None)
+        if cached is not None:
+            # Drop its indexes along with it
+            journal.forget_indexes(cached[0])
+            self.evictions += 1
+
+    def commit(self, league, entries, expected_version=None):
+        """
+        Record changes to a league (see journal.commit) and keep its aggregate current.
+        """
+        data = self.data(league)
+        path = self.path(league)
+        journal.storage_for(path).commit(data, entries, path, expected_version)
+        signature = journal.file_signature(path)
+        self.loaded[league] = (data, estimated_size(data))
+        self._set_summary(league, data, signature)
+        self._evict(keep=league)
+
+    def record(self, league, entry, expected_version=None):
+        self.commit(league, [entry], expected_version)
+
+    def close(self):
+        self.flush()
+        for league in list(self.loaded):
+            self.evict(league)
+
+    # ################################ aggregates ################################ #
+
+    def _set_summary(self, league, data, signature):
+        self.manifest[league] = {'signature': json.loads(json.dumps(signature)), **summarize(data)}
+        self._manifest_dirty = True
+
+    def summary(self, league):
+        """
+        A league's aggregate (see summarize), from the manifest while the shard's files are unchanged.
+        """
+        summary = self.manifest.get(league)
+        # JSON turns the signature's tuples into lists
+        signature = json.loads(json.dumps(journal.file_signature(self.path(league))))
+        if summary is None or summary['signature'] != signature:
+            # Changed by another process (or never summarized): reload it
+            self.evict(league)
+            self.data(league)
+            summary = self.manifest[league]
+        return summary
+
+    def flush(self):
+        # Write the aggregates back, for the next process
+        if self._manifest_dirty:
+            leagues = set(self.names())
+            manifest = {league: summary for league, summary in self.manifest.items() if league in leagues}
+            journal.write_snapshot(manifest, os.path.join(self.directory, MANIFEST_FILE))
+            self._manifest_dirty = False
+
+    def identity(self, league, name):
+        return self.identities.get(league, {}).get(name, name)
+
+    def player_totals(self, identity):
+        """
+        A player's counters in every league they played in.
+        :param identity: The player's identity (their name, unless mapped in identities.json)
+        :return: Dict of league -> {'tuesday_games', ..., 'total_games', 'name'} (the name in that league)
+        """
+        totals = {}
+        for league in self.names():
+            players = self.summary(league)['players']
+            for name, counters in players.items():
+                if self.identity(league, name) == identity:
+                    totals[league] = {**dict(zip(stats.STAT_KEYS, counters)), 'name': name}
+                    break
+        return totals
+
+    def totals(self):
+        """
+        :return: Dict of identity -> counters summed over all leagues (a list in stats.STAT_KEYS order)
+        """
+        totals = {}
+        for league in self.names():
+            for name, counters in self.summary(league)['players'].items():
+                summed = totals.setdefault(self.identity(league, name), [0] * len(stats.STAT_KEYS))
+                for i, count in enumerate(counters):
+                    summed[i] += count
+        return totals
@@ -1,17 +1,30 @@
 import json
+import os
+import sys
 from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
-import random
-from difflib import get_close_matches
 
-with open('soccer_team.json', 'r', encoding='utf-8') as read_file:
-    data = json.load(read_file)
+import attendance
+import balancer
+import coplay
+import instrument
+import journal
+import ratings
+import stats
+import team_cache
 
-# Access players safely
-if 'players' in data:
-    players = data['players']
-else:
-    players = {}
+# Importing this module must stay cheap and side-effect free (the bots import it per message):
+# the data is loaded on first use, and heavier or optional imports (dateutil, argparse, the name
+# resolver, tkinter in gui.py) happen inside the functions that need them. See benchmark.py.
+
+DATA_FILE = 'soccer_team.json'
+
+# Day-of-week codes used by all the prompts and the command line: code -> (day_of_week, stats key)
+DAY_CODES = {
+    'T': ('Tuesday', 'tuesday_games'),
+    'H': ('Thursday', 'thursday_games'),
+    'S': ('Saturday', 'saturday_games'),
+}
+ALL_GAMES_CODE = 'A'
 
 
 # ################################ initial settings and basic functions ################################ #
@@ -47,6 +60,8 @@ def initial_data_json_creation():
 
 # Fill initially all the past games into the JSON (not necessary anymore)
 def auto_fill_data():
+    from dateutil.relativedelta import relativedelta
+
     # Load the existing data from the JSON file
     with open('soccer_team.json', 'r', encoding='utf-8') as read_file:
         existing_data = json.load(read_file)
@@ -106,19 +121,100 @@ def auto_fill_data():
         json.dump(existing_data, auto_fill_write_file, ensure_ascii=False, indent=4)
 
 
-# Load the existing data from the JSON file
+# Load the existing data from the JSON file, replaying any journaled changes on top of it
+@instrument.timed()
 def load_data():
-    # Open the file using 'utf-8' encoding to avoid Unicode errors
-    with open('soccer_team.json', 'r', encoding='utf-8') as read_file:
-        data = json.load(read_file)
-    return data
+    return journal.storage_for(DATA_FILE).load(DATA_FILE)
 
 
-# Save the updated data back to the JSON file
+# Save the full data back to the JSON file (atomically) and fold the journal into it
+@instrument.timed()
 def save_data(data):
-    # Save the updated data back to the file, ensuring 'utf-8' encoding
-    with open('soccer_team.json', 'w', encoding='utf-8') as write_file:
-        json.dump(data, write_file, ensure_ascii=False, indent=4)
+    journal.storage_for(DATA_FILE).compact(data, DATA_FILE)
+    cached = _data_cache.get(DATA_FILE)
+    if cached is not None and cached[1] is data:
+        _data_cache[DATA_FILE] = (journal.file_signature(DATA_FILE), data)
+
+
+# Record a single change without rewriting the whole JSON file
+@instrument.timed()
+def record_change(data, entry):
+    journal.storage_for(DATA_FILE).record(data, entry, DATA_FILE)
+    # Our own write shouldn't make get_data reload the dict it just updated
+    cached = _data_cache.get(DATA_FILE)
+    if cached is not None and cached[1] is data:
+        _data_cache[DATA_FILE] = (journal.file_signature(DATA_FILE), data)
+
+
+# Several changes in one write (one lock and one fsync, or one transaction)
+@instrument.timed()
+def record_changes(data, entries):
+    if not entries:
+        return
+    journal.storage_for(DATA_FILE).commit(data, entries, DATA_FILE)
+    cached = _data_cache.get(DATA_FILE)
+    if cached is not None and cached[1] is data:
+        _data_cache[DATA_FILE] = (journal.file_signature(DATA_FILE), data)
+
+
+# path -> (file signature, data); see get_data
+_data_cache = {}
+
+
+# Shared, cached data for library callers: loaded on first access and reloaded only when the snapshot or
+# journal changed on disk. Changes made through record_change on this dict keep it current.
+def get_data(path=None):
+    path = path or DATA_FILE
+    signature = journal.file_signature(path)
+    cached = _data_cache.get(path)
+    if cached is None or cached[0] != signature:
+        data = journal.storage_for(path).load(path)
+        if cached is not None:
+            # The per-data indexes hold on to the dict being replaced until they forget it
+            journal.forget_indexes(cached[1])
+        _data_cache[path] = (signature, data)
+        return data
+    return cached[1]
+
+
+# Backwards compatible module attributes: main.data / main.players load the data on first access
+def __getattr__(name):
+    if name == 'data':
+        return get_data()
+    if name == 'players':
+        return get_data().get('players', {})
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Match typed/pasted names to the roster. Close typos are fixed automatically. For unknown names,
+# on_unknown decides: 'ask' shows suggestions to pick from (the pick is remembered as an alias) or keeps
+# the name as a new player, 'keep' keeps it as a new player, 'skip' drops it and 'error' raises ValueError.
+# Corrections and skipped names are reported on stderr, so piped output stays clean.
+def resolve_player_names(data, raw_names, on_unknown='ask'):
+    import names
+
+    resolved, notes = names.resolve_names(data, raw_names, on_unknown, _choose_player)
+    for note in notes:
+        if 'resolved' in note:
+            print(f"'{note['name']}' -> {note['resolved']}", file=sys.stderr)
+        else:
+            hint = f" (did you mean: {', '.join(note['suggestions'])}?)" if note['suggestions'] else ''
+            print(f"Unknown player '{note['name']}'{hint}: "
+                  f"{'skipped' if note['action'] == 'skipped' else 'added as new'}", file=sys.stderr)
+    return resolved
+
+
+# The prompt for an unknown name ('ask')
+def _choose_player(raw, suggestions, resolver):
+    print(f"Unknown player '{raw}'. Did you mean:")
+    for i, suggestion in enumerate(suggestions, start=1):
+        print(f"  {i}. {suggestion}")
+    choice = input("Pick a number, type the correct name, or leave empty to add as a new player: ").strip()
+    if choice.isdigit() and 1 <= int(choice) <= len(suggestions):
+        return suggestions[int(choice) - 1]
+    if choice:
+        return resolver.resolve(choice).name or choice
+    return raw.strip()
 
 
 # Ensure all players have the necessary attributes
@@ -132,26 +228,14 @@ def update_player_info(players):
             player_data['past_teams'] = []  # Default past teams
 
 
+# Repair the player stats: counters are normally kept up to date per game by the stats module,
+# this recounts everything from the recorded games
+@instrument.timed()
 def sync_player_stats(data):
-    # Reset all player stats
-    for player in data['players']:
-        data['players'][player]['tuesday_games'] = 0
-        data['players'][player]['thursday_games'] = 0  # נוסיף יום חמישי
-        data['players'][player]['saturday_games'] = 0
-        data['players'][player]['total_games'] = 0
-
-    # Recalculate the stats based on the recorded games
-    for game in data['games']:
-        day_of_week = game['day_of_week']
-        for player_name in game['players']:
-            if player_name in data['players']:
-                if day_of_week == 'Tuesday':
-                    data['players'][player_name]['tuesday_games'] += 1
-                elif day_of_week == 'Thursday':
-                    data['players'][player_name]['thursday_games'] += 1
-                elif day_of_week == 'Saturday':
-                    data['players'][player_name]['saturday_games'] += 1
-                data['players'][player_name]['total_games'] += 1
+    mismatches = stats.verify_stats(data)
+    for player_name, key, stored, expected in mismatches:
+        print(f"Fixing {player_name} {key}: {stored} -> {expected}")
+    stats.rebuild_stats(data)
 
     # Sort players by total_games in descending order
     sorted_players = dict(sorted(data['players'].items(), key=lambda item: item[1]['total_games'], reverse=True))
@@ -212,264 +296,190 @@ def update_player_ratings(data):
             else:
                 print("Please enter 1, 2, 3, or 4.")
 
-        # Update the player data
-        player_data['rating'] = rating
-        player_data['position'] = defense_role
-
-        # Save the updated data back to the JSON file after each update
-        save_data(data)
+        # Update the player data and journal the change right away
+        record_change(data, {'op': 'update_player', 'name': player_name,
+                             'fields': {'rating': rating, 'position': defense_role}})
         print(f"Updated and saved data for player: {player_name}\n")
 
 
 # ################################ specific game helper ################################ #
 
-# A function for adding one specific game into the JSON
-from datetime import datetime
-import json
+# Read names line by line until 'done' (or the end of the input)
+def read_player_names(lines):
+    players = []
+    for line in lines:
+        if line.strip().lower() == 'done':
+            break
+        players.append(line.strip())
+    return players
 
-import json
-from datetime import datetime
 
-import json
-from datetime import datetime
+def _input_lines():
+    while True:
+        try:
+            yield input()
+        except EOFError:
+            return
 
-import json
-from datetime import datetime
 
+# Convert DD.MM.YY to the stored YYYY-MM-DD format (raises ValueError)
+def parse_game_date(text):
+    return datetime.strptime(text.strip(), '%d.%m.%y').strftime('%Y-%m-%d')
 
+
+# Add one game to the data (newest first), update the stats of its players only and journal it
+def record_game(data, date, day_of_week, players):
+    game = {
+        "date": date,
+        "day_of_week": day_of_week,
+        "players": players
+    }
+    record_change(data, {'op': 'add_game', 'game': game})
+    return game
+
+
+# A function for adding one specific game into the JSON
 def add_game():
     # Load the existing data from the JSON file
-    with open('soccer_team.json', 'r', encoding='utf-8') as read_file:
-        data = json.load(read_file)
+    data = load_data()
 
     # Prompt user for game details
-    date = input("Enter the date of the game (DD.MM.YY): ")
-    date = datetime.strptime(date, '%d.%m.%y').strftime('%Y-%m-%d')
+    date = parse_game_date(input("Enter the date of the game (DD.MM.YY): "))
 
     day_of_week_input = input(
         "Enter the day of the week (T for Tuesday, H for Thursday, S for Saturday): ").strip().upper()
-
-    if day_of_week_input == 'T':
-        day_of_week = 'Tuesday'
-        day_key = 'tuesday_games'
-    elif day_of_week_input == 'H':
-        day_of_week = 'Thursday'
-        day_key = 'thursday_games'
-    elif day_of_week_input == 'S':
-        day_of_week = 'Saturday'
-        day_key = 'saturday_games'
-    else:
+    if day_of_week_input not in DAY_CODES:
         print("Invalid input for day of the week. Please enter 'T' for Tuesday, 'H' for Thursday, or 'S' for Saturday.")
         return
+    day_of_week = DAY_CODES[day_of_week_input][0]
 
     print("Enter the player names, each on a new line. Type 'done' when finished:")
-    players = []
-    while True:
-        player = input()
-        if player.strip().lower() == 'done':
-            break
-        players.append(player.strip())
+    players = resolve_player_names(data, read_player_names(_input_lines()))
 
-    # Add the game to the data
-    game = {
-        "date": date,
-        "day_of_week": day_of_week,
-        "players": players
-    }
-    data["games"].insert(0, game)  # Insert at the beginning to keep newest first
-
-    # Ensure every player has 'thursday_games' key
-    for player in data["players"]:
-        if "thursday_games" not in data["players"][player]:
-            data["players"][player]["thursday_games"] = 0
-
-    # Update player statistics
-    for player in players:
-        if player not in data["players"]:
-            data["players"][player] = {
-                "tuesday_games": 0,
-                "thursday_games": 0,  # Ensure new players get Thursday initialized
-                "saturday_games": 0,
-                "total_games": 0
-            }
-
-        # Increase game count for the specific day
-        data["players"][player][day_key] += 1
-        data["players"][player]["total_games"] += 1
-
-    # **🔹 Reorder player data to maintain a fixed order**
-    for player in data["players"]:
-        ordered_data = {
-            "tuesday_games": data["players"][player].get("tuesday_games", 0),
-            "thursday_games": data["players"][player].get("thursday_games", 0),
-            "saturday_games": data["players"][player].get("saturday_games", 0),
-            "total_games": data["players"][player].get("total_games", 0),
-        }
-        # Merge with the rest of the player's data while keeping order
-        for key, value in data["players"][player].items():
-            if key not in ordered_data:
-                ordered_data[key] = value
-        data["players"][player] = ordered_data
+    record_game(data, date, day_of_week, players)
+    print("Game has been added and data has been saved.")
 
-    # Save the updated data back to the JSON file
-    with open('soccer_team.json', 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
 
-    print("Game has been added and data has been saved.")
+# Order a signup list. By default the 13 players with the most games (on that day, then in total) get in
+# first, the next 2 spots go by signup order, and everyone else is on hold, again by games played.
+# See prioritization.py for other scores (e.g. recent attendance) and slot policies.
+@instrument.timed()
+def prioritize_signups(data, players, day_key, score=None, policies=None, explain=False):
+    import prioritization
+
+    score = score or prioritization.LifetimeScore(data, day_key)
+    return prioritization.prioritize(players, score, policies or prioritization.DEFAULT_POLICIES, explain)
+
+
+def print_priority_list(data, final_list, day_key, day_of_week):
+    # Display the sorted player list with the number of games (or, in explain mode, the slot and reason)
+    print(f"Final sorted player list for the game ({day_of_week}):")
+    for i, player in enumerate(final_list, start=1):
+        if isinstance(player, tuple):
+            print(f"{i}. {player.name} - {player.slot}: {player.reason}")
+            continue
+        games_on_day = data["players"].get(player, {}).get(day_key, 0)
+        total_games = data["players"].get(player, {}).get("total_games", 0)
+        print(f"{i}. {player} - {day_key}: {games_on_day}, Total games: {total_games}")
+
+    # Print a clean list of names for easy copying
+    print("\nCopy-paste friendly list of player names:")
+    for player in final_list:
+        print(player.name if isinstance(player, tuple) else player)
+
+
+# Day code (T/H/S/A) -> (day_of_week label, stats key) for sorting
+def priority_day(code):
+    if code == ALL_GAMES_CODE:
+        return 'All Games', 'total_games'
+    return DAY_CODES[code]
 
 
 # A function just for sort players from a list
 def sort_players_only():
     # Load the existing data from the JSON file
-    with open('soccer_team.json', 'r', encoding='utf-8') as read_file:
-        data = json.load(read_file)
+    data = load_data()
 
     # Ask for sorting preference
     day_of_week_input = input(
         "Enter the day of the week (T for Tuesday, H for Thursday, S for Saturday, A for All Games): ").strip().upper()
-    if day_of_week_input == 'T':
-        day_key = 'tuesday_games'
-        day_of_week = 'Tuesday'
-    elif day_of_week_input == 'H':
-        day_key = 'thursday_games'
-        day_of_week = 'Thursday'
-    elif day_of_week_input == 'S':
-        day_key = 'saturday_games'
-        day_of_week = 'Saturday'
-    elif day_of_week_input == 'A':
-        day_key = 'total_games'
-        day_of_week = 'All Games'
-    else:
+    if day_of_week_input not in DAY_CODES and day_of_week_input != ALL_GAMES_CODE:
         print("Invalid input. Please enter 'T' for Tuesday, 'H' for Thursday, 'S' for Saturday, or 'A' for All Games.")
         return
+    day_of_week, day_key = priority_day(day_of_week_input)
 
     print("Enter the player names, each on a new line. Type 'done' when finished:")
-    players = []
-    while True:
-        player = input()
-        if player.strip().lower() == 'done':
-            break
-        players.append(player.strip())
-
-    # Step 1: Sort the entire list based on prioritization rules
-    sorted_players_by_priority = sorted(players, key=lambda p: (
-    -data["players"][p].get(day_key, 0), -data["players"][p]["total_games"]))
-
-    # Step 2: Take the first 13 players from the sorted list
-    first_13_players = sorted_players_by_priority[:13]
-
-    # Step 3: For the next 2 spots, take the first two players based on the original input order
-    remaining_players = sorted_players_by_priority[13:]
-    next_two_spots = []
-    for player in players:
-        if player in remaining_players:
-            next_two_spots.append(player)
-            remaining_players.remove(player)
-            if len(next_two_spots) == 2:
-                break
-
-    # Step 4: Sort remaining players (who are on hold) based on prioritization rules
-    on_hold = sorted(remaining_players,
-                     key=lambda p: (-data["players"][p].get(day_key, 0), -data["players"][p]["total_games"]))
-
-    # Combine the lists for final output
-    final_list = first_13_players + next_two_spots + on_hold
-
-    # Display the sorted player list with the number of games
-    print(f"Final sorted player list for the game ({day_of_week}):")
-    for i, player in enumerate(final_list, start=1):
-        games_on_day = data["players"][player].get(day_key, 0)
-        total_games = data["players"][player]["total_games"]
-        print(f"{i}. {player} - {day_key}: {games_on_day}, Total games: {total_games}")
+    players = resolve_player_names(data, read_player_names(_input_lines()))
 
-    # Print a clean list of names for easy copying
-    print("\nCopy-paste friendly list of player names:")
-    for player in final_list:
-        print(player)
+    print_priority_list(data, prioritize_signups(data, players, day_key), day_key, day_of_week)
 
 
 # Players comparison
 def compare_players(data, player1, player2, day_of_week=None):
     """
     Function to compare two players and get the list of dates where one played and the other did not.
-    :param data: The JSON data
+    :param data: The JSON data, or None to read the data file (a SQLite file is queried instead of loaded)
     :param player1: The first player's name
     :param player2: The second player's name
     :param day_of_week: Optional, specify the day (Tuesday/Saturday)
     :return: Dates where player1 played and player2 did not, and vice versa
     """
-    player1_dates = set(get_player_dates(data, player1, day_of_week))
-    player2_dates = set(get_player_dates(data, player2, day_of_week))
+    dates_of, label = _date_lookup(data)
+    player1_dates = attendance.unique(dates_of(player1, day_of_week))
+    player2_dates = attendance.unique(dates_of(player2, day_of_week))
 
-    # Dates where player1 played and player2 did not
-    player1_only_dates = player1_dates - player2_dates
-    # Dates where player2 played and player1 did not
-    player2_only_dates = player2_dates - player1_dates
+    # Dates where player1 played and player2 did not, and vice versa (one merge over the sorted dates)
+    player1_only_dates, player2_only_dates = attendance.sorted_difference(player1_dates, player2_dates)
 
-    # Sort the lists before returning
-    return (sorted(player1_dates, key=lambda x: datetime.strptime(x, '%d/%m/%y')),
-            sorted(player2_dates, key=lambda x: datetime.strptime(x, '%d/%m/%y')),
-            sorted(player1_only_dates, key=lambda x: datetime.strptime(x, '%d/%m/%y')),
-            sorted(player2_only_dates, key=lambda x: datetime.strptime(x, '%d/%m/%y')))
+    return tuple([label(d) for d in dates]
+                 for dates in (player1_dates, player2_dates, player1_only_dates, player2_only_dates))
 
 
 def get_player_dates(data, player_name, day_of_week=None):
     """
     Function to get the list of dates a player participated.
-    :param data: The JSON data
+    :param data: The JSON data, or None to read the data file (a SQLite file is queried instead of loaded)
     :param player_name: The player's name
     :param day_of_week: Optional, specify the day (Tuesday/Saturday)
     :return: Sorted list of dates in DD/MM/YY format
     """
-    dates = []
-    for game in data['games']:
-        if player_name in game['players'] and (day_of_week is None or game['day_of_week'] == day_of_week):
-            # Convert the date to DD/MM/YY format
-            formatted_date = datetime.strptime(game['date'], '%Y-%m-%d').strftime('%d/%m/%y')
-            dates.append(formatted_date)
-    # Sort dates in ascending order
-    return sorted(dates, key=lambda x: datetime.strptime(x, '%d/%m/%y'))
-
-
-# ################################ teams creation ################################ #
+    dates_of, label = _date_lookup(data)
+    return [label(d) for d in dates_of(player_name, day_of_week)]
 
-# Create balanced teams with goalkeepers
-def create_teams(players, creativity_level=1):
-    goalkeepers = [p for p in players if p['position'] == 'goalkeeper']
-    other_players = [p for p in players if p['position'] != 'goalkeeper']
 
-    # Shuffle to introduce randomness
-    random.shuffle(goalkeepers)
-    random.shuffle(other_players)
+def _date_lookup(data):
+    # (function from player and day to their sorted game day ordinals, ordinal -> 'DD/MM/YY')
+    if data is None and hasattr(journal.storage_for(DATA_FILE), 'player_dates'):
+        # Indexed queries on the SQLite file, without loading the dataset
+        def dates_of(player_name, day_of_week=None):
+            return [datetime.strptime(played, '%Y-%m-%d').toordinal()
+                    for played in journal.storage_for(DATA_FILE).player_dates(DATA_FILE, player_name, day_of_week)]
+        return dates_of, lambda ordinal: datetime.fromordinal(ordinal).strftime('%d/%m/%y')
+    # The attendance index keeps each player's dates sorted, so this is a lookup plus formatting
+    index = attendance.index_for(data if data is not None else get_data())
+    return index.dates, index.label
 
-    # Create initial teams with one goalkeeper each
-    teams = [[], [], []]
-    for i in range(3):
-        if i < len(goalkeepers):
-            teams[i].append(goalkeepers[i])  # Add one goalkeeper to each team
 
-    # Distribute other players among teams
-    for i, player in enumerate(other_players):
-        teams[i % 3].append(player)
-
-    # Adjust for creativity
-    if creativity_level > 1:
-        for team in teams:
-            if random.random() < creativity_level * 0.1:  # Adjust creativity influence here
-                random.shuffle(team)
+# ################################ teams creation ################################ #
 
+# Create balanced teams: goalkeepers and Defensive/Offensive players are spread evenly, rating totals
+# are kept close, and a higher creativity level pushes harder for teammates who haven't played together.
+# With data, players are balanced on the ratings learned from recorded results (see ratings.py).
+@instrument.timed()
+def create_teams(players, creativity_level=1, num_teams=3, data=None, seed=None, learned_ratings=True):
+    teammates = None
+    if data is not None:
+        teammates = coplay.matrix_for(data).teammates_of
+        if learned_ratings:
+            players = ratings.ratings_for(data).rated(players)
+    teams, score = balancer.optimize_teams(players, num_teams=num_teams, seed=seed, teammates=teammates,
+                                           diversity_weight=0.1 * creativity_level)
     return teams
 
 
-# Calculate diversity score
-def calculate_diversity_score(teams, past_teams_data):
-    score = 0
-    for team in teams:
-        for player in team:
-            player_name = player['name']  # Ensure player_name is fetched correctly
-            if player_name in past_teams_data:
-                score += len(set(past_teams_data[player_name]) & set([p['name'] for p in team]))
-    return score
+# Calculate diversity score: how many teammates in each team already played together on a team before
+def calculate_diversity_score(teams, data):
+    return team_cache.diversity(data, teams)
 
 
 # Save game data and update player past teams
@@ -480,18 +490,8 @@ def save_game_data(teams, data):
         "teams": [[player['name'] for player in team] for team in teams]
     }
 
-    # Save the game data to history
-    data['games'].insert(0, game_data)  # Insert at the beginning for newest first
-
-    # Update player past teams
-    for i, team in enumerate(teams):
-        for player in team:
-            if 'past_teams' not in data['players'][player['name']]:
-                data['players'][player['name']]['past_teams'] = []
-            data['players'][player['name']]['past_teams'].append([p['name'] for p in team])
-
-    # Save updated data to file
-    save_data(data)
+    # Save the game data to history (newest first) and update player past teams
+    record_change(data, {'op': 'save_teams', 'game': game_data})
 
 
 # Print the teams
@@ -503,8 +503,46 @@ def print_teams(teams):
         print()
 
 
-# Main function to execute the workflow
-def main(creativity_level=1):
+# Team options for a recorded game, as a list of (teams, score), best first.
+# With candidates > 0, that many seeded team splits are generated on a process pool and the top_k
+# distinct lineups are returned; the same seed always gives the same lineups.
+# learned_ratings=False balances on the hand-entered ratings instead of the ones learned from results.
+# Seeded results are cached per dataset version (team_cache.py), so asking again for the same game is a lookup.
+@instrument.timed()
+def form_teams(data, game, creativity_level=1, candidates=0, top_k=3, workers=None, seed=0, learned_ratings=True):
+    def search():
+        selected_players = team_cache.rated_lineup(data, game['players'], learned_ratings)
+        teammates = coplay.matrix_for(data).teammates_of
+        if candidates:
+            return balancer.generate_lineups(selected_players, candidates=candidates, top_k=top_k, seed=seed,
+                                             workers=workers, teammates=teammates,
+                                             diversity_weight=0.1 * creativity_level)
+        return [balancer.optimize_teams(selected_players, seed=seed, teammates=teammates,
+                                        diversity_weight=0.1 * creativity_level)]
+
+    if seed is None:
+        return search()
+    return team_cache.lineups(data, game['players'], search, diversity_weight=0.1 * creativity_level,
+                              learned_ratings=learned_ratings, candidates=candidates,
+                              top_k=top_k if candidates else 1, seed=seed)
+
+
+# Store the chosen teams on the game
+def assign_teams(data, game, teams):
+    record_change(data, {'op': 'set_teams', 'date': game['date'], 'day_of_week': game['day_of_week'],
+                         'teams': [[player['name'] for player in team] for team in teams]})
+
+
+# Store the result of a game: 'Team N' (as printed by print_teams), an app team name, or 'draw'
+def record_result(data, game, winner):
+    if ratings.winning_team({**game, 'winner': winner}) is None:
+        raise ValueError(f"{winner!r} is not a team of the game on {game['date']} ({game['day_of_week']})")
+    record_change(data, {'op': 'edit_game', 'date': game['date'], 'day_of_week': game['day_of_week'],
+                         'changes': {'winner': winner}})
+
+
+# Main function to execute the workflow (see form_teams for the arguments)
+def main(creativity_level=1, candidates=0, top_k=3, workers=None, seed=0):
     # Load existing data
     data = load_data()
 
@@ -520,22 +558,15 @@ def main(creativity_level=1):
         print("Invalid date format. Please enter the date in DD.MM.YY format.")
         return
 
-    day_of_week_input = input("Enter the day of the week (T for Tuesday, S for Saturday): ").strip().upper()
-
-    if day_of_week_input == 'T':
-        day_of_week = 'Tuesday'
-    elif day_of_week_input == 'S':
-        day_of_week = 'Saturday'
-    else:
-        print("Invalid input for day of the week. Please enter 'T' for Tuesday or 'S' for Saturday.")
+    day_of_week_input = input(
+        "Enter the day of the week (T for Tuesday, H for Thursday, S for Saturday): ").strip().upper()
+    if day_of_week_input not in DAY_CODES:
+        print("Invalid input for day of the week. Please enter 'T' for Tuesday, 'H' for Thursday, or 'S' for Saturday.")
         return
+    day_of_week = DAY_CODES[day_of_week_input][0]
 
     # Check if the game already exists
-    existing_game = None
-    for game in data['games']:
-        if game['date'] == game_date and game['day_of_week'] == day_of_week:
-            existing_game = game
-            break
+    existing_game = stats.find_game(data, game_date, day_of_week)
 
     if existing_game:
         print(f"Game on {game_date} ({day_of_week}) found. Using existing players for team formation.")
@@ -544,58 +575,412 @@ def main(creativity_level=1):
         return
 
     # Generate teams based on existing players
-    selected_players = []
-    for player_name in existing_game['players']:
-        selected_players.append({'name': player_name, **data['players'][player_name]})
-
-    # Generate teams
-    teams = create_teams(selected_players, creativity_level)
+    lineups = form_teams(data, existing_game, creativity_level, candidates, top_k, workers, seed)
+    teams = lineups[0][0]
+    if len(lineups) > 1:
+        for i, (lineup, score) in enumerate(lineups, start=1):
+            print(f"Option {i}: balance {score['balance']:.2f}, positions {score['positions']:.0f}, "
+                  f"diversity {score['diversity']}")
+            print_teams(lineup)
+        choice = input(f"Choose a lineup (1-{len(lineups)}, default 1): ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(lineups):
+            teams = lineups[int(choice) - 1][0]
 
     # Calculate and print diversity score
-    diversity_score = calculate_diversity_score(teams, data['players'])
+    diversity_score = calculate_diversity_score(teams, data)
     print(f"Diversity Score: {diversity_score}")
 
     # Print teams
     print_teams(teams)
 
     # Update the existing game with the new teams
-    existing_game['teams'] = [[player['name'] for player in team] for team in teams]
+    assign_teams(data, existing_game, teams)
 
-    # Save the updated game data back to the JSON file
-    save_data(data)
 
+# ################################ command line ################################ #
 
-# Load existing data
-data = load_data()
+# Split an input stream into blocks (one per matchday), separated by 'done' lines or blank lines
+def read_blocks(lines):
+    block = []
+    for line in lines:
+        line = line.strip()
+        if line and line.lower() != 'done':
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+    if block:
+        yield block
 
-# Run the main function with a specified creativity level
-# main(creativity_level=3)  # Adjust the creativity level as needed
 
+def _open_inputs(paths):
+    if not paths:
+        yield from sys.stdin
+        return
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+            continue
+        with open(path, 'r', encoding='utf-8') as input_file:
+            yield from input_file
 
-import tkinter as tk
-from tkinter import messagebox
 
+# 'DD.MM.YY T' -> ('YYYY-MM-DD', 'Tuesday')
+def parse_game_header(line):
+    parts = line.split()
+    if len(parts) != 2 or parts[1].upper() not in DAY_CODES:
+        raise ValueError(f"Expected 'DD.MM.YY T|H|S', got {line!r}")
+    return parse_game_date(parts[0]), DAY_CODES[parts[1].upper()][0]
 
-def show_players():
-    messagebox.showinfo("Info", "Showing players...")
 
+def command_prioritize(args):
+    import prioritization
 
-def prioritize_players():
-    messagebox.showinfo("Info", "Prioritizing players...")
+    data = load_data()
+    day_of_week, day_key = priority_day(args.day.upper())
+    policies = (prioritization.CoreSlots(args.core), prioritization.FirstComeSlots(args.first_come),
+                prioritization.Waitlist())
+    score = None
+    if args.recent_weeks:
+        score = prioritization.RecencyScore(data, None if day_key == 'total_games' else day_of_week,
+                                            weeks=args.recent_weeks, half_life_weeks=args.half_life,
+                                            day_key=day_key)
+    for block in read_blocks(_open_inputs(args.files)):
+        players = resolve_player_names(data, block, args.unknown)
+        final_list = prioritize_signups(data, players, day_key, score, policies, args.explain)
+        print_priority_list(data, final_list, day_key, day_of_week)
+        print()
 
 
-def add_new_game():
-    messagebox.showinfo("Info", "Adding new game...")
+def command_add_game(args):
+    data = load_data()
+    added = 0
+    for block in read_blocks(_open_inputs(args.files)):
+        date, day_of_week = parse_game_header(block[0])
+        if stats.find_game(data, date, day_of_week) is not None:
+            print(f"Game on {date} ({day_of_week}) already recorded, skipping.", file=sys.stderr)
+            continue
+        try:
+            record_game(data, date, day_of_week, resolve_player_names(data, block[1:], args.unknown))
+        except journal.ConflictError as error:
+            # Another organizer recorded it in the meantime
+            print(f"{error}, skipping.", file=sys.stderr)
+            continue
+        added += 1
+    print(f"Added {added} games.")
 
 
-def view_calendar():
-    messagebox.showinfo("Info", "Viewing calendar...")
+def command_import(args):
+    import importer
 
+    data = load_data()
+    counts = {}
+    entries = []
+    for path in args.files or ['-']:
+        file_format = args.format or importer.detect_format(path)
+        games = importer.read_games(importer.open_lines(path), file_format, args.month_first)
+        entries += importer.game_entries(data, games, args.unknown, counts)
+    if args.dry_run:
+        for entry in entries:
+            game = entry['game']
+            print(f"{game['date']} ({game['day_of_week']}): {', '.join(game['players'])}")
+    else:
+        # One write for the whole import; if another organizer recorded one of these games meanwhile,
+        # the ConflictError stops it at that game
+        record_changes(data, entries)
+    print(f"{'Would import' if args.dry_run else 'Imported'} {len(entries)} games "
+          f"({counts.get('duplicates', 0)} already recorded, {counts.get('unknown', 0)} unknown names).")
 
-# add_game()
 
-sort_players_only()
+def command_make_teams(args):
+    data = load_data()
+    update_player_info(data['players'])
+    lines = args.games or _open_inputs(args.files)
+    for line in lines:
+        if not line.strip() or line.strip().lower() == 'done':
+            continue
+        date, day_of_week = parse_game_header(line)
+        game = stats.find_game(data, date, day_of_week)
+        if game is None:
+            print(f"No game found on {date} ({day_of_week}), skipping.", file=sys.stderr)
+            continue
+        lineups = form_teams(data, game, args.creativity, args.candidates, args.top_k, args.workers, args.seed,
+                             not args.manual_ratings)
+        print(f"{date} ({day_of_week}):")
+        for i, (teams, score) in enumerate(lineups, start=1):
+            print(f"Option {i}: balance {score['balance']:.2f}, positions {score['positions']:.0f}, "
+                  f"diversity {score['diversity']}")
+            print_teams(teams)
+        if args.save:
+            assign_teams(data, game, lineups[0][0])
+
+
+def command_most_played(args):
+    import rollups
+
+    data = load_data()
+    day_of_week = DAY_CODES[args.day][0] if args.day != ALL_GAMES_CODE else None
+    since = datetime.strptime(parse_game_date(args.since), '%Y-%m-%d').date()
+    until = datetime.strptime(parse_game_date(args.until), '%Y-%m-%d').date() if args.until else None
+    granularity = 'week' if args.weeks else 'month'
+    rollup = rollups.rollups_for(data)
+    for i, (name, games) in enumerate(rollup.most_played(since, until, day_of_week, args.limit, granularity), start=1):
+        current, longest = rollup.streak(name, day_of_week)
+        print(f"{i}. {name} - {games} games (streak {current}, longest {longest})")
+
+
+def command_dates(args):
+    day_of_week = DAY_CODES[args.day][0] if args.day != ALL_GAMES_CODE else None
+    if len(args.players) == 1:
+        dates = get_player_dates(None, args.players[0], day_of_week)
+        print(f"{args.players[0]} - {len(dates)} games: {', '.join(dates)}")
+        return
+    if len(args.players) != 2:
+        raise ValueError("Give one player, or two to compare")
+    player1, player2 = args.players
+    _, _, player1_only, player2_only = compare_players(None, player1, player2, day_of_week)
+    print(f"{player1} without {player2}: {', '.join(player1_only)}")
+    print(f"{player2} without {player1}: {', '.join(player2_only)}")
+
+
+def command_result(args):
+    data = load_data()
+    date, day_of_week = parse_game_header(args.game)
+    game = stats.find_game(data, date, day_of_week)
+    if game is None:
+        raise ValueError(f"No game found on {date} ({day_of_week})")
+    winner = f"Team {args.winner}" if args.winner.isdigit() else args.winner
+    record_result(data, game, winner)
+    print(f"{date} ({day_of_week}): winner {winner}")
+
+
+def command_ratings(args):
+    data = load_data()
+    engine = ratings.ratings_for(data)
+    print(f"Ratings learned from {engine.games} games with a result:")
+    learned = sorted(engine.ratings().items(), key=lambda item: -item[1])
+    for name, rating in learned[:args.limit or None]:
+        manual = data['players'][name].get('rating', 3.0)
+        print(f"  {name}: {rating:.2f} (manual {manual})")
+
+
+def command_simulate(args):
+    import simulation
 
-# sync_player_stats(data)
+    reports = simulation.sweep(load_data(), cores=args.core, first_comes=args.first_come, scores=args.score,
+                               teams=args.teams, seasons=args.seasons, seed=args.seed, workers=args.workers,
+                               demand=args.demand, weeks=args.weeks)
+    simulation.print_report(reports)
 
-# update_player_info(players)
+
+def command_serve(args):
+    import service
+
+    service.serve(DATA_FILE, args.host, args.port)
+
+
+def command_sync(args):
+    sync_player_stats(load_data())
+
+
+def command_export_delta(args):
+    import delta
+
+    storage = journal.storage_for(DATA_FILE)
+    bundle = delta.local_fetch(DATA_FILE, storage)(args.since)
+    size = delta.write_bundle(bundle, args.output)
+    print(f"Wrote a {bundle['format']} bundle ({bundle.get('base', '-')} -> {bundle['version']}, "
+          f"{size} bytes) to {args.output}")
+
+
+def command_sync_client(args):
+    import delta
+
+    client = delta.FileClient(args.client)
+    before = client.version
+    bundle = client.pull(delta.local_fetch(DATA_FILE, journal.storage_for(DATA_FILE)))
+    print(f"{args.client}: version {before} -> {client.version} ({bundle['format']}, "
+          f"{delta.bundle_size(bundle)} bytes)")
+
+
+def command_leagues(args):
+    import leagues
+
+    shards = leagues.Leagues(args.leagues)
+    try:
+        if args.create:
+            print(f"Created {shards.create(args.create)}")
+            return
+        if args.player:
+            totals = shards.player_totals(args.player)
+            for league, counters in totals.items():
+                name = f" (as {counters['name']})" if counters['name'] != args.player else ''
+                print(f"{league}: {counters['total_games']} games{name}")
+            print(f"{args.player}: {sum(counters['total_games'] for counters in totals.values())} games "
+                  f"in {len(totals)} leagues")
+            return
+        if args.top:
+            ranked = sorted(shards.totals().items(), key=lambda item: (-item[1][-1], item[0]))
+            for identity, counters in ranked[:args.top]:
+                print(f"{identity}: {counters[-1]} games")
+            return
+        for league in shards.names():
+            summary = shards.summary(league)
+            print(f"{league}: {summary['games']} games, {len(summary['players'])} players, "
+                  f"last game {summary['last_game'] or '-'}, version {summary['version']}")
+    finally:
+        shards.close()
+
+
+def command_convert(args):
+    # Read with the source's backend and write the whole dataset in the target's format
+    data = journal.storage_for(args.source).load(args.source)
+    target = journal.storage_for(args.target)
+    if target is journal:
+        journal.write_snapshot(data, args.target)
+    else:
+        target.write(data, args.target)
+    print(f"Converted {args.source} -> {args.target}")
+
+
+def build_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Kaduregel Beynoni - signups, games and teams.")
+    parser.add_argument('--data', help=f"data file, .json, .db or a read-only .kbs (default: {DATA_FILE})")
+    parser.add_argument('--league', help="work on this league of the leagues directory instead of --data")
+    parser.add_argument('--leagues', default='leagues', help="leagues directory (default: leagues)")
+    parser.add_argument('--report', help=f"write a JSON timing report for this run (or set {instrument.REPORT_ENV})")
+    parser.add_argument('--profile', action='store_true', help="add cProfile results to the report")
+    parser.add_argument('--trace-memory', action='store_true', help="add tracemalloc results to the report")
+    subparsers = parser.add_subparsers(dest='command')
+    unknown_help = "what to do with names not on the roster (default: error)"
+
+    prioritize = subparsers.add_parser('prioritize', help="order signup lists (one list per block)")
+    prioritize.add_argument('--day', required=True, choices=[*DAY_CODES, ALL_GAMES_CODE],
+                            type=str.upper, help="T, H, S or A for all games")
+    prioritize.add_argument('--unknown', choices=['keep', 'skip', 'error'], default='error', help=unknown_help)
+    prioritize.add_argument('--core', type=int, default=13, help="slots by games played (default: 13)")
+    prioritize.add_argument('--first-come', type=int, default=2, help="slots by signup order (default: 2)")
+    prioritize.add_argument('--recent-weeks', type=int, default=0,
+                            help="rank by attendance over the last N weeks instead of lifetime counters")
+    prioritize.add_argument('--half-life', type=float, default=4.0, help="weeks for a game's weight to halve")
+    prioritize.add_argument('--explain', action='store_true', help="show why each player got their spot")
+    prioritize.add_argument('files', nargs='*', help="input files (default: stdin)")
+    prioritize.set_defaults(func=command_prioritize)
+
+    add = subparsers.add_parser('add-game', help="record games: a 'DD.MM.YY T|H|S' line, then the players")
+    add.add_argument('--unknown', choices=['keep', 'skip', 'error'], default='error', help=unknown_help)
+    add.add_argument('files', nargs='*', help="input files (default: stdin)")
+    add.set_defaults(func=command_add_game)
+
+    bulk = subparsers.add_parser('import', help="import game history from WhatsApp chat exports or CSV files")
+    bulk.add_argument('--format', choices=['chat', 'csv'], help="default: csv for .csv files, chat otherwise")
+    bulk.add_argument('--unknown', choices=['keep', 'skip', 'error'], default='error', help=unknown_help)
+    bulk.add_argument('--month-first', action='store_true', help="chat timestamps are M/D/Y")
+    bulk.add_argument('--dry-run', action='store_true', help="list the games without recording them")
+    bulk.add_argument('files', nargs='*', help="input files (default: stdin)")
+    bulk.set_defaults(func=command_import)
+
+    teams = subparsers.add_parser('make-teams', help="make teams for recorded games ('DD.MM.YY T|H|S' lines)")
+    teams.add_argument('--game', dest='games', action='append', help="'DD.MM.YY T|H|S' (repeatable)")
+    teams.add_argument('--creativity', type=int, default=1)
+    teams.add_argument('--candidates', type=int, default=0, help="number of splits to search in parallel")
+    teams.add_argument('--top-k', type=int, default=3)
+    teams.add_argument('--workers', type=int, default=None)
+    teams.add_argument('--seed', type=int, default=0)
+    teams.add_argument('--save', action='store_true', help="store the best lineup on the game")
+    teams.add_argument('--manual-ratings', action='store_true',
+                       help="balance on the entered ratings instead of the ones learned from results")
+    teams.add_argument('files', nargs='*', help="input files (default: stdin)")
+    teams.set_defaults(func=command_make_teams)
+
+    most = subparsers.add_parser('most-played', help="players with the most games since a date")
+    most.add_argument('--day', choices=[*DAY_CODES, ALL_GAMES_CODE], default=ALL_GAMES_CODE, type=str.upper)
+    most.add_argument('--since', required=True, help="DD.MM.YY, rounded down to the start of its month")
+    most.add_argument('--until', help="DD.MM.YY (default: the latest game)")
+    most.add_argument('--weeks', action='store_true', help="count by week instead of by month")
+    most.add_argument('--limit', type=int, default=10)
+    most.set_defaults(func=command_most_played)
+
+    dates = subparsers.add_parser('dates', help="a player's game dates, or the dates only one of two played")
+    dates.add_argument('players', nargs='+', help="one player, or two to compare")
+    dates.add_argument('--day', choices=[*DAY_CODES, ALL_GAMES_CODE], default=ALL_GAMES_CODE, type=str.upper)
+    dates.set_defaults(func=command_dates)
+
+    result = subparsers.add_parser('result', help="record the winner of a game")
+    result.add_argument('--game', required=True, help="'DD.MM.YY T|H|S'")
+    result.add_argument('--winner', required=True, help="team number (as printed), team name or 'draw'")
+    result.set_defaults(func=command_result)
+
+    rated = subparsers.add_parser('ratings', help="show the ratings learned from game results")
+    rated.add_argument('--limit', type=int, default=0)
+    rated.set_defaults(func=command_ratings)
+
+    simulate = subparsers.add_parser('simulate', help="compare signup and team policies over simulated seasons")
+    simulate.add_argument('--core', type=int, nargs='+', default=[13], help="core slot counts to try")
+    simulate.add_argument('--first-come', type=int, nargs='+', default=[2], help="first-come slot counts to try")
+    simulate.add_argument('--score', nargs='+', default=['day'], choices=['day', 'total', 'recency'])
+    simulate.add_argument('--teams', nargs='+', default=['snake'], choices=['snake', 'random', 'balanced'])
+    simulate.add_argument('--seasons', type=int, default=200)
+    simulate.add_argument('--demand', type=float, default=1.3, help="signups relative to past attendance")
+    simulate.add_argument('--weeks', type=int, default=52, help="weeks of history to fit the seasons to")
+    simulate.add_argument('--workers', type=int, default=None)
+    simulate.add_argument('--seed', type=int, default=0)
+    simulate.set_defaults(func=command_simulate)
+
+    serve = subparsers.add_parser('serve', help="run the local HTTP service (see service.py)")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.set_defaults(func=command_serve)
+
+    sync = subparsers.add_parser('sync', help="recount player stats from the recorded games")
+    sync.set_defaults(func=command_sync)
+
+    export = subparsers.add_parser('export-delta', help="write the changes since a version as a bundle (see delta.py)")
+    export.add_argument('--since', type=int, required=True, help="the client's version (journal_seq)")
+    export.add_argument('-o', '--output', default='delta.json', help="bundle file, gzipped if it ends in .gz")
+    export.set_defaults(func=command_export_delta)
+
+    client = subparsers.add_parser('sync-client', help="bring a client copy of the data up to date")
+    client.add_argument('client', help="the client's JSON file (created on the first sync)")
+    client.set_defaults(func=command_sync_client)
+
+    shards = subparsers.add_parser('leagues', help="list the leagues, or a player's games across all of them")
+    shards.add_argument('--player', help="a player's games in every league (name or shared identity)")
+    shards.add_argument('--top', type=int, default=0, help="the players with the most games over all leagues")
+    shards.add_argument('--create', help="add a new, empty league")
+    shards.set_defaults(func=command_leagues)
+
+    convert = subparsers.add_parser('convert', help="convert between the JSON snapshot, the binary (.kbs) "
+                                                    "snapshot and a SQLite database (.db)")
+    convert.add_argument('source', help="a .json snapshot (with its journal), a .kbs or a .db file")
+    convert.add_argument('target')
+    convert.set_defaults(func=command_convert)
+    return parser
+
+
+def cli(argv=None):
+    global DATA_FILE
+    args = build_parser().parse_args(argv)
+    if args.data:
+        DATA_FILE = args.data
+    if args.league:
+        import leagues
+
+        DATA_FILE = leagues.shard_path(args.leagues, args.league)
+    instrument.start_report(args.report, args.command or 'sort', args.profile, args.trace_memory)
+    try:
+        if args.command is None:
+            # No subcommand: the interactive signup sorter, as before
+            sort_players_only()
+            return
+        args.func(args)
+    except ValueError as error:
+        sys.exit(f"Error: {error}")
+    finally:
+        instrument.finish_report()
+
+
+if __name__ == '__main__':
+    cli()
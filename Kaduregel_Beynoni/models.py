@@ -0,0 +1,73 @@
+import sys
+
+from coplay import team_members
+
+# Compact player records on the JSON data, which is the one in-memory representation of the league.
+#
+# In the JSON data every name is a fresh string per occurrence, and 'past_teams' holds a fresh copy of the
+# whole team for every member of every saved team, so it grows by team_size^2 names per game. compact(data)
+# shares them in place (interned names, one list per distinct past team) and is applied on every load;
+# lineup() builds the slim player dicts the balancer needs instead of copying whole player records.
+# There are no typed (slotted) Player/Game records: stats, the journal, both storage backends and the
+# indexes all work on the dicts. Integer player ids and same-team pair counts live in the co-play matrix
+# (coplay.AttendanceMatrix), which is what the balancer's diversity term reads; past_teams itself is only
+# carried along for the file format.
+
+DEFAULT_RATING = 3.0
+DEFAULT_POSITION = 'both'
+
+
+def _names(value):
+    return isinstance(value, list) and all(isinstance(name, str) for name in value)
+
+
+def _name_lists(value):
+    return isinstance(value, list) and all(_names(team) for team in value)
+
+
+def compact(data):
+    """
+    Share what the JSON parser duplicated, in place: names become interned strings and equal past teams
+    a single list. The data reads and serializes exactly as before.
+    :param data: The JSON data
+    """
+    intern = sys.intern
+    players = data.get('players', {})
+    for name in players:
+        intern(name)
+    shared = {}
+    for fields in players.values():
+        past_teams = fields.get('past_teams')
+        if not _name_lists(past_teams):
+            continue
+        for i, team in enumerate(past_teams):
+            key = tuple(team)
+            members = shared.get(key)
+            if members is None:
+                members = shared[key] = [intern(name) for name in team]
+            past_teams[i] = members
+    for game in data.get('games', []):
+        names = game.get('players')
+        if _names(names):
+            game['players'] = [intern(name) for name in names]
+        for team in game.get('teams') or []:
+            members = team_members(team)
+            if _names(members):
+                members[:] = [intern(name) for name in members]
+
+
+def lineup(data, names, engine=None):
+    """
+    Player dicts for the balancer: just name, rating and position, without copying whole player records.
+    :param data: The JSON data
+    :param names: Player names
+    :param engine: Optional ratings.RatingEngine, to use learned ratings instead of the hand-entered ones
+    :return: List of {'name', 'rating', 'position'} dicts
+    """
+    players = data['players']
+    result = []
+    for name in names:
+        player = players.get(name, {})
+        rating = round(engine.rating(name), 2) if engine is not None else player.get('rating', DEFAULT_RATING)
+        result.append({'name': name, 'rating': rating, 'position': player.get('position', DEFAULT_POSITION)})
+    return result
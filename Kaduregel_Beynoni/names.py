@@ -0,0 +1,233 @@
+import heapq
+import json
+import os
+import re
+import unicodedata
+from collections import Counter, namedtuple
+from difflib import SequenceMatcher
+
+import journal
+
+# Player name resolution for names pasted from WhatsApp.
+#
+# Names are normalized (niqqud and direction marks removed, final letters mapped to their regular form,
+# geresh/apostrophe variants unified, list numbering and emoji stripped, whitespace collapsed), then
+# looked up exactly, then in the alias table, and only then fuzzily: a trigram index narrows the roster
+# to a handful of candidates, which are ranked with difflib. A pasted name never raises; it either
+# resolves to a roster name or comes back with ranked suggestions.
+
+ALIASES_FILE = 'name_aliases.json'
+
+# Accept a fuzzy match on its own only when it is this close and clearly ahead of the runner-up
+AUTO_ACCEPT_RATIO = 0.85
+AUTO_ACCEPT_MARGIN = 0.1
+
+FINAL_LETTERS = str.maketrans({'ך': 'כ', 'ם': 'מ', 'ן': 'נ', 'ף': 'פ', 'ץ': 'צ'})
+GERESH = str.maketrans({"'": '׳', '’': '׳', '`': '׳', '״': '׳׳', '"': '׳׳'})
+_LIST_PREFIX = re.compile(r'^\s*(?:\d+\s*[.)\-:]?|[-*•])\s*')
+
+# name: the roster name (None when unresolved); how: 'exact', 'alias', 'fuzzy' or None;
+# suggestions: ranked roster names when the name wasn't resolved
+Resolution = namedtuple('Resolution', ['raw', 'name', 'how', 'suggestions'])
+
+
+def normalize(name):
+    name = _LIST_PREFIX.sub('', unicodedata.normalize('NFKC', name))
+    kept = []
+    for char in name:
+        category = unicodedata.category(char)
+        if category == 'Mn' or category == 'Cf':      # niqqud, cantillation, RTL/LTR marks
+            continue
+        if category.startswith(('L', 'N')) or char in "'’`׳״\"":
+            kept.append(char)
+        else:                                          # punctuation, emoji, whitespace
+            kept.append(' ')
+    name = ''.join(kept).translate(FINAL_LETTERS).translate(GERESH).casefold()
+    return ' '.join(name.split())
+
+
+def clean_name(raw):
+    # A pasted name as it is kept for a new player: list numbering or bullet and direction marks dropped,
+    # whitespace collapsed (like the importer's new players)
+    return ' '.join(_LIST_PREFIX.sub('', raw.replace('\u200e', '').replace('\u200f', '')).split())
+
+
+def trigrams(normalized):
+    padded = f'  {normalized} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameResolver:
+    def __init__(self, roster, aliases=None):
+        """
+        :param roster: Iterable of player names (e.g. data['players'])
+        :param aliases: Optional, dict of normalized pasted name -> roster name
+        """
+        self.names = []
+        self.keys = []           # normalized form of each roster name
+        self.gram_counts = []    # number of trigrams of each roster name
+        self.exact = {}
+        self.index = {}          # trigram -> list of roster positions
+        self.aliases = dict(aliases or {})
+        for name in roster:
+            self.add_name(name)
+
+    def add_name(self, name):
+        key = normalize(name)
+        if key in self.exact:
+            return
+        position = len(self.names)
+        self.names.append(name)
+        self.keys.append(key)
+        self.exact[key] = position
+        grams = trigrams(key)
+        self.gram_counts.append(len(grams))
+        for gram in grams:
+            self.index.setdefault(gram, []).append(position)
+
+    def learn(self, raw, name):
+        # Remember a manual correction so the same spelling resolves directly next time
+        self.aliases[normalize(raw)] = name
+
+    @staticmethod
+    def similarity(matcher, candidate):
+        # Whole-string similarity, or a slightly discounted match against a single word of the name,
+        # so 'אורי' ranks 'אורי תור' above 'אור'. The matcher already holds the pasted name as seq2.
+        matcher.set_seq1(candidate)
+        ratio = matcher.ratio()
+        words = candidate.split()
+        if len(words) > 1:
+            for word in words:
+                matcher.set_seq1(word)
+                if matcher.real_quick_ratio() * 0.95 > ratio:
+                    ratio = max(ratio, 0.95 * matcher.ratio())
+        return ratio
+
+    def suggestions(self, raw, limit=5):
+        key = normalize(raw)
+        grams = trigrams(key)
+        overlap = Counter()
+        for gram in grams:
+            overlap.update(self.index.get(gram, ()))
+        # Shortlist by trigram similarity (Dice), then rank only the shortlist properly
+        dice = {position: 2 * shared / (len(grams) + self.gram_counts[position])
+                for position, shared in overlap.items()}
+        shortlist = heapq.nlargest(limit * 2, dice, key=dice.__getitem__)
+        matcher = SequenceMatcher(None, b=key)
+        scored = [(self.similarity(matcher, self.keys[p]), self.names[p]) for p in shortlist]
+        scored.sort(key=lambda item: -item[0])
+        return scored[:limit]
+
+    def resolve(self, raw):
+        """
+        :param raw: A name as typed or pasted
+        :return: Resolution
+        """
+        key = normalize(raw)
+        if key in self.exact:
+            return Resolution(raw, self.names[self.exact[key]], 'exact', [])
+        if key in self.aliases:
+            return Resolution(raw, self.aliases[key], 'alias', [])
+
+        scored = self.suggestions(raw)
+        if scored:
+            best_ratio = scored[0][0]
+            runner_up = scored[1][0] if len(scored) > 1 else 0.0
+            if best_ratio >= AUTO_ACCEPT_RATIO and best_ratio - runner_up >= AUTO_ACCEPT_MARGIN:
+                return Resolution(raw, scored[0][1], 'fuzzy', [])
+        return Resolution(raw, None, None, [name for _, name in scored])
+
+
+# ################################ alias table ################################ #
+
+def load_aliases(path=ALIASES_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as read_file:
+        return json.load(read_file)
+
+
+def save_aliases(aliases, path=ALIASES_FILE):
+    journal.write_snapshot(aliases, path)
+
+
+# ################################ resolving lists ################################ #
+
+# id(data) -> (data, (version, roster size, alias file signature), NameResolver); the data reference keeps
+# the id from being reused. Building a resolver indexes the whole roster, so it is kept until the roster
+# or the alias table changes.
+_resolvers = {}
+
+
+def _alias_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _resolver_key(data, aliases_path):
+    return journal.version(data), len(data['players']), _alias_signature(aliases_path)
+
+
+def resolver_for(data, aliases_path=ALIASES_FILE):
+    # The data's NameResolver, rebuilt only when its version, its roster size or the alias file changed
+    key = _resolver_key(data, aliases_path)
+    cached = _resolvers.get(id(data))
+    if cached is None or cached[0] is not data or cached[1] != key:
+        cached = _resolvers[id(data)] = (data, key, NameResolver(data['players'], load_aliases(aliases_path)))
+    return cached[2]
+
+
+def forget(data):
+    _resolvers.pop(id(data), None)
+
+
+def resolve_names(data, raw_names, on_unknown='error', choose=None, aliases_path=ALIASES_FILE):
+    """
+    Match a list of typed/pasted names to the roster.
+    :param data: The JSON data
+    :param raw_names: Names as typed or pasted; blanks (and anything that isn't a string) are ignored
+    :param on_unknown: Names that don't resolve: 'keep' (new player), 'skip', 'error' (ValueError) or 'ask'
+    :param choose: For 'ask': function (raw name, suggestions, resolver) -> the name to use; a pick from the
+                   roster is remembered as an alias
+    :param aliases_path: The alias table
+    :return: (resolved names without repeats, notes) where notes are dicts {'name', 'resolved'} for fuzzy
+             matches and {'name', 'suggestions', 'action'} for unknown names that were kept or skipped
+    """
+    resolver = resolver_for(data, aliases_path)
+    learned = False
+    resolved, notes, seen = [], [], set()
+    for raw in raw_names:
+        if not isinstance(raw, str) or not normalize(raw):
+            continue
+        result = resolver.resolve(raw)
+        name = result.name
+        if result.how == 'fuzzy':
+            notes.append({'name': raw, 'resolved': name})
+        elif name is None and on_unknown == 'ask':
+            name = choose(raw, result.suggestions, resolver)
+            if name in data['players']:
+                resolver.learn(raw, name)
+                learned = True
+            else:
+                name = clean_name(name)
+        elif name is None:
+            hint = f" (did you mean: {', '.join(result.suggestions)}?)" if result.suggestions else ''
+            if on_unknown == 'error':
+                raise ValueError(f"Unknown player '{raw}'{hint}")
+            notes.append({'name': raw, 'suggestions': result.suggestions,
+                          'action': 'skipped' if on_unknown == 'skip' else 'added'})
+            if on_unknown == 'skip':
+                continue
+            name = clean_name(raw)
+        if name not in seen:
+            seen.add(name)
+            resolved.append(name)
+
+    if learned:
+        save_aliases(resolver.aliases, aliases_path)
+        # Our own write doesn't make the resolver stale
+        _resolvers[id(data)] = (data, _resolver_key(data, aliases_path), resolver)
+    return resolved, notes
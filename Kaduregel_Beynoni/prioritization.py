@@ -0,0 +1,150 @@
+import heapq
+from collections import namedtuple
+from datetime import date
+
+import attendance
+import instrument
+
+# Signup prioritization engine.
+#
+# A signup list is ranked once by a score (lifetime counters, or attendance over recent weeks) and
+# then handed to a sequence of slot policies, each taking players from what is left:
+#   CoreSlots(n)       - the n best-ranked players
+#   FirstComeSlots(n)  - the next n players in signup order
+#   Waitlist()         - everyone else, best-ranked first
+# Ranking is one heap over the signups (lazy deletion of players already placed), so a list of n
+# players costs O(n log n) no matter how many policies run.
+
+# slot: label of the policy that placed the player; reason: why, for explain mode
+Placement = namedtuple('Placement', ['name', 'slot', 'reason'])
+
+
+# ################################ scores ################################ #
+
+class LifetimeScore:
+    """Games played on the day (day_key counter), then total games - the classic ordering."""
+
+    def __init__(self, data, day_key):
+        self.players = data['players']
+        self.day_key = day_key
+
+    def key(self, name):
+        stats = self.players.get(name, {})
+        return -stats.get(self.day_key, 0), -stats.get('total_games', 0)
+
+    def describe(self, name):
+        stats = self.players.get(name, {})
+        return f"{self.day_key}: {stats.get(self.day_key, 0)}, total games: {stats.get('total_games', 0)}"
+
+
+class RecencyScore:
+    """
+    Attendance over the last `weeks` weeks, each game weighted by 0.5 ** (age / half_life_weeks),
+    computed from the recorded games through the attendance index. Ties fall back to lifetime counters.
+    """
+
+    def __init__(self, data, day_of_week=None, weeks=12, half_life_weeks=4.0, as_of=None, day_key='total_games'):
+        self.index = attendance.index_for(data)
+        self.lifetime = LifetimeScore(data, day_key)
+        self.day_of_week = day_of_week
+        self.as_of = as_of or date.today()
+        self.start = date.fromordinal(self.as_of.toordinal() - 7 * weeks)
+        self.half_life_days = 7 * half_life_weeks
+        self._scores = {}
+
+    def score(self, name):
+        value = self._scores.get(name)
+        if value is None:
+            end = self.as_of.toordinal()
+            value = sum(0.5 ** ((end - ordinal) / self.half_life_days)
+                        for ordinal in self.index.between(name, self.start, self.as_of, self.day_of_week))
+            self._scores[name] = value
+        return value
+
+    def key(self, name):
+        return (-round(self.score(name), 9),) + self.lifetime.key(name)
+
+    def describe(self, name):
+        return f"recent attendance: {self.score(name):.2f}, {self.lifetime.describe(name)}"
+
+
+# ################################ slot policies ################################ #
+
+class CoreSlots:
+    label = 'core'
+
+    def __init__(self, count):
+        self.count = count
+
+    def fill(self, queue):
+        return queue.pop_best(self.count)
+
+
+class FirstComeSlots:
+    label = 'first come'
+
+    def __init__(self, count):
+        self.count = count
+
+    def fill(self, queue):
+        return queue.pop_earliest(self.count)
+
+
+class Waitlist:
+    label = 'waitlist'
+
+    def fill(self, queue):
+        return queue.pop_best(None)
+
+
+DEFAULT_POLICIES = (CoreSlots(13), FirstComeSlots(2), Waitlist())
+
+
+class _SignupQueue:
+    def __init__(self, signups, score):
+        self.signups = signups
+        self.heap = [(score.key(name), order, name) for order, name in enumerate(signups)]
+        heapq.heapify(self.heap)
+        self.taken = set()
+        self.next_signup = 0
+
+    def pop_best(self, count):
+        picked = []
+        while self.heap and (count is None or len(picked) < count):
+            _, order, name = heapq.heappop(self.heap)
+            if order not in self.taken:
+                self.taken.add(order)
+                picked.append((order, name))
+        return picked
+
+    def pop_earliest(self, count):
+        picked = []
+        while self.next_signup < len(self.signups) and len(picked) < count:
+            order = self.next_signup
+            self.next_signup += 1
+            if order not in self.taken:
+                self.taken.add(order)
+                picked.append((order, self.signups[order]))
+        return picked
+
+
+def prioritize(signups, score, policies=DEFAULT_POLICIES, explain=False):
+    """
+    Order a signup list.
+    :param signups: Player names in signup order (no duplicates)
+    :param score: A score object (LifetimeScore, RecencyScore, ...) with key(name) and describe(name)
+    :param policies: Slot policies, applied in order
+    :param explain: Return Placement tuples with the slot and the reason instead of plain names
+    :return: List of names (or Placements), in final order
+    """
+    instrument.count('signups_ranked', len(signups))
+    queue = _SignupQueue(signups, score)
+    result = []
+    for policy in policies:
+        for order, name in policy.fill(queue):
+            if explain:
+                reason = f"signed up #{order + 1}" if isinstance(policy, FirstComeSlots) else score.describe(name)
+                result.append(Placement(name, policy.label, reason))
+            else:
+                result.append(name)
+    return result
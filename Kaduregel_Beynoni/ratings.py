@@ -0,0 +1,190 @@
+from array import array
+
+import instrument
+from coplay import team_members
+
+# Player ratings learned from game results (Elo for team games).
+#
+# A team's strength is the mean Elo of its players. For every pair of teams in a game the winner scores 1
+# and the loser 0 (two teams that both lost to a third, or a draw, score 0.5 each), and every player moves
+# by their team's share of K * (actual - expected). Everyone starts from their hand-entered rating, so
+# players without results keep exactly that rating, and the learned value is read back on the same 1-5
+# scale the balancer uses.
+#
+# Games are replayed oldest first over flat arrays of player ids; a new latest game is a single update.
+# One engine is cached per data dict (see ratings_for) and kept current through stats.apply_game.
+
+BASE_ELO = 1500.0
+ELO_PER_POINT = 200.0        # Elo difference for one rating point on the 1-5 scale
+K_FACTOR = 24.0
+PROVISIONAL_GAMES = 5        # players move twice as fast over their first rated games
+MIN_RATING, MAX_RATING = 1.0, 5.0
+DRAW = 'draw'
+
+
+def winning_team(game):
+    """
+    :param game: A game dict with 'teams' and 'winner'
+    :return: Index of the winning team, DRAW, or None when the game has no usable result
+    """
+    teams, winner = game.get('teams'), game.get('winner')
+    if not teams or winner is None or winner == '':
+        return None
+    if isinstance(winner, str):
+        if winner.lower() in (DRAW, 'tie'):
+            return DRAW
+        # App teams are named; Python teams are 'Team N', as printed by print_teams
+        for i, team in enumerate(teams):
+            if isinstance(team, dict) and team.get('name') == winner:
+                return i
+        label = winner.lower().removeprefix('team').strip()
+        if not label.isdigit():
+            return None
+        winner = int(label) - 1
+    if isinstance(winner, int) and 0 <= winner < len(teams):
+        return winner
+    return None
+
+
+def to_elo(rating):
+    return BASE_ELO + (float(rating) - 3.0) * ELO_PER_POINT
+
+
+def to_rating(elo):
+    return min(MAX_RATING, max(MIN_RATING, 3.0 + (elo - BASE_ELO) / ELO_PER_POINT))
+
+
+class RatingEngine:
+    def __init__(self, data, k_factor=K_FACTOR):
+        self.k_factor = k_factor
+        self.players = data['players']
+        self.names = []
+        self.ids = {}
+        self.elo = array('d')
+        self.rated_games = array('i')    # player id -> games with a result
+        self.games = 0                   # games with a result applied so far
+        self.replay(reversed(data['games']))
+
+    def player_id(self, name):
+        player_id = self.ids.get(name)
+        if player_id is None:
+            player_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.elo.append(to_elo(self.players.get(name, {}).get('rating', 3.0)))
+            self.rated_games.append(0)
+        return player_id
+
+    def _compile(self, game):
+        # (team id lists, winner) for a game with a result, else None
+        winner = winning_team(game)
+        if winner is None:
+            return None
+        teams = [[self.player_id(name) for name in team_members(team)] for team in game['teams']]
+        teams = [team for team in teams if team] if winner == DRAW else teams
+        if len(teams) < 2 or (winner != DRAW and not teams[winner]):
+            return None
+        return teams, winner
+
+    def replay(self, games):
+        """
+        Apply the results of several games, oldest first.
+        :param games: Iterable of game dicts
+        """
+        compiled = [match for match in map(self._compile, games) if match is not None]
+        elo, rated_games, k_factor = self.elo, self.rated_games, self.k_factor
+        for teams, winner in compiled:
+            strengths = [sum(elo[i] for i in team) / len(team) for team in teams]
+            pairs = len(teams) - 1
+            for a, team in enumerate(teams):
+                change = 0.0
+                for b, other in enumerate(strengths):
+                    if a == b:
+                        continue
+                    expected = 1.0 / (1.0 + 10.0 ** ((other - strengths[a]) / 400.0))
+                    actual = 1.0 if winner == a else 0.0 if winner == b else 0.5
+                    change += actual - expected
+                change *= k_factor / pairs
+                for i in team:
+                    elo[i] += 2 * change if rated_games[i] < PROVISIONAL_GAMES else change
+                    rated_games[i] += 1
+            self.games += 1
+
+    def add_game(self, game):
+        self.replay((game,))
+
+    # ################################ queries ################################ #
+
+    def rating(self, name):
+        """
+        :return: The learned rating on the 1-5 scale (the manual rating for players without results)
+        """
+        player_id = self.ids.get(name)
+        if player_id is None:
+            return float(self.players.get(name, {}).get('rating', 3.0))
+        return to_rating(self.elo[player_id])
+
+    def ratings(self):
+        return {name: self.rating(name) for name in self.players}
+
+    def win_probabilities(self, teams):
+        """
+        :param teams: List of teams, each a list of player names or player dicts with 'name'
+        :return: Expected score of each team against the others, between 0 and 1
+        """
+        strengths = []
+        for team in teams:
+            names = [p['name'] if isinstance(p, dict) else p for p in team]
+            strengths.append(sum(to_elo(self.rating(name)) for name in names) / max(len(names), 1))
+        if len(strengths) < 2:
+            return [1.0] * len(strengths)
+        return [sum(1.0 / (1.0 + 10.0 ** ((other - strength) / 400.0))
+                    for b, other in enumerate(strengths) if b != a) / (len(strengths) - 1)
+                for a, strength in enumerate(strengths)]
+
+    def rated(self, players):
+        # Copies of player dicts with 'rating' replaced by the learned rating, for the balancer
+        return [{**player, 'rating': round(self.rating(player['name']), 2)} for player in players]
+
+
+# ################################ per-data cache ################################ #
+
+# id(data) -> (data, engine); the data reference keeps the id from being reused
+_engines = {}
+
+
+def ratings_for(data):
+    cached = _engines.get(id(data))
+    if cached is None or cached[0] is not data:
+        instrument.count('games_scanned', len(data['games']))
+        cached = _engines[id(data)] = (data, RatingEngine(data))
+    return cached[1]
+
+
+# Called for every game write; a new latest game is one update, anything else forces a replay
+def apply_game(data, game, sign=1):
+    cached = _engines.get(id(data))
+    if cached is None or cached[0] is not data:
+        return
+    if sign > 0 and data['games'] and data['games'][0] is game:
+        cached[1].add_game(game)
+    else:
+        forget(data)
+
+
+# Teams or winner of a recorded game changed: a first result for the latest game is a single update,
+# a game that still has no result changes nothing, anything else forces a replay
+def set_result(data, game, had_result):
+    cached = _engines.get(id(data))
+    if cached is None or cached[0] is not data:
+        return
+    if had_result:
+        forget(data)
+    elif winning_team(game) is not None:
+        if data['games'] and data['games'][0] is game:
+            cached[1].add_game(game)
+        else:
+            forget(data)
+
+
+def forget(data):
+    _engines.pop(id(data), None)
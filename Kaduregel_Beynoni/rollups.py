@@ -0,0 +1,209 @@
+from datetime import date
+
+import instrument
+
+# Precomputed attendance rollups, maintained per game (through stats.apply_game) instead of rescanning
+# data['games']:
+#   weekly / monthly counts   player -> day_of_week -> bucket -> games; windowed questions such as
+#                             "who played most Saturdays since January" add up a few buckets per player
+#   decayed attendance        each game weighs 0.5 ** (age / half_life_days); stored as (score, reference
+#                             ordinal) so a new game is O(1) and the value can be read at any date
+#   streaks                   current and longest run of consecutive games attended, per day of week; each
+#                             player keeps the index of their last game, so a new game costs O(its players)
+#                             and the current streak is read off when asked
+# Buckets are keyed by integers: the ordinal of the week's Monday, and year * 12 + month - 1.
+
+ALL_DAYS = None
+
+
+def week_key(ordinal):
+    return ordinal - date.fromordinal(ordinal).weekday()
+
+
+def month_key(day):
+    return day.year * 12 + day.month - 1
+
+
+class Rollups:
+    def __init__(self, games=(), half_life_days=28):
+        self.half_life_days = half_life_days
+        self.weekly = {}        # player -> {day_of_week or None: {week_key: games}}
+        self.monthly = {}       # player -> {day_of_week or None: {month_key: games}}
+        self.decay = {}         # (player, day_of_week or None) -> [score, reference ordinal]
+        self.calendar = {}      # day_of_week or None -> {game ordinal: set of players}
+        # (player, day_of_week or None) -> [index of the last game attended, run ending there, longest run],
+        # with games numbered per day of week in _day_games; None = stale
+        self._streaks = None
+        self._day_games = None
+        self.latest = None      # ordinal of the newest game
+        for game in reversed(list(games)):   # oldest first
+            self.add_game(game)
+
+    def _days(self, game):
+        return ALL_DAYS, game.get('day_of_week')
+
+    def add_game(self, game, sign=1):
+        if 'date' not in game:
+            return
+        played = date.fromisoformat(game['date'])
+        ordinal = played.toordinal()
+        week, month = week_key(ordinal), month_key(played)
+        players = game.get('players', [])
+
+        for day in self._days(game):
+            attendees = self.calendar.setdefault(day, {}).setdefault(ordinal, set())
+            if sign > 0:
+                attendees.update(players)
+            else:
+                attendees.difference_update(players)
+                if not attendees:
+                    del self.calendar[day][ordinal]
+            for player in players:
+                buckets = self.weekly.setdefault(player, {}).setdefault(day, {})
+                buckets[week] = buckets.get(week, 0) + sign
+                buckets = self.monthly.setdefault(player, {}).setdefault(day, {})
+                buckets[month] = buckets.get(month, 0) + sign
+                self._add_decay((player, day), ordinal, sign)
+
+        self._update_streaks(game, ordinal, players, sign)
+        if sign > 0 and (self.latest is None or ordinal > self.latest):
+            self.latest = ordinal
+        elif sign < 0 and ordinal == self.latest:
+            # The newest game may be gone: fall back to the newest date left
+            remaining = self.calendar.get(ALL_DAYS)
+            self.latest = max(remaining) if remaining else None
+
+    def remove_game(self, game):
+        self.add_game(game, sign=-1)
+
+    def _add_decay(self, key, ordinal, sign):
+        entry = self.decay.get(key)
+        if entry is None:
+            entry = self.decay[key] = [0.0, ordinal]
+        score, reference = entry
+        if ordinal > reference:
+            # Move the reference forward to the newest game
+            entry[0] = score * 0.5 ** ((ordinal - reference) / self.half_life_days) + sign
+            entry[1] = ordinal
+        else:
+            entry[0] = score + sign * 0.5 ** ((reference - ordinal) / self.half_life_days)
+
+    # ################################ streaks ################################ #
+
+    def _update_streaks(self, game, ordinal, players, sign):
+        if self._streaks is None:
+            return
+        # The common case, a new latest game, moves only its own players' runs on; anything else
+        # (backfilling, removals, a second game on the same date) recomputes them on next use
+        newest = self.latest is None or ordinal > self.latest
+        if sign < 0 or not newest or len(self.calendar[ALL_DAYS][ordinal]) != len(set(players)):
+            self._streaks = self._day_games = None
+            return
+        for day in self._days(game):
+            self._attend(day, set(players))
+
+    def _attend(self, day, attended):
+        # The day's next game: each attendee's run goes on when they also played the day's previous game
+        index = self._day_games.get(day, 0)
+        self._day_games[day] = index + 1
+        for player in attended:
+            entry = self._streaks.get((player, day))
+            if entry is None:
+                entry = self._streaks[(player, day)] = [index, 0, 0]
+            entry[1] = entry[1] + 1 if entry[0] == index - 1 else 1
+            entry[0] = index
+            entry[2] = max(entry[2], entry[1])
+
+    def _rebuild_streaks(self):
+        self._streaks = {}
+        self._day_games = {}
+        for day, games in self.calendar.items():
+            for ordinal in sorted(games):
+                self._attend(day, games[ordinal])
+
+    def streak(self, player, day_of_week=ALL_DAYS):
+        """
+        :return: (current, longest) run of consecutive games attended on that day
+        """
+        if self._streaks is None:
+            self._rebuild_streaks()
+        entry = self._streaks.get((player, day_of_week))
+        if entry is None:
+            return 0, 0
+        last, run, longest = entry
+        # The run is current only if it reaches the day's latest game
+        return run if last == self._day_games[day_of_week] - 1 else 0, longest
+
+    # ################################ queries ################################ #
+
+    def decayed(self, player, day_of_week=ALL_DAYS, as_of=None):
+        """
+        :return: Decayed attendance score as of the given date (default: the newest game)
+        """
+        entry = self.decay.get((player, day_of_week))
+        if entry is None:
+            return 0.0
+        score, reference = entry
+        as_of = as_of.toordinal() if as_of is not None else self.latest
+        return score * 0.5 ** ((as_of - reference) / self.half_life_days)
+
+    def counts_since(self, since, until=None, day_of_week=ALL_DAYS, granularity='month'):
+        """
+        Games per player within a window, read from the rollup buckets.
+        :param since: datetime.date; rounded down to the start of its month (or week)
+        :param until: Optional datetime.date (inclusive bucket), default no end
+        :param day_of_week: Optional, specify the day (Tuesday/Thursday/Saturday)
+        :param granularity: 'month' or 'week'
+        :return: Dict of player name -> games
+        """
+        if until is None:
+            until = date.fromordinal(self.latest) if self.latest is not None else since
+        if granularity == 'month':
+            rollup, start, end, step = self.monthly, month_key(since), month_key(until), 1
+        elif granularity == 'week':
+            rollup, start, end, step = self.weekly, week_key(since.toordinal()), week_key(until.toordinal()), 7
+        else:
+            raise ValueError(f"Unknown granularity: {granularity!r}")
+        window = range(start, end + 1, step)
+
+        counts = {}
+        for player, per_day in rollup.items():
+            buckets = per_day.get(day_of_week)
+            if not buckets:
+                continue
+            if len(window) <= len(buckets):
+                total = sum(buckets.get(bucket, 0) for bucket in window)
+            else:
+                total = sum(games for bucket, games in buckets.items() if start <= bucket <= end)
+            if total:
+                counts[player] = total
+        return counts
+
+    def most_played(self, since, until=None, day_of_week=ALL_DAYS, limit=10, granularity='month'):
+        counts = self.counts_since(since, until, day_of_week, granularity)
+        return sorted(counts.items(), key=lambda item: -item[1])[:limit]
+
+
+# ################################ per-data cache ################################ #
+
+# id(data) -> (data, rollups); the data reference keeps the id from being reused
+_rollups = {}
+
+
+def rollups_for(data):
+    cached = _rollups.get(id(data))
+    if cached is None or cached[0] is not data:
+        instrument.count('games_scanned', len(data['games']))
+        cached = _rollups[id(data)] = (data, Rollups(data['games']))
+    return cached[1]
+
+
+# Called for every game write; only updates rollups that have already been built
+def apply_game(data, game, sign=1):
+    cached = _rollups.get(id(data))
+    if cached is not None and cached[0] is data:
+        cached[1].add_game(game, sign)
+
+
+def forget(data):
+    _rollups.pop(id(data), None)
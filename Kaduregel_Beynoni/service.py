@@ -0,0 +1,397 @@
+import asyncio
+import json
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import balancer
+import coplay
+import delta
+import journal
+import main
+import names
+import prioritization
+import ratings
+import rollups
+import stats
+import team_cache
+from writer import WriteQueue
+
+# Local HTTP service for the app and the bots (stdlib asyncio only, nothing external to run or mock).
+#
+#   GET  /health                     {"status": "ok", "version": 12, "team_cache": {"hits": ..., ...}}
+#   GET  /players                    every player's stats (ETag / If-None-Match supported)
+#   GET  /players/<name>             one player's stats, dates, learned rating and streak
+#   GET  /changes?since=120          a delta bundle from that version, or the snapshot (see delta.py)
+#   POST /prioritize                 {"day": "T", "players": [...], "unknown": "keep", "explain": false,
+#                                     "core": 13, "first_come": 2, "recent_weeks": 0, "half_life": 4}
+#   POST /games                      {"date": "2025-03-18" or "18.03.25", "day": "T", "players": [...]}
+#   POST /make-teams                 {"date": ..., "day": "T", "seed": 0, "creativity": 1, "candidates": 0,
+#                                     "top_k": 3, "save": false}
+#
+# The dataset stays in memory. Writes go through a WriteQueue: concurrent requests are committed as one
+# journal batch by the writer thread (write-behind - the event loop never waits on the disk), and the
+# journal is folded into the snapshot in the background as it grows. Writes accept If-Match with the
+# ETag from a read and answer 412 when someone else wrote first. Responses that only depend on the data
+# (player lists, signup rankings) are cached per dataset version, so repeated requests between writes
+# are a dictionary lookup; team searches go through team_cache.py, so re-rolls of a matchday are too.
+# Team optimization runs in a worker process to keep the loop responsive.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+RESULT_CACHE_SIZE = 512
+MAX_BODY = 1 << 20
+TEAM_WORKERS = 1
+UNKNOWN_CHOICES = ('keep', 'skip', 'error')
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+_REASONS = {200: 'OK', 201: 'Created', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 409: 'Conflict', 412: 'Precondition Failed', 413: 'Payload Too Large',
+            500: 'Internal Server Error'}
+
+
+def _encode(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def parse_date(text):
+    # 'YYYY-MM-DD' or the 'DD.MM.YY' the prompts use
+    try:
+        return datetime.strptime(text, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        pass
+    try:
+        return main.parse_game_date(text)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"Bad date {text!r}, expected YYYY-MM-DD or DD.MM.YY")
+
+
+def parse_day(body):
+    # 'day' as a code (T/H/S) or 'day_of_week' as stored
+    if 'day_of_week' in body:
+        if body['day_of_week'] not in stats.DAY_KEYS:
+            raise HTTPError(400, f"Bad day_of_week {body['day_of_week']!r}")
+        return body['day_of_week']
+    code = str(body.get('day', '')).upper()
+    if code not in main.DAY_CODES:
+        raise HTTPError(400, "Expected 'day' (T, H or S) or 'day_of_week'")
+    return main.DAY_CODES[code][0]
+
+
+class Service:
+    """
+    The request handling, independent of the sockets: handle() can be called directly in tests.
+    """
+
+    def __init__(self, data_file, team_workers=TEAM_WORKERS):
+        if journal.storage_for(data_file) is not journal:
+            # Writes are batched through the JSON journal (writer.py); SQLite has no such queue
+            raise ValueError(f"The service needs a JSON data file, not {data_file}; "
+                             f"convert it first (main.py convert {data_file} soccer_team.json)")
+        self.data_file = data_file
+        self.data = journal.load(data_file)
+        self.writes = WriteQueue(self.data, data_file)
+        self.team_pool = ProcessPoolExecutor(max_workers=team_workers) if team_workers else None
+        self._cache = OrderedDict()
+        self._cache_version = None
+        self.routes = {
+            ('GET', 'health'): self.health,
+            ('GET', 'players'): self.players,
+            ('GET', 'changes'): self.changes,
+            ('POST', 'prioritize'): self.prioritize,
+            ('POST', 'games'): self.add_game,
+            ('POST', 'make-teams'): self.make_teams,
+        }
+
+    def close(self):
+        self.writes.close()
+        if self.team_pool is not None:
+            self.team_pool.shutdown()
+
+    @property
+    def version(self):
+        return journal.version(self.data)
+
+    # ################################ caching ################################ #
+
+    def cached(self, key, compute):
+        # Results for the current dataset version; the whole cache goes stale on any write
+        if self._cache_version != self.version:
+            self._cache.clear()
+            self._cache_version = self.version
+        value = self._cache.get(key)
+        if value is None:
+            value = self._cache[key] = compute()
+            if len(self._cache) > RESULT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return value
+
+    def resolve(self, raw_names, on_unknown):
+        # main.resolve_player_names without the prompts (names.resolve_names, with its cached resolver);
+        # unresolved names are reported in the response
+        if on_unknown not in UNKNOWN_CHOICES:
+            raise HTTPError(400, f"'unknown' must be one of {', '.join(UNKNOWN_CHOICES)}")
+        try:
+            return names.resolve_names(self.data, raw_names, on_unknown)
+        except ValueError as error:
+            raise HTTPError(400, str(error))
+
+    # ################################ endpoints ################################ #
+
+    # Handlers run on the event loop. The writer thread changes the data only while holding
+    # writes.lock, so every read of the data happens under it - and never across an await, since
+    # the writer needs the lock to finish the writes being awaited.
+
+    def health(self, request):
+        with self.writes.lock:
+            return 200, {'status': 'ok', 'version': self.version, 'team_cache': team_cache.cache_for(self.data).info()}
+
+    def players(self, request):
+        with self.writes.lock:
+            if request['rest']:
+                return 200, _encode(self.player_details(unquote(request['rest'])))
+            return 200, self.cached(('players',), lambda: _encode(self.data['players']))
+
+    def changes(self, request):
+        try:
+            since = int(request['query'].get('since', ['-1'])[0])
+        except ValueError:
+            raise HTTPError(400, "'since' must be a version number")
+        # Read before taking writes.lock: the writer thread takes the file lock first, then writes.lock
+        changes = journal.changes_since(self.data_file, since)
+        with self.writes.lock:
+            if changes is not None and (changes[-1]['seq'] if changes else since) < self.version:
+                # A batch still on its way to the disk; the snapshot this gives isn't worth caching
+                return 200, _encode(delta.export_delta(self.data, changes, since))
+            return 200, self.cached(('changes', since),
+                                    lambda: _encode(delta.export_delta(self.data, changes, since)))
+
+    def player_details(self, name):
+        player = self.data['players'].get(name)
+        if player is None:
+            raise HTTPError(404, f"No player named {name!r}")
+        current, longest = rollups.rollups_for(self.data).streak(name)
+        return {
+            'name': name,
+            'stats': player,
+            'dates': main.get_player_dates(self.data, name),
+            'learned_rating': ratings.ratings_for(self.data).rating(name),
+            'streak': {'current': current, 'longest': longest},
+        }
+
+    def prioritize(self, request):
+        body = request['json']
+        code = str(body.get('day', main.ALL_GAMES_CODE)).upper()
+        if code not in main.DAY_CODES and code != main.ALL_GAMES_CODE:
+            raise HTTPError(400, "'day' must be T, H, S or A")
+        players = body.get('players')
+        if not isinstance(players, list):
+            raise HTTPError(400, "'players' must be a list of names")
+        options = (code, tuple(map(str, players)), body.get('unknown', 'keep'), bool(body.get('explain')),
+                   int(body.get('core', 13)), int(body.get('first_come', 2)), int(body.get('recent_weeks', 0)),
+                   float(body.get('half_life', 4.0)))
+        with self.writes.lock:
+            return 200, self.cached(('prioritize', options), lambda: self._prioritize(*options))
+
+    def _prioritize(self, code, raw_names, unknown, explain, core, first_come, recent_weeks, half_life):
+        day_of_week, day_key = main.priority_day(code)
+        players, notes = self.resolve(raw_names, unknown)
+        score = None
+        if recent_weeks:
+            score = prioritization.RecencyScore(self.data, None if day_key == 'total_games' else day_of_week,
+                                                weeks=recent_weeks, half_life_weeks=half_life, day_key=day_key)
+        policies = (prioritization.CoreSlots(core), prioritization.FirstComeSlots(first_come),
+                    prioritization.Waitlist())
+        ranked = main.prioritize_signups(self.data, players, day_key, score, policies, explain)
+        if explain:
+            ranked = [placement._asdict() for placement in ranked]
+        return _encode({'version': self.version, 'day': day_of_week, 'players': ranked, 'notes': notes})
+
+    async def add_game(self, request):
+        body = request['json']
+        date, day_of_week = parse_date(body.get('date')), parse_day(body)
+        with self.writes.lock:
+            players, notes = self.resolve(body.get('players') or [], body.get('unknown', 'error'))
+        if not players:
+            raise HTTPError(400, "A game needs players")
+        game = {'date': date, 'day_of_week': day_of_week, 'players': players}
+        version = await self.write({'op': 'add_game', 'game': game}, request)
+        return 201, {'version': version, 'game': game, 'notes': notes}
+
+    async def make_teams(self, request):
+        body = request['json']
+        date, day_of_week = parse_date(body.get('date')), parse_day(body)
+        creativity = int(body.get('creativity', 1))
+        seed, candidates, top_k = int(body.get('seed', 0)), int(body.get('candidates', 0)), int(body.get('top_k', 3))
+
+        # Same keys as main.form_teams, so a re-roll of the same game and seed is a cache hit
+        key = dict(diversity_weight=0.1 * creativity, learned_ratings=True, candidates=candidates,
+                   top_k=top_k if candidates else 1, seed=seed)
+        # Plain inputs for the worker: learned ratings and past teammates of just these players
+        with self.writes.lock:
+            game = stats.find_game(self.data, date, day_of_week)
+            if game is None:
+                raise HTTPError(404, f"No game on {date} ({day_of_week})")
+            roster = list(game['players'])
+            version = self.version
+            lineups = team_cache.find_lineups(self.data, roster, **key)
+            if lineups is None:
+                players = team_cache.rated_lineup(self.data, roster)
+                matrix = coplay.matrix_for(self.data)
+                teammates = {p['name']: matrix.teammates_of(p['name']) for p in players}
+
+        if lineups is None:
+            options = dict(seed=seed, teammates=teammates.__getitem__, diversity_weight=0.1 * creativity)
+            if candidates:
+                call = (balancer.generate_lineups, players)
+                options.update(candidates=candidates, top_k=top_k, workers=1)
+            else:
+                call = (_single_lineup, players)
+
+            if self.team_pool is not None:
+                lineups = await asyncio.get_running_loop().run_in_executor(self.team_pool, _call, call, options)
+            else:
+                lineups = _call(call, options)
+            with self.writes.lock:
+                # Dropped if a write came in meanwhile
+                team_cache.store_lineups(self.data, roster, lineups, version, **key)
+
+        result = {'version': version, 'lineups': [
+            {'teams': [[p['name'] for p in team] for team in teams], 'score': score} for teams, score in lineups]}
+        if body.get('save') and lineups:
+            result['version'] = await self.write(
+                {'op': 'set_teams', 'date': date, 'day_of_week': day_of_week, 'teams': result['lineups'][0]['teams']},
+                request)
+        return 200, result
+
+    async def write(self, entry, request):
+        # Queue a change; If-Match makes it a compare-and-swap against the version the client read
+        expected = request['headers'].get('if-match')
+        if expected is not None:
+            try:
+                expected = int(expected.strip('W/').strip('"'))
+            except ValueError:
+                raise HTTPError(400, f"Bad If-Match {expected!r}")
+        try:
+            return await asyncio.wrap_future(self.writes.submit(entry, expected))
+        except journal.ConflictError as error:
+            raise HTTPError(412 if expected is not None and error.expected == expected else 409, str(error))
+        except ValueError as error:
+            raise HTTPError(400, str(error))
+
+    # ################################ dispatch ################################ #
+
+    async def handle(self, method, target, headers=None, body=b''):
+        """
+        :return: (status, body bytes, extra headers)
+        """
+        headers = headers or {}
+        url = urlsplit(target)
+        path = url.path.strip('/')
+        resource, _, rest = path.partition('/')
+        handler = self.routes.get((method, resource))
+        try:
+            if handler is None:
+                if any(key[1] == resource for key in self.routes):
+                    raise HTTPError(405, f"{method} not allowed on /{resource}")
+                raise HTTPError(404, f"No such endpoint /{path}")
+            if method == 'GET' and headers.get('if-none-match') == journal.etag(self.data):
+                return 304, b'', {'ETag': journal.etag(self.data)}
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                raise HTTPError(400, "Body is not valid JSON")
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "Body must be a JSON object")
+            response = handler({'rest': rest, 'query': parse_qs(url.query), 'headers': headers, 'json': payload})
+            status, result = await response if asyncio.iscoroutine(response) else response
+        except HTTPError as error:
+            status, result = error.status, {'error': str(error)}
+        except (TypeError, ValueError) as error:
+            status, result = 400, {'error': str(error)}
+        return status, result if isinstance(result, bytes) else _encode(result), {'ETag': journal.etag(self.data)}
+
+
+def _single_lineup(players, **options):
+    return [balancer.optimize_teams(players, **options)]
+
+
+def _call(call, options):
+    function, players = call
+    return function(players, **options)
+
+
+# ################################ HTTP server ################################ #
+
+async def _serve_connection(service, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, protocol = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get('content-length') or 0)
+            if length > MAX_BODY:
+                status, body, extra = 413, _encode({'error': "Body too large"}), {}
+                headers['connection'] = 'close'
+            else:
+                body = await reader.readexactly(length) if length else b''
+                status, body, extra = await service.handle(method, target, headers, body)
+
+            keep_alive = protocol == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            head = [f'HTTP/1.1 {status} {_REASONS.get(status, "")}',
+                    'Content-Type: application/json; charset=utf-8',
+                    f'Content-Length: {len(body)}',
+                    f'Connection: {"keep-alive" if keep_alive else "close"}',
+                    *(f'{key}: {value}' for key, value in extra.items())]
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Start serving; port 0 picks a free port (see server.sockets[0].getsockname()).
+    :return: asyncio.Server
+    """
+    return await asyncio.start_server(lambda reader, writer: _serve_connection(service, reader, writer),
+                                      host, port)
+
+
+def serve(data_file, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    service = Service(data_file)
+
+    async def run():
+        server = await start(service, host, port)
+        print(f"Serving {data_file} on http://{host}:{server.sockets[0].getsockname()[1]}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
@@ -0,0 +1,324 @@
+import os
+import random
+from array import array
+from collections import namedtuple
+from datetime import date
+
+import prioritization
+import stats
+
+# Monte Carlo seasons for comparing signup and team-making policies.
+#
+# A SeasonModel is fitted to the history: the schedule of the last `weeks` weeks (which days had games),
+# how often each player came on each day, the current counters and the learned ratings. Every simulated
+# season replays that schedule from the current league state. For each game the signups are drawn
+# per player (their attendance rate on that day times `demand`: real attendance is capped by the slots,
+# so demand > 1 is what creates a waitlist), in random signup order. Each policy then ranks the same
+# signups with prioritization.prioritize, the same code 'main.py prioritize' runs:
+#   score 'day'      LifetimeScore on the game's day: games on that day, then total games (the classic)
+#   score 'total'    LifetimeScore on total games
+#   score 'recency'  RecencyScore on the game's day over RECENCY_WEEKS, as of the game's date
+# with CoreSlots(core), FirstComeSlots(first_come) and Waitlist(), and splits the players into teams
+# ('snake' - the balancer's opening draft by rating, 'random', or 'balanced' - the full balancer, much
+# slower). Every season plays in a league of its own, seeded with the current counters and the last
+# RECENCY_WEEKS of games; its games go in through stats.record_game, so counters and the attendance
+# index move as the season goes and the policies feed back into later rankings.
+#
+# All policies see the same draws for a given (seed, season) (common random numbers), so differences
+# between them are not noise from different signups. Seasons are split into chunks over a process pool;
+# the same seed gives the same report for any number of workers. Reported per policy:
+#   waitlist_rate      share of a player's signups that ended on the waitlist, averaged over players
+#   max_waitlist_rate  the worst-off regular (at least one signup per season on average)
+#   gini               Gini coefficient of games played per season among players who signed up
+#   team_spread        highest minus lowest team mean rating, averaged over games
+
+Policy = namedtuple('Policy', ['name', 'core', 'first_come', 'score', 'teams'])
+
+SCORES = ('day', 'total', 'recency')
+TEAM_POLICIES = ('snake', 'random', 'balanced')
+NUM_TEAMS = 3
+DEMAND = 1.3
+HISTORY_WEEKS = 52
+RECENCY_WEEKS = 12
+RECENCY_HALF_LIFE_WEEKS = 4.0
+BALANCED_ITERATIONS = 100
+SEASONS = 200
+CHUNK_SIZE = 25
+MOST_WAITLISTED = 5
+
+
+def policy(core=13, first_come=2, score='day', teams='snake', name=None):
+    if score not in SCORES:
+        raise ValueError(f"Unknown score {score!r}, expected one of {', '.join(SCORES)}")
+    if teams not in TEAM_POLICIES:
+        raise ValueError(f"Unknown team policy {teams!r}, expected one of {', '.join(TEAM_POLICIES)}")
+    return Policy(name or f'{core}+{first_come} {score} {teams}', core, first_come, score, teams)
+
+
+DEFAULT_POLICY = policy()
+
+
+class SeasonModel:
+    def __init__(self, data, weeks=HISTORY_WEEKS, demand=DEMAND):
+        """
+        :param data: The JSON data
+        :param weeks: Weeks of history to take the schedule and attendance rates from
+        :param demand: Signups relative to attendance (1.3 = 30% more players want to play than did)
+        """
+        import ratings
+
+        games = []
+        for game in data['games']:
+            day = game.get('day_of_week')
+            try:
+                played = date.fromisoformat(game.get('date', ''))
+            except (TypeError, ValueError):
+                continue
+            if day in stats.DAY_KEYS and game.get('players'):
+                games.append((played.toordinal(), day, game['players']))
+        if not games:
+            raise ValueError("No games with a date, day and players to fit a season to")
+
+        self.days = list(stats.DAY_KEYS)
+        self.names = list(data['players'])
+        self.names += sorted({name for _, _, players in games for name in players} - set(self.names))
+        self.ids = ids = {name: i for i, name in enumerate(self.names)}
+        players = [data['players'].get(name, {}) for name in self.names]
+
+        self.end = max(ordinal for ordinal, _, _ in games)
+        start = self.end - 7 * weeks
+        window = sorted(game for game in games if game[0] > start)
+        self.span = 7 * weeks
+        self.schedule = [(ordinal - self.end, self.days.index(day)) for ordinal, day, _ in window]
+
+        # Attendance rate per day over the window -> signup chance per game
+        self.signup_odds = []
+        for day in self.days:
+            day_games = [names for _, game_day, names in window if game_day == day]
+            counts = {}
+            for names in day_games:
+                for name in names:
+                    counts[ids[name]] = counts.get(ids[name], 0) + 1
+            self.signup_odds.append([(i, min(1.0, demand * count / len(day_games)))
+                                     for i, count in sorted(counts.items())])
+
+        # Where every season starts from: the counters, and the games a RecencyScore still looks back on
+        self.counters = {name: {key: player.get(key, 0) for key in stats.STAT_KEYS}
+                         for name, player in zip(self.names, players)}
+        self.recent_games = [{'date': date.fromordinal(ordinal).isoformat(), 'day_of_week': day, 'players': names}
+                             for ordinal, day, names in sorted(games, reverse=True)
+                             if ordinal > self.end - 7 * RECENCY_WEEKS]
+
+        engine = ratings.ratings_for(data)
+        self.ratings = [engine.rating(name) for name in self.names]
+        self.positions = [player.get('position', 'both') for player in players]
+
+    def season_data(self):
+        # A league of its own for one simulated season, with the current counters and the recent games
+        return {'players': {name: dict(counters) for name, counters in self.counters.items()},
+                'games': list(self.recent_games)}
+
+    def draw_season(self, rnd):
+        # Signups of every game in the schedule, each list in signup order
+        season = []
+        for _, day in self.schedule:
+            signups = [i for i, chance in self.signup_odds[day] if rnd.random() < chance]
+            rnd.shuffle(signups)
+            season.append(signups)
+        return season
+
+
+# ################################ one season under one policy ################################ #
+
+class _Tally:
+    def __init__(self, size):
+        self.signups = array('q', bytes(8 * size))
+        self.waitlisted = array('q', bytes(8 * size))
+        self.seasons = 0
+        self.games = 0
+        self.signup_total = 0
+        self.gini = 0.0
+        self.spread = 0.0
+        self.team_games = 0
+
+    def merge(self, other):
+        for i, value in enumerate(other.signups):
+            self.signups[i] += value
+        for i, value in enumerate(other.waitlisted):
+            self.waitlisted[i] += value
+        self.seasons += other.seasons
+        self.games += other.games
+        self.signup_total += other.signup_total
+        self.gini += other.gini
+        self.spread += other.spread
+        self.team_games += other.team_games
+
+
+def gini(values):
+    values = sorted(values)
+    total = sum(values)
+    if not values or not total:
+        return 0.0
+    count = len(values)
+    return sum((2 * i - count - 1) * value for i, value in enumerate(values, start=1)) / (count * total)
+
+
+def _split(model, playing, team_policy, rnd):
+    if team_policy == 'random':
+        playing = list(playing)
+        rnd.shuffle(playing)
+        return [playing[i::NUM_TEAMS] for i in range(NUM_TEAMS)]
+    import balancer
+
+    lineup = [{'name': i, 'rating': model.ratings[i], 'position': model.positions[i]} for i in playing]
+    if team_policy == 'balanced':
+        teams, _ = balancer.optimize_teams(lineup, num_teams=NUM_TEAMS, seed=rnd.random(),
+                                           iterations=BALANCED_ITERATIONS, restarts=1, time_budget=float('inf'))
+    else:
+        # No annealing steps: the balancer's opening snake draft, goalkeepers dealt first
+        teams, _ = balancer.optimize_teams(lineup, num_teams=NUM_TEAMS, seed=rnd.random(), iterations=0,
+                                           restarts=1, time_budget=float('inf'))
+    return [[player['name'] for player in team] for team in teams]
+
+
+def _score(policy, data, day_of_week, as_of):
+    day_key = stats.DAY_KEYS[day_of_week]
+    if policy.score == 'day':
+        return prioritization.LifetimeScore(data, day_key)
+    if policy.score == 'total':
+        return prioritization.LifetimeScore(data, 'total_games')
+    return prioritization.RecencyScore(data, day_of_week, weeks=RECENCY_WEEKS,
+                                       half_life_weeks=RECENCY_HALF_LIFE_WEEKS, as_of=as_of, day_key=day_key)
+
+
+def _play_season(model, season, policy, rnd, tally):
+    import journal
+
+    data = model.season_data()
+    slots = (prioritization.CoreSlots(policy.core), prioritization.FirstComeSlots(policy.first_come),
+             prioritization.Waitlist())
+    played = {}
+    signed_up = set()
+    ratings = model.ratings
+
+    for (offset, day), signups in zip(model.schedule, season):
+        # Each season starts right after the last real game
+        played_on = date.fromordinal(model.end + model.span + offset)
+        day_of_week = model.days[day]
+        names = [model.names[i] for i in signups]
+        ranked = prioritization.prioritize(names, _score(policy, data, day_of_week, played_on), slots)
+        playing = [model.ids[name] for name in ranked[:policy.core + policy.first_come]]
+        taken = set(playing)
+
+        for i in signups:
+            tally.signups[i] += 1
+            signed_up.add(i)
+            if i not in taken:
+                tally.waitlisted[i] += 1
+        for i in playing:
+            played[i] = played.get(i, 0) + 1
+        stats.record_game(data, {'date': played_on.isoformat(), 'day_of_week': day_of_week,
+                                 'players': ranked[:len(playing)]})
+        tally.games += 1
+        tally.signup_total += len(signups)
+
+        if len(playing) >= NUM_TEAMS:
+            means = [sum(ratings[i] for i in team) / len(team)
+                     for team in _split(model, playing, policy.teams, rnd) if team]
+            tally.spread += max(means) - min(means)
+            tally.team_games += 1
+
+    # The season's league is thrown away; drop the indexes cached for it
+    journal.forget_indexes(data)
+    tally.gini += gini([played.get(i, 0) for i in signed_up])
+    tally.seasons += 1
+
+
+def _run_seasons(model, policies, seed, indexes):
+    # Same draws for every policy in a season; team splits get their own stream per policy
+    tallies = [_Tally(len(model.names)) for _ in policies]
+    for index in indexes:
+        season = model.draw_season(random.Random(f'{seed}:{index}'))
+        for policy, tally in zip(policies, tallies):
+            _play_season(model, season, policy, random.Random(f'{seed}:{index}:{policy.name}'), tally)
+    return tallies
+
+
+# ################################ running and reporting ################################ #
+
+def simulate(data, policies=(DEFAULT_POLICY,), seasons=SEASONS, seed=0, workers=None, demand=DEMAND,
+             weeks=HISTORY_WEEKS, chunk_size=CHUNK_SIZE):
+    """
+    Run every policy over the same simulated seasons.
+    :param data: The JSON data, or a SeasonModel fitted to it
+    :param policies: Policy tuples (see policy())
+    :param seasons: Number of seasons
+    :param seed: Seed for the whole run; the same seed gives the same report for any number of workers
+    :param workers: Number of worker processes (None = one per core, 1 = run in this process)
+    :param demand: Signups relative to attendance, when data is given
+    :param weeks: Weeks of history to fit, when data is given
+    :param chunk_size: Seasons per task sent to a worker
+    :return: Dict of policy name -> metrics dict (see the top of this module)
+    """
+    model = data if isinstance(data, SeasonModel) else SeasonModel(data, weeks, demand)
+    policies = list(policies)
+    if len({p.name for p in policies}) != len(policies):
+        raise ValueError("Policy names must be unique")
+    chunks = [range(start, min(start + chunk_size, seasons)) for start in range(0, seasons, chunk_size)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) == 1:
+        results = [_run_seasons(model, policies, seed, chunk) for chunk in chunks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_run_seasons, model, policies, seed, chunk) for chunk in chunks]
+            results = [future.result() for future in futures]
+
+    reports = {}
+    for k, policy in enumerate(policies):
+        tally = _Tally(len(model.names))
+        for tallies in results:
+            tally.merge(tallies[k])
+        reports[policy.name] = _report(model, tally)
+    return reports
+
+
+def _report(model, tally):
+    rates = {i: tally.waitlisted[i] / count for i, count in enumerate(tally.signups) if count}
+    regulars = {i: rate for i, rate in rates.items() if tally.signups[i] >= tally.seasons}
+    worst = sorted(regulars.items(), key=lambda item: (-item[1], item[0]))[:MOST_WAITLISTED]
+    return {
+        'seasons': tally.seasons,
+        'games_per_season': tally.games / max(tally.seasons, 1),
+        'signups_per_game': tally.signup_total / max(tally.games, 1),
+        'waitlist_rate': sum(rates.values()) / max(len(rates), 1),
+        'max_waitlist_rate': worst[0][1] if worst else 0.0,
+        'most_waitlisted': [(model.names[i], rate) for i, rate in worst],
+        'gini': tally.gini / max(tally.seasons, 1),
+        'team_spread': tally.spread / max(tally.team_games, 1),
+    }
+
+
+def sweep(data, cores=(13,), first_comes=(2,), scores=('day',), teams=('snake',), **options):
+    """
+    simulate() over every combination of the given policy settings.
+    :return: Dict of policy name -> metrics dict, in grid order
+    """
+    policies = [policy(core, first_come, score, team_policy)
+                for core in cores for first_come in first_comes for score in scores for team_policy in teams]
+    return simulate(data, policies, **options)
+
+
+def print_report(reports):
+    print(f"{'policy':28} {'waitlist':>9} {'worst':>7} {'gini':>6} {'spread':>7}")
+    for name, report in reports.items():
+        print(f"{name:28} {report['waitlist_rate']:9.1%} {report['max_waitlist_rate']:7.1%} "
+              f"{report['gini']:6.3f} {report['team_spread']:7.2f}")
+    first = next(iter(reports.values()), None)
+    if first is not None:
+        print(f"\n{first['seasons']} seasons of {first['games_per_season']:.0f} games, "
+              f"{first['signups_per_game']:.1f} signups per game")
+    for name, report in reports.items():
+        worst = ', '.join(f"{player} {rate:.0%}" for player, rate in report['most_waitlisted'])
+        print(f"  most waitlisted ({name}): {worst}")
@@ -0,0 +1,551 @@
+import json
+import os
+import sqlite3
+
+import journal
+import models
+import stats
+from coplay import team_members
+
+# Optional SQLite backend, used when DATA_FILE ends in .db (see journal.storage_for).
+#
+# Same interface as the JSON snapshot + journal (load / record / compact / changes_since), over normalized tables:
+#   players          one row per player: the counters, rating and position as columns, anything else as JSON
+#   past_teams       (player, slot) -> one of the player's past teams, as a JSON list of names
+#   games            one row per game; position ascending is history order (oldest first), with gaps so a
+#                    backfilled game goes in between its neighbours
+#   game_players     (game, slot) -> player
+#   team_assignments (game, team, slot) -> player; team names/colors of app teams are kept on the game
+#   changes          the recorded journal entries by sequence number (compact keeps the newest RETAIN_CHANGES)
+#   meta             journal_seq and any other top-level keys
+# Writes look games up by date and day of week through an index, player_dates answers from the file without
+# loading the dataset (main.get_player_dates / compare_players with data=None), and record() inserts or
+# rewrites only the rows the change touched, in one transaction, instead of the whole file: a backfilled
+# game is one row placed by its position, and saved teams add one past_teams row per member.
+# Concurrent writers serialize on SQLite's write lock; like the journal, each write first applies the
+# changes other writers committed since, and expected_version makes it a compare-and-swap.
+#
+# Converting JSON -> SQLite -> JSON gives back the same data, including key order.
+
+SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+RETAIN_CHANGES = journal.RETAIN_SEGMENTS * journal.COMPACT_EVERY
+# Spacing of game positions; a backfill takes the middle of the gap it goes into
+POSITION_GAP = 1 << 20
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    sort_order INTEGER NOT NULL,
+    listed INTEGER NOT NULL,            -- 0 for names that appear in games but not in data['players']
+    tuesday_games INTEGER, thursday_games INTEGER, saturday_games INTEGER, total_games INTEGER,
+    rating REAL, position TEXT,
+    extra TEXT                          -- JSON: other keys and the key order
+);
+CREATE TABLE IF NOT EXISTS past_teams (
+    player_id INTEGER NOT NULL REFERENCES players(id),
+    slot INTEGER NOT NULL,
+    members TEXT NOT NULL,              -- JSON list of names
+    PRIMARY KEY (player_id, slot)
+);
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    position INTEGER,
+    date TEXT, day_of_week TEXT, winner TEXT,
+    extra TEXT                          -- JSON: other keys, team names/colors and the key order
+);
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id INTEGER NOT NULL REFERENCES games(id) ON DELETE CASCADE,
+    slot INTEGER NOT NULL,
+    player_id INTEGER NOT NULL REFERENCES players(id),
+    PRIMARY KEY (game_id, slot)
+);
+CREATE TABLE IF NOT EXISTS team_assignments (
+    game_id INTEGER NOT NULL REFERENCES games(id) ON DELETE CASCADE,
+    team INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    player_id INTEGER NOT NULL REFERENCES players(id),
+    PRIMARY KEY (game_id, team, slot)
+);
+CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY, entry TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS games_by_date ON games(date, day_of_week);
+CREATE INDEX IF NOT EXISTS games_by_day ON games(day_of_week, date);
+CREATE INDEX IF NOT EXISTS game_players_by_player ON game_players(player_id, game_id);
+CREATE INDEX IF NOT EXISTS team_assignments_by_player ON team_assignments(player_id);
+'''
+
+PLAYER_COLUMNS = {
+    'tuesday_games': int,
+    'thursday_games': int,
+    'saturday_games': int,
+    'total_games': int,
+    'rating': float,
+    'position': str,
+}
+GAME_COLUMNS = ('date', 'day_of_week', 'winner')
+
+
+def is_sqlite_path(path):
+    return path.endswith(SUFFIXES)
+
+
+def connect(path):
+    # Rollback journal mode (the default) so every commit changes the file's mtime, which get_data relies on
+    connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(SCHEMA)
+    if 'position' not in [row[1] for row in connection.execute('PRAGMA table_info(games)')]:
+        # Written before games had a position: the row ids were the history order
+        connection.execute('ALTER TABLE games ADD COLUMN position INTEGER')
+        connection.execute('UPDATE games SET position = id * ?', (POSITION_GAP,))
+    connection.execute('CREATE INDEX IF NOT EXISTS games_by_position ON games(position)')
+    return connection
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _is_string_list(value):
+    return type(value) is list and all(type(item) is str for item in value)
+
+
+def _is_team_list(value):
+    # past_teams kept as past_teams rows: a non-empty list of name lists
+    return type(value) is list and bool(value) and all(_is_string_list(team) for team in value)
+
+
+# ################################ rows <-> dicts ################################ #
+
+def _player_id(connection, name):
+    row = connection.execute('SELECT id FROM players WHERE name = ?', (name,)).fetchone()
+    if row is not None:
+        return row[0]
+    # Referenced by a game before (or without) being listed in data['players']
+    return connection.execute(
+        'INSERT INTO players (name, sort_order, listed) VALUES (?, (SELECT COALESCE(MAX(sort_order), -1) + 1 '
+        'FROM players), 0)', (name,)).lastrowid
+
+
+def _write_player(connection, name, player, sort_order=None, past_teams='all'):
+    """
+    :param past_teams: Which of the player's past_teams rows to write: 'all', 'last' (the team just appended,
+                       when the rows hold all the others) or None (they didn't change)
+    """
+    columns = {key: player[key] if type(player.get(key)) is kind else None for key, kind in PLAYER_COLUMNS.items()}
+    teams = player.get('past_teams') if _is_team_list(player.get('past_teams')) else None
+    stored = [key for key in player if columns.get(key) is not None or (key == 'past_teams' and teams)]
+    rest = {key: value for key, value in player.items() if key not in stored}
+    canonical = [key for key in (*PLAYER_COLUMNS, 'past_teams') if key in stored]
+    extra = {'rest': rest, 'order': list(player)} if rest or list(player) != canonical else None
+    values = [*columns.values(), _dumps(extra) if extra else None]
+    player_id = connection.execute('SELECT id FROM players WHERE name = ?', (name,)).fetchone()
+    if player_id is None:
+        if sort_order is None:
+            sort_order = connection.execute('SELECT COALESCE(MAX(sort_order), -1) + 1 FROM players').fetchone()[0]
+        player_id = connection.execute(
+            f'INSERT INTO players (name, sort_order, listed, {", ".join(PLAYER_COLUMNS)}, extra) '
+            f'VALUES (?, ?, 1, {", ".join("?" * (len(PLAYER_COLUMNS) + 1))})', (name, sort_order, *values)).lastrowid
+    else:
+        player_id = player_id[0]
+        assignments = ', '.join(f'{key} = ?' for key in PLAYER_COLUMNS)
+        order = ', sort_order = ?' if sort_order is not None else ''
+        connection.execute(f'UPDATE players SET listed = 1, {assignments}, extra = ?{order} WHERE id = ?',
+                           (*values, *((sort_order,) if sort_order is not None else ()), player_id))
+
+    if past_teams == 'last' and teams:
+        count = connection.execute('SELECT COUNT(*) FROM past_teams WHERE player_id = ?', (player_id,)).fetchone()[0]
+        if count == len(teams) - 1:
+            connection.execute('INSERT INTO past_teams (player_id, slot, members) VALUES (?, ?, ?)',
+                               (player_id, count, _dumps(teams[-1])))
+            return
+    if past_teams is not None:
+        connection.execute('DELETE FROM past_teams WHERE player_id = ?', (player_id,))
+        if teams:
+            connection.executemany('INSERT INTO past_teams (player_id, slot, members) VALUES (?, ?, ?)',
+                                   [(player_id, slot, _dumps(team)) for slot, team in enumerate(teams)])
+
+
+def _read_player(row, past_teams=None):
+    player = {key: value for key, value in zip(PLAYER_COLUMNS, row[:len(PLAYER_COLUMNS)]) if value is not None}
+    if past_teams:
+        player['past_teams'] = past_teams
+    if row[-1]:
+        extra = json.loads(row[-1])
+        player.update(extra['rest'])
+        player = {key: player[key] for key in extra['order']}
+    return player
+
+
+def _position(connection, date=None):
+    """
+    Position for a new game row: on top, or for a backfill (a dated game that isn't the newest) where
+    stats.record_game puts it, right above the newest game dated on or before it.
+    """
+    if date is None:
+        top = connection.execute('SELECT MAX(position) FROM games').fetchone()[0]
+        return (top or 0) + POSITION_GAP
+    lower = connection.execute("SELECT MAX(position) FROM games WHERE COALESCE(date, '') <= ?", (date,)).fetchone()[0]
+    if lower is None:
+        bottom = connection.execute('SELECT MIN(position) FROM games').fetchone()[0]
+        return (bottom or 0) - POSITION_GAP
+    upper = connection.execute('SELECT MIN(position) FROM games WHERE position > ?', (lower,)).fetchone()[0]
+    if upper is None:
+        return lower + POSITION_GAP
+    if upper - lower < 2:
+        # The gap is used up: make room above, moving only the newer rows' positions
+        connection.execute('UPDATE games SET position = position + ? WHERE position > ?', (POSITION_GAP, lower))
+        upper += POSITION_GAP
+    return (lower + upper) // 2
+
+
+def _insert_game(connection, game, game_id=None, position=None):
+    columns = [game[key] if type(game.get(key)) is str else None for key in GAME_COLUMNS]
+    stored = [key for key, value in zip(GAME_COLUMNS, columns) if value is not None]
+    players, teams = game.get('players'), game.get('teams')
+    if _is_string_list(players):
+        stored.append('players')
+    team_meta = None
+    if type(teams) is list and all(_is_string_list(team) or (isinstance(team, dict) and _is_string_list(
+            team.get('players'))) for team in teams):
+        stored.append('teams')
+        # 'players' stays as a placeholder so the team's key order survives
+        team_meta = [{key: None if key == 'players' else value for key, value in team.items()}
+                     if isinstance(team, dict) else None for team in teams]
+    rest = {key: value for key, value in game.items() if key not in stored}
+    extra = {}
+    if rest:
+        extra['rest'] = rest
+    if players == []:
+        extra['players'] = []       # no rows to tell an empty list from a missing one
+    # Team names/colors, and the team count when it can't be told from the assignments
+    if team_meta is not None and (any(meta is not None for meta in team_meta)
+                                  or not all(team_members(team) for team in teams) or not teams):
+        extra['teams'] = team_meta
+    if list(game) != [key for key in ('date', 'day_of_week', 'players', 'teams', 'winner') if key in stored] \
+            + list(rest):
+        extra['order'] = list(game)
+
+    if position is None:
+        position = _position(connection)
+    game_id = connection.execute(
+        'INSERT INTO games (id, position, date, day_of_week, winner, extra) VALUES (?, ?, ?, ?, ?, ?)',
+        (game_id, position, *columns, _dumps(extra) if extra else None)).lastrowid
+    if 'players' in stored:
+        connection.executemany('INSERT INTO game_players (game_id, slot, player_id) VALUES (?, ?, ?)',
+                               [(game_id, slot, _player_id(connection, name)) for slot, name in enumerate(players)])
+    if 'teams' in stored:
+        connection.executemany(
+            'INSERT INTO team_assignments (game_id, team, slot, player_id) VALUES (?, ?, ?, ?)',
+            [(game_id, team_index, slot, _player_id(connection, name))
+             for team_index, team in enumerate(teams) for slot, name in enumerate(team_members(team))])
+    return game_id
+
+
+def _read_games(connection, where='', params=()):
+    names = dict(connection.execute('SELECT id, name FROM players'))
+    rows = connection.execute(f'SELECT id, date, day_of_week, winner, extra FROM games {where} '
+                              f'ORDER BY position DESC', params).fetchall()
+    if not rows:
+        return []
+    ids = [row[0] for row in rows]
+    marks = ', '.join('?' * len(ids)) if where else None
+    player_query = 'SELECT game_id, player_id FROM game_players' + (f' WHERE game_id IN ({marks})' if where else '')
+    team_query = 'SELECT game_id, team, player_id FROM team_assignments' + (
+        f' WHERE game_id IN ({marks})' if where else '')
+    players, teams = {}, {}
+    for game_id, player_id in connection.execute(player_query + ' ORDER BY game_id, slot', ids if where else ()):
+        players.setdefault(game_id, []).append(names[player_id])
+    for game_id, team, player_id in connection.execute(team_query + ' ORDER BY game_id, team, slot',
+                                                      ids if where else ()):
+        teams.setdefault(game_id, {}).setdefault(team, []).append(names[player_id])
+
+    games = []
+    for game_id, *columns, extra in rows:
+        extra = json.loads(extra) if extra else {}
+        game = {key: value for key, value in zip(GAME_COLUMNS[:2], columns[:2]) if value is not None}
+        if game_id in players or 'players' in extra:
+            game['players'] = players.get(game_id, [])
+        if game_id in teams or 'teams' in extra:
+            members = teams.get(game_id, {})
+            meta = extra.get('teams') or [None] * (max(members) + 1 if members else 0)
+            game['teams'] = [{**team_meta, 'players': members.get(i, [])} if team_meta is not None
+                             else members.get(i, []) for i, team_meta in enumerate(meta)]
+        if columns[2] is not None:
+            game['winner'] = columns[2]
+        game.update(extra.get('rest', {}))
+        if 'order' in extra:
+            game = {key: game[key] for key in extra['order']}
+        games.append(game)
+    return games
+
+
+def _game_row(connection, date, day_of_week):
+    # The game stats.find_game would return: the newest one with that date and day
+    row = connection.execute('SELECT id, position FROM games WHERE date = ? AND day_of_week IS ? '
+                             'ORDER BY position DESC LIMIT 1', (date, day_of_week)).fetchone()
+    if row is None:
+        raise ValueError(f"No game on {date} ({day_of_week})")
+    return row
+
+
+# ################################ load / save ################################ #
+
+def _meta(connection):
+    return {key: json.loads(value) for key, value in connection.execute('SELECT key, value FROM meta')}
+
+
+def _read_data(connection):
+    meta = _meta(connection)
+    data = {'games': _read_games(connection), 'players': {}}
+    past_teams = {}
+    for player_id, members in connection.execute('SELECT player_id, members FROM past_teams ORDER BY player_id, slot'):
+        past_teams.setdefault(player_id, []).append(json.loads(members))
+    for player_id, name, *row in connection.execute(f'SELECT id, name, {", ".join(PLAYER_COLUMNS)}, extra FROM players '
+                                                    f'WHERE listed = 1 ORDER BY sort_order'):
+        data['players'][name] = _read_player(row, past_teams.get(player_id))
+    if 'top' in meta:
+        data.update(meta['top'])
+        data = {key: data[key] for key in meta['top_order']}
+    if meta.get('journal_seq'):
+        data['journal_seq'] = meta['journal_seq']
+    return data
+
+
+def load(path):
+    """
+    Load the whole dataset from a SQLite file.
+    :param path: Path of the .db file
+    :return: The JSON data
+    """
+    connection = connect(path)
+    try:
+        connection.execute('BEGIN')
+        data = _read_data(connection)
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+    models.compact(data)
+    return data
+
+
+def _write_all(connection, data):
+    for table in ('past_teams', 'team_assignments', 'game_players', 'games', 'players', 'meta'):
+        connection.execute(f'DELETE FROM {table}')
+    for sort_order, (name, player) in enumerate(data.get('players', {}).items()):
+        _write_player(connection, name, player, sort_order)
+    for game in reversed(data.get('games', [])):
+        _insert_game(connection, game)
+
+    top = {key: value for key, value in data.items() if key not in ('games', 'players', 'journal_seq')}
+    meta = {'journal_seq': journal.version(data)}
+    if top or [key for key in data if key != 'journal_seq'] != ['games', 'players']:
+        meta['top'] = top
+        meta['top_order'] = [key for key in data if key != 'journal_seq']
+    connection.executemany('INSERT INTO meta (key, value) VALUES (?, ?)',
+                           [(key, _dumps(value)) for key, value in meta.items()])
+
+
+def _version(connection):
+    row = connection.execute("SELECT value FROM meta WHERE key = 'journal_seq'").fetchone()
+    return json.loads(row[0]) if row else 0
+
+
+def _reload(connection, data):
+    # Replace the data in place with what the database holds
+    fresh = _read_data(connection)
+    models.compact(fresh)
+    data.clear()
+    data.update(fresh)
+    journal.forget_indexes(data)
+
+
+def _catch_up(connection, data, reload):
+    ours = journal.version(data)
+    stored = _version(connection)
+    if stored == ours:
+        return
+    entries = [json.loads(entry) for (entry,) in
+               connection.execute('SELECT entry FROM changes WHERE seq > ? ORDER BY seq', (ours,))]
+    # Behind with a gap (another writer compacted), or ahead of the database (changes that were never
+    # stored): stamping on top would skip or reuse versions in the changes table
+    if stored < ours or not entries or entries[0]['seq'] != ours + 1:
+        if not reload:
+            raise journal.ConflictError("The data and the database disagree on the version; reload and try again",
+                                        ours, stored)
+        _reload(connection, data)
+        return
+    for entry in entries:
+        journal.apply_entry(data, entry)
+        data['journal_seq'] = entry['seq']
+
+
+def compact(data, path):
+    """
+    Store the whole dataset (the SQLite counterpart of rewriting the JSON snapshot).
+    Changes other writers committed meanwhile are merged in first.
+    """
+    connection = connect(path)
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            _catch_up(connection, data, reload=False)
+            _write_all(connection, data)
+            # Keep about as many changes as the JSON change log does, for changes_since
+            connection.execute('DELETE FROM changes WHERE seq <= ?', (journal.version(data) - RETAIN_CHANGES,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+    finally:
+        connection.close()
+
+
+# ################################ row-level writes ################################ #
+
+def _touched(data, entry):
+    # (game dicts, player names) an entry is about to change, looked up before it is applied
+    op = entry['op']
+    if op in ('add_game', 'save_teams'):
+        game = entry['game']
+        names = set(game.get('players', []))
+        for team in game.get('teams', []):
+            names.update(team_members(team))
+        return [], names
+    if op == 'update_player':
+        return [], {entry['name']}
+    game = stats.find_game(data, entry['date'], entry['day_of_week'])
+    return ([game] if game is not None else []), set(game.get('players', []) if game else [])
+
+
+def _write_entry(connection, data, entry, games, names):
+    op = entry['op']
+    past_teams = {}
+    if op in ('add_game', 'save_teams'):
+        game = entry['game']
+        # A game that went in below the newest one (a backfill) is placed between its neighbours
+        backfill = data['games'][0] is not game and game.get('date')
+        _insert_game(connection, game, position=_position(connection, game['date'] if backfill else None))
+        if op == 'save_teams':
+            past_teams = {name: 'last' for team in game['teams'] for name in team_members(team)}
+    elif op == 'remove_game':
+        connection.execute('DELETE FROM games WHERE id = ?',
+                           (_game_row(connection, entry['date'], entry['day_of_week'])[0],))
+    elif op in ('edit_game', 'set_teams'):
+        # Rewrite the game in place (same row id and position, so history order is kept)
+        game_id, position = _game_row(connection, entry['date'], entry['day_of_week'])
+        connection.execute('DELETE FROM games WHERE id = ?', (game_id,))
+        _insert_game(connection, games[0], game_id, position)
+        names = names | set(games[0].get('players', []))
+    elif op == 'update_player' and 'past_teams' in entry['fields']:
+        past_teams = {entry['name']: 'all'}
+
+    for name in names:
+        if name in data['players']:
+            _write_player(connection, name, data['players'][name], past_teams=past_teams.get(name))
+    connection.execute('INSERT INTO changes (seq, entry) VALUES (?, ?)', (entry['seq'], _dumps(entry)))
+    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('journal_seq', ?)", (entry['seq'],))
+
+
+def commit(data, entries, path, expected_version=None):
+    """
+    Apply entries to the data and write the rows they touch, in one transaction.
+    Same arguments and conflicts as journal.commit.
+    :return: The new version
+    """
+    connection = connect(path)
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        stamped = 0
+        try:
+            _catch_up(connection, data, reload=True)
+            if expected_version is not None and journal.version(data) != expected_version:
+                raise journal.ConflictError(
+                    f"Expected version {expected_version}, the data is at version {journal.version(data)}",
+                    expected_version, journal.version(data))
+            failed = None
+            for entry in entries:
+                try:
+                    games, names = _touched(data, entry)
+                    entry = journal.stamp(data, entry)
+                except Exception as error:
+                    # Entries applied before a failing one are kept, in memory and on disk alike (as in
+                    # journal.commit); stamp leaves the data untouched when it refuses an entry
+                    failed = error
+                    break
+                stamped += 1
+                _write_entry(connection, data, entry, games, names)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            if stamped:
+                # The data holds changes the database doesn't: go back to what is stored
+                _reload(connection, data)
+            raise
+    finally:
+        connection.close()
+    if failed is not None:
+        raise failed
+    return journal.version(data)
+
+
+def record(data, entry, path, expected_version=None):
+    return commit(data, [entry], path, expected_version)
+
+
+def changes_since(path, since):
+    """
+    :return: Changes with seq > since, oldest first, or None when they are no longer kept (see journal.changes_since)
+    """
+    connection = connect(path)
+    try:
+        connection.execute('BEGIN')
+        current = _version(connection)
+        entries = [json.loads(entry) for (entry,) in
+                   connection.execute('SELECT entry FROM changes WHERE seq > ? ORDER BY seq', (since,))]
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+    if since > current or (since < current and (not entries or entries[0]['seq'] != since + 1)):
+        return None
+    return entries
+
+
+# ################################ indexed queries ################################ #
+
+def player_dates(path, player_name, day_of_week=None):
+    """
+    A player's games straight from the file, without loading the dataset.
+    :return: Sorted 'YYYY-MM-DD' dates of the player's games (optionally on one day of the week)
+    """
+    query = ('SELECT g.date FROM game_players gp JOIN players p ON p.id = gp.player_id '
+             'JOIN games g ON g.id = gp.game_id WHERE p.name = ? AND g.date IS NOT NULL')
+    params = [player_name]
+    if day_of_week:
+        query += ' AND g.day_of_week = ?'
+        params.append(day_of_week)
+    connection = connect(path)
+    try:
+        return [date for (date,) in connection.execute(query + ' ORDER BY g.date', params)]
+    finally:
+        connection.close()
+
+
+# ################################ migration ################################ #
+
+def write(data, path):
+    """
+    Store a whole dataset in a new SQLite file, replacing the file ('main.py convert' from JSON or .kbs).
+    :param data: The JSON data
+    :param path: Path of the .db file
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    connection = connect(path)
+    try:
+        connection.execute('BEGIN')
+        _write_all(connection, data)
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
@@ -0,0 +1,176 @@
+import attendance
+import coplay
+import instrument
+import ratings
+import rollups
+import team_cache
+
+# Incremental player statistics.
+#
+# The per-day counters ('tuesday_games', 'thursday_games', 'saturday_games', 'total_games') are kept
+# up to date by applying the delta of each game as it is added, edited or removed, which costs
+# O(players in the game). rebuild_stats / verify_stats recount everything from data['games'] and are
+# only meant for repairs. apply_game also keeps the attendance index, the co-play matrix, the
+# attendance rollups and the learned ratings in step with the games, and clears the team evaluation
+# cache. find_game looks games up by date + day of week in a per-data index instead of scanning the history.
+
+DAY_KEYS = {
+    'Tuesday': 'tuesday_games',
+    'Thursday': 'thursday_games',
+    'Saturday': 'saturday_games',
+}
+
+STAT_KEYS = ('tuesday_games', 'thursday_games', 'saturday_games', 'total_games')
+
+# Game fields the counters, the attendance index and the rollups are computed from
+COUNTED_FIELDS = ('players', 'date', 'day_of_week')
+
+
+def new_player_stats():
+    return {key: 0 for key in STAT_KEYS}
+
+
+# Add (sign=1) or subtract (sign=-1) one game's contribution to the player counters
+def apply_game(data, game, sign=1):
+    day_key = DAY_KEYS.get(game.get('day_of_week'))
+    for player_name in game.get('players', []):
+        player = data['players'].get(player_name)
+        if player is None:
+            player = data['players'][player_name] = new_player_stats()
+        if day_key:
+            player[day_key] = player.get(day_key, 0) + sign
+        player['total_games'] = player.get('total_games', 0) + sign
+    attendance.apply_game(data, game, sign)
+    coplay.apply_game(data, game, sign)
+    rollups.apply_game(data, game, sign)
+    ratings.apply_game(data, game, sign)
+    team_cache.apply_game(data, game, sign)
+
+
+# id(data) -> (data, number of games, newest game, {(date, day_of_week): game}). The count and the newest
+# game catch inserts that bypass record_game (e.g. saved teams), which then just rebuild the index.
+_game_keys = {}
+
+
+def _game_index(data):
+    games = data['games']
+    cached = _game_keys.get(id(data))
+    if (cached is None or cached[0] is not data or cached[1] != len(games)
+            or cached[2] is not (games[0] if games else None)):
+        index = {}
+        # Oldest first, so the newest of two games with the same key wins, like a scan from the top
+        for game in reversed(games):
+            index[game.get('date'), game.get('day_of_week')] = game
+        cached = _game_keys[id(data)] = (data, len(games), games[0] if games else None, index)
+    return cached[3]
+
+
+def find_game(data, date, day_of_week):
+    return _game_index(data).get((date, day_of_week))
+
+
+def forget(data):
+    _game_keys.pop(id(data), None)
+
+
+def record_game(data, game):
+    """
+    Add a game to the history (newest first) and count it for its players.
+    A game older than the latest one (a backfill) goes in by date instead of on top.
+    :param data: The JSON data
+    :param game: Game dict with 'date', 'day_of_week' and 'players'
+    """
+    games = data['games']
+    index = _game_index(data)
+    position = 0
+    if game.get('date'):
+        # ISO dates compare as strings; usually the loop stops right away at the newest game
+        while position < len(games) and str(games[position].get('date') or '') > game['date']:
+            position += 1
+    games.insert(position, game)
+    key = game.get('date'), game.get('day_of_week')
+    if position == 0 or key not in index:
+        index[key] = game
+    _game_keys[id(data)] = (data, len(games), games[0], index)
+    apply_game(data, game)
+
+
+def remove_game(data, game):
+    """
+    Remove a game from the history and take it off its players' counters.
+    :param data: The JSON data
+    :param game: The game dict, as stored in data['games']
+    """
+    for i, stored in enumerate(data['games']):
+        if stored is game:
+            del data['games'][i]
+            break
+    else:
+        raise ValueError(f"Game on {game.get('date')} ({game.get('day_of_week')}) is not in the data")
+    forget(data)
+    apply_game(data, game, sign=-1)
+
+
+def edit_game(data, game, **changes):
+    """
+    Change a recorded game (e.g. its players or day) and move the counters along with it.
+    Edits that leave the players, date and day alone (teams, winner) only touch the co-play matrix and the
+    ratings: the counters, attendance index and rollups don't depend on them.
+    :param data: The JSON data
+    :param game: The game dict, as stored in data['games']
+    :param changes: Game fields to replace
+    """
+    if not any(key in changes for key in COUNTED_FIELDS):
+        had_teams, had_result = bool(game.get('teams')), ratings.winning_team(game) is not None
+        game.update(changes)
+        if 'teams' in changes:
+            coplay.set_teams(data, game, had_teams)
+        ratings.set_result(data, game, had_result)
+        team_cache.apply_game(data, game)
+        return
+    apply_game(data, game, sign=-1)
+    game.update(changes)
+    if 'date' in changes or 'day_of_week' in changes:
+        forget(data)
+    apply_game(data, game)
+
+
+# ################################ repair ################################ #
+
+# Count every game from scratch
+def compute_stats(data):
+    instrument.count('games_scanned', len(data['games']))
+    expected = {name: new_player_stats() for name in data['players']}
+    for game in data['games']:
+        day_key = DAY_KEYS.get(game.get('day_of_week'))
+        for player_name in game.get('players', []):
+            counters = expected.setdefault(player_name, new_player_stats())
+            if day_key:
+                counters[day_key] += 1
+            counters['total_games'] += 1
+    return expected
+
+
+def verify_stats(data):
+    """
+    Compare the stored counters with a full recount.
+    :param data: The JSON data
+    :return: List of (player_name, stat_key, stored_value, expected_value) for every mismatch
+    """
+    mismatches = []
+    for player_name, counters in compute_stats(data).items():
+        stored = data['players'].get(player_name, {})
+        for key in STAT_KEYS:
+            if stored.get(key) != counters[key]:
+                mismatches.append((player_name, key, stored.get(key), counters[key]))
+    return mismatches
+
+
+# Overwrite the counters with a full recount, keeping them at the front of each player's dict
+def rebuild_stats(data):
+    for player_name, counters in compute_stats(data).items():
+        player = data['players'].get(player_name, {})
+        data['players'][player_name] = {
+            **counters,
+            **{key: value for key, value in player.items() if key not in counters}
+        }
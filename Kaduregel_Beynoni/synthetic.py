@@ -0,0 +1,122 @@
+import random
+from datetime import date, timedelta
+
+import stats
+
+# Seeded synthetic leagues in the soccer_team.json schema, for benchmarks and load tests.
+#
+# The shape follows the real data: Hebrew names (first names, then first name + surname once those run
+# out), mostly Tuesday and Saturday games with the odd Thursday, 14-16 players a game, and a skewed
+# attendance where a small core plays most games and a long tail shows up a handful of times.
+# About two thirds of the players have a rating and position, like the players added through the prompts.
+# The same arguments always give the same league.
+
+FIRST_NAMES = [
+    'אורי', 'איתי', 'אלון', 'אביב', 'אופיר', 'אור', 'אייל', 'אילן', 'אלעד', 'אמיר', 'אסף', 'אריאל',
+    'בן', 'ברק', 'גיא', 'גל', 'גלעד', 'דביר', 'דוד', 'דור', 'דן', 'דניאל', 'הראל', 'זיו', 'חיים',
+    'טל', 'יאיר', 'יגאל', 'יהונתן', 'יובל', 'יונתן', 'יוסי', 'ינון', 'יניב', 'ירין', 'ישי', 'כפיר',
+    'ליאב', 'ליאור', 'מאור', 'מיכאל', 'משה', 'נדב', 'נועם', 'ניר', 'ניתאי', 'נתנאל', 'עדי', 'עומר',
+    'עומרי', 'עידו', 'עמית', 'ערן', 'רוני', 'רועי', 'רן', 'רנן', 'שגיא', 'שחר', 'שי', 'שירן', 'תומר',
+]
+SURNAMES = [
+    'כהן', 'לוי', 'מזרחי', 'פרץ', 'ביטון', 'דהאן', 'אברהם', 'פרידמן', 'אזולאי', 'מלכה', 'חדד', 'גבאי',
+    'שפירא', 'קליין', 'אוחיון', 'יוסף', 'דוד', 'עמר', 'בן חמו', 'פלישתי', 'נוי', 'תור', 'שלוי', 'אביב',
+    'מנשה', 'גל', 'ציון', 'אלמקייס', 'מורגנשטיין', 'הורביץ', 'לדרמן', 'גאון', 'נגר', 'ששון', 'בוזגלו',
+]
+
+# Chance that a week has a game on each day
+DAY_WEIGHTS = {'Tuesday': 0.85, 'Thursday': 0.1, 'Saturday': 0.75}
+POSITIONS = ['Both', 'Offensive', 'Defensive', 'Goalkeeper']
+POSITION_WEIGHTS = [27, 26, 13, 4]
+RATINGS = [1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]
+RATING_WEIGHTS = [1, 1, 3, 8, 15, 17, 10, 10, 6]
+
+
+def player_names(count, rnd):
+    names = list(FIRST_NAMES)
+    rnd.shuffle(names)
+    seen = set(names)
+    while len(names) < count:
+        name = f'{rnd.choice(FIRST_NAMES)} {rnd.choice(SURNAMES)}'
+        if name in seen:
+            name = f'{name} {len(names)}'
+        seen.add(name)
+        names.append(name)
+    return names[:count]
+
+
+def game_dates(count, end, rnd):
+    # Newest first, walking back one week at a time from the week of `end`
+    dates = []
+    monday = end - timedelta(days=end.weekday())
+    while len(dates) < count:
+        for day, offset in (('Saturday', 5), ('Thursday', 3), ('Tuesday', 1)):
+            played = monday + timedelta(days=offset)
+            if played <= end and rnd.random() < DAY_WEIGHTS[day] and len(dates) < count:
+                dates.append((played, day))
+        monday -= timedelta(days=7)
+    return dates
+
+
+def _weighted_sample(names, cum_weights, k, rnd):
+    # Weighted sampling without replacement by redrawing repeats; O(k log n) per game
+    picked = {}
+    while len(picked) < k:
+        for name in rnd.choices(names, cum_weights=cum_weights, k=k - len(picked)):
+            picked.setdefault(name, None)
+    return list(picked)[:k]
+
+
+def generate_league(games=117, players=99, seed=0, end=date(2025, 3, 18), teams_share=0.0):
+    """
+    Build a synthetic league.
+    :param games: Number of games
+    :param players: Number of players on the roster
+    :param seed: Random seed
+    :param end: Date of the newest game (at the latest)
+    :param teams_share: Share of games that also get three teams and a winner (and past_teams entries)
+    :return: The data, in the soccer_team.json schema
+    """
+    rnd = random.Random(seed)
+    names = player_names(players, rnd)
+    # Heavy-tailed attendance propensity: a core of regulars and many occasional players
+    propensity = {name: min(rnd.paretovariate(1.2), 50.0) for name in names}
+    # Regulars stick to their days
+    cum_weights = {}
+    for day in DAY_WEIGHTS:
+        total, cum_weights[day] = 0.0, []
+        for name in names:
+            total += propensity[name] * rnd.uniform(0.3, 1.0)
+            cum_weights[day].append(total)
+
+    data = {'games': [], 'players': {}}
+    for name in names:
+        player = stats.new_player_stats()
+        if rnd.random() < 0.7:
+            player['rating'] = rnd.choices(RATINGS, RATING_WEIGHTS)[0]
+            player['position'] = rnd.choices(POSITIONS, POSITION_WEIGHTS)[0]
+            player['past_teams'] = []
+        data['players'][name] = player
+
+    for played, day in game_dates(games, end, rnd):
+        size = min(players, rnd.choice((14, 15, 15, 15, 16)))
+        game = {'date': played.isoformat(), 'day_of_week': day,
+                'players': _weighted_sample(names, cum_weights[day], size, rnd)}
+        data['games'].append(game)
+
+    # Teams and results, applied oldest first so past_teams keeps the order save_teams would give
+    for game in reversed(data['games']):
+        if rnd.random() >= teams_share:
+            continue
+        lineup = list(game['players'])
+        rnd.shuffle(lineup)
+        game['teams'] = [lineup[i::3] for i in range(3)]
+        game['winner'] = f'Team {rnd.randint(1, 3)}'
+        for team in game['teams']:
+            members = list(team)
+            for name in team:
+                data['players'][name].setdefault('past_teams', []).append(members)
+
+    for name, counters in stats.compute_stats(data).items():
+        data['players'][name].update(counters)
+    return data
@@ -0,0 +1,196 @@
+from collections import OrderedDict
+
+import balancer
+import coplay
+import instrument
+import ratings
+
+# Memoized team evaluations, for re-rolling teams on the same matchday.
+#
+# Regenerating teams for one roster asks the same questions again and again: the rated player dicts of
+# the roster, the score (balance, position spread, diversity) of a split, and the whole lineup search for
+# the same options and seed. Each data gets a bounded LRU of those answers, keyed by
+#   ('lineup', roster, learned ratings)              -> the balancer's player dicts (models.lineup)
+#   ('score', fingerprint, weight, learned ratings)  -> balancer.evaluate_teams of a split
+#   ('diversity', fingerprint)                       -> coplay diversity_score of a split
+#   ('lineups', roster, options)                     -> form_teams results, whose scores are stored too
+# A split's fingerprint is order-independent (balancer.lineup_fingerprint: sorted names per team, teams
+# sorted). A roster stays in signup order, since the seeded search depends on it.
+# Everything in the cache belongs to one dataset version: a new journal_seq, or a game applied through
+# stats.apply_game, clears it, because ratings and past teammates move with the history.
+# Cached values are shared between callers and must not be changed.
+
+CACHE_SIZE = 256
+
+
+def _version(data):
+    # journal.version; journal imports stats, which imports this module
+    return data.get('journal_seq', 0)
+
+
+class TeamCache:
+    def __init__(self, data, size=CACHE_SIZE):
+        self.data = data
+        self.size = size
+        self.version = _version(data)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        version = _version(self.data)
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def lookup(self, key):
+        """
+        :return: The cached value, or None
+        """
+        self._check_version()
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            instrument.count('team_cache_misses')
+        else:
+            self.hits += 1
+            instrument.count('team_cache_hits')
+            self.entries.move_to_end(key)
+        return value
+
+    def store(self, key, value, version=None):
+        """
+        :param version: Version of the data the value was computed from (default: the current one);
+                        values computed from an older version are dropped
+        """
+        self._check_version()
+        if version is not None and version != self.version:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def get(self, key, compute):
+        value = self.lookup(key)
+        if value is None:
+            value = compute()
+            self.store(key, value)
+        return value
+
+    def clear(self):
+        if self.entries:
+            self.invalidations += 1
+            self.entries.clear()
+
+    def info(self):
+        return {'version': self.version, 'size': len(self.entries), 'capacity': self.size, 'hits': self.hits,
+                'misses': self.misses, 'invalidations': self.invalidations}
+
+
+# ################################ per-data cache ################################ #
+
+# id(data) -> (data, TeamCache); the data reference keeps the id from being reused, so a dict that is
+# replaced stays alive until forget (journal.forget_indexes) drops it
+_caches = {}
+
+
+def cache_for(data):
+    cached = _caches.get(id(data))
+    if cached is None or cached[0] is not data:
+        cached = _caches[id(data)] = (data, TeamCache(data))
+    return cached[1]
+
+
+# Called for every game write: evaluations depend on the whole history
+def apply_game(data, game, sign=1):
+    cached = _caches.get(id(data))
+    if cached is not None and cached[0] is data:
+        cached[1].clear()
+
+
+def forget(data):
+    _caches.pop(id(data), None)
+
+
+# ################################ evaluations ################################ #
+
+def rated_lineup(data, names, learned_ratings=True):
+    """
+    The balancer's player dicts for a roster (see models.lineup), computed once per dataset version.
+    :param data: The JSON data
+    :param names: Player names, in signup order
+    :param learned_ratings: Use the ratings learned from results instead of the hand-entered ones
+    """
+    import models
+
+    return cache_for(data).get(('lineup', tuple(names), learned_ratings), lambda: models.lineup(
+        data, names, ratings.ratings_for(data) if learned_ratings else None))
+
+
+def evaluate(data, teams, diversity_weight=0.1, learned_ratings=True):
+    """
+    Score a split with the balancer's objective, on the data's current ratings and past teams.
+    :param data: The JSON data
+    :param teams: List of teams, each a list of player dicts with 'name' or a list of names
+    :param diversity_weight: Cost of every repeated teammate pair (0.1 * creativity level)
+    :param learned_ratings: Use the ratings learned from results instead of the hand-entered ones
+    :return: Score dict with 'balance', 'positions', 'diversity' and 'total'
+    """
+    teams = [[p if isinstance(p, dict) else {'name': p} for p in team] for team in teams]
+    key = ('score', balancer.lineup_fingerprint(teams), diversity_weight, learned_ratings)
+
+    def compute():
+        import models
+
+        engine = ratings.ratings_for(data) if learned_ratings else None
+        rated = [models.lineup(data, [p['name'] for p in team], engine) for team in teams]
+        return balancer.evaluate_teams(rated, coplay.matrix_for(data).teammates_of, diversity_weight)
+    return cache_for(data).get(key, compute)
+
+
+def diversity(data, teams):
+    # coplay's diversity score of a split (see main.calculate_diversity_score)
+    teams = [[p if isinstance(p, dict) else {'name': p} for p in team] for team in teams]
+    return cache_for(data).get(('diversity', balancer.lineup_fingerprint(teams)),
+                               lambda: coplay.matrix_for(data).diversity_score(teams))
+
+
+def _lineups_key(names, options):
+    return 'lineups', tuple(names), tuple(sorted(options.items()))
+
+
+def find_lineups(data, names, **options):
+    # Cached search results for a roster and options (see lineups), or None
+    return cache_for(data).lookup(_lineups_key(names, options))
+
+
+def store_lineups(data, names, results, version=None, **options):
+    """
+    Cache search results, along with the score of every split in them.
+    :param version: The dataset version the search ran on (default: the current one)
+    """
+    cache = cache_for(data)
+    cache.store(_lineups_key(names, options), results, version)
+    for teams, score in results:
+        cache.store(('score', balancer.lineup_fingerprint(teams), options.get('diversity_weight', 0.1),
+                     options.get('learned_ratings', True)), score, version)
+
+
+def lineups(data, names, search, **options):
+    """
+    Lineup search results for a roster, computed once per dataset version and options.
+    :param data: The JSON data
+    :param names: The roster, in signup order
+    :param search: Function that runs the search, returning a list of (teams, score)
+    :param options: Everything the results depend on: diversity_weight and learned_ratings (also used for
+                    the score entries), seed, candidates, top_k, ...
+    :return: The list of (teams, score)
+    """
+    results = find_lineups(data, names, **options)
+    if results is None:
+        version = cache_for(data).version
+        results = search()
+        store_lineups(data, names, results, version, **options)
+    return results
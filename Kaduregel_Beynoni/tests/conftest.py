@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+
+import pytest
+
+# The modules sit flat next to main.py; run from Kaduregel_Beynoni (or anywhere): python -m pytest tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import journal  # noqa: E402
+import sqlite_store  # noqa: E402
+import synthetic  # noqa: E402
+
+# (file name, storage module) for every backend that records changes
+BACKENDS = [('soccer_team.json', journal), ('soccer_team.db', sqlite_store)]
+
+
+def pytest_addoption(parser):
+    parser.addoption('--bench-baseline', help="fail benchmark cases that regressed against results saved with "
+                                              "'python benchmark.py --json'")
+
+
+def canonical(data):
+    # Data as plain JSON with sorted keys: what a load gives back, whatever lists are shared in memory
+    return json.dumps(data, ensure_ascii=False, sort_keys=True)
+
+
+def store(league, path, storage):
+    if storage is journal:
+        journal.write_snapshot(league, path)
+    else:
+        sqlite_store.compact(league, path)
+    return path
+
+
+@pytest.fixture
+def league():
+    # A small seeded league with teams and winners on some of its games
+    return synthetic.generate_league(games=40, seed=0, teams_share=0.3)
+
+
+@pytest.fixture(params=BACKENDS, ids=[storage.__name__ for _, storage in BACKENDS])
+def backend(request, tmp_path, monkeypatch, league):
+    """
+    (path, storage) of a fresh data file holding the league, in the test's own directory.
+    """
+    # Alias files and the like land in the temporary directory, not in the repo
+    monkeypatch.chdir(tmp_path)
+    file_name, storage = request.param
+    return store(league, str(tmp_path / file_name), storage), storage
+
+
+@pytest.fixture
+def data_file(tmp_path, monkeypatch, league):
+    # The league as a JSON snapshot (with no journal yet)
+    monkeypatch.chdir(tmp_path)
+    return store(league, str(tmp_path / 'soccer_team.json'), journal)
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+import benchmark
+
+# benchmark.py under pytest: the same budgets and checks as 'python benchmark.py', one test each.
+# Compare the suite against a saved run with: python -m pytest tests --bench-baseline baseline.json
+
+
+def test_startup_within_budget():
+    import_time, first_list_time = benchmark.measure_startup(runs=3)
+    assert import_time <= benchmark.IMPORT_BUDGET
+    assert first_list_time <= benchmark.FIRST_LIST_BUDGET
+
+
+def test_partial_batch_keeps_memory_and_disk_in_step(backend):
+    path, storage = backend
+    assert benchmark._partial_batch(path, storage) is None
+
+
+@pytest.fixture(scope='module')
+def suite():
+    return benchmark.run_suite(('real',), repeat=3)
+
+
+@pytest.mark.parametrize('case', ['sync_player_stats', 'sort_players_only', 'compare_players',
+                                  'calculate_diversity_score', 'create_teams'])
+def test_suite_case(suite, case, request):
+    result = suite[f'real/{case}']
+    assert result['cold'] > 0 and result['warm'] > 0
+    baseline_path = request.config.getoption('--bench-baseline')
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as read_file:
+            baseline = json.load(read_file)
+        assert benchmark.compare_suite({f'real/{case}': result}, baseline) == []
+
+
+def test_service_read_latency_within_budget():
+    results = benchmark.measure_service(clients=10, requests=20)
+    assert results['read']['p99'] <= benchmark.SERVICE_P99_BUDGET
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+import journal
+import writer
+from conftest import canonical
+
+
+def _game(data, date, first=0):
+    return {'op': 'add_game',
+            'game': {'date': date, 'day_of_week': 'Tuesday', 'players': list(data['players'])[first:first + 15]}}
+
+
+def test_stale_expected_version_is_a_conflict(backend):
+    path, storage = backend
+    ours, theirs = storage.load(path), storage.load(path)
+    base = journal.version(ours)
+    storage.record(theirs, _game(theirs, '2030-01-01'), path)
+
+    with pytest.raises(journal.ConflictError) as conflict:
+        storage.record(ours, _game(ours, '2030-01-08'), path, expected_version=base)
+    assert (conflict.value.expected, conflict.value.actual) == (base, base + 1)
+    # Nothing of ours was stored, and we caught up with their change
+    assert canonical(storage.load(path)) == canonical(theirs)
+    assert journal.version(ours) == base + 1
+
+
+def test_writers_without_expected_version_merge(backend):
+    path, storage = backend
+    ours, theirs = storage.load(path), storage.load(path)
+    storage.record(theirs, _game(theirs, '2030-01-01'), path)
+    storage.record(ours, _game(ours, '2030-01-08', first=20), path)
+
+    stored = storage.load(path)
+    assert [game['date'] for game in stored['games'][:2]] == ['2030-01-08', '2030-01-01']
+    assert canonical(stored) == canonical(ours)
+
+
+def test_same_game_from_two_writers_is_a_conflict(backend):
+    path, storage = backend
+    ours, theirs = storage.load(path), storage.load(path)
+    storage.record(theirs, _game(theirs, '2030-01-01'), path)
+    with pytest.raises(journal.ConflictError, match='already recorded'):
+        storage.record(ours, _game(ours, '2030-01-01', first=20), path)
+    assert canonical(storage.load(path)) == canonical(theirs)
+
+
+def test_compact_after_another_writer_compacted_is_a_conflict(data_file):
+    ours, theirs = journal.load(data_file), journal.load(data_file)
+    journal.record(theirs, _game(theirs, '2030-01-01'), data_file)
+    journal.compact(theirs, data_file)
+
+    with pytest.raises(journal.ConflictError, match='rewritten by another writer'):
+        journal.compact(ours, data_file)
+    assert canonical(journal.load(data_file)) == canonical(theirs)
+
+
+def test_write_queue_fails_only_the_stale_entry(data_file):
+    data = journal.load(data_file)
+    names = list(data['players'])
+    with writer.WriteQueue(data, data_file) as writes:
+        base = writes.write({'op': 'update_player', 'name': names[0], 'fields': {'rating': 1.0}})
+        futures = []
+
+        def submit(i):
+            futures.append(writes.submit({'op': 'update_player', 'name': names[i], 'fields': {'rating': 2.0}}))
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(1, 21)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stale = writes.submit({'op': 'update_player', 'name': names[0], 'fields': {'rating': 5.0}},
+                              expected_version=base)
+        versions = sorted(future.result() for future in futures)
+
+    assert versions == list(range(base + 1, base + 21))
+    with pytest.raises(journal.ConflictError):
+        stale.result()
+    stored = journal.load(data_file)
+    assert stored['players'][names[0]]['rating'] == 1.0
+    assert canonical(stored) == canonical(data)
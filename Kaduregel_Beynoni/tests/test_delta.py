@@ -0,0 +1,93 @@
+import copy
+
+import pytest
+
+import delta
+import journal
+from conftest import canonical
+
+
+def _server_changes(data):
+    # Every kind of write a client has to catch up on: new, backfilled, edited, removed and saved games
+    names = list(data['players'])
+    newest, older = data['games'][0], data['games'][5]
+    return [
+        {'op': 'add_game', 'game': {'date': '2030-01-01', 'day_of_week': 'Tuesday', 'players': names[:15]}},
+        {'op': 'add_game', 'game': {'date': '2001-01-02', 'day_of_week': 'Tuesday', 'players': names[5:20]}},
+        {'op': 'edit_game', 'date': newest['date'], 'day_of_week': newest['day_of_week'],
+         'changes': {'players': names[10:25]}},
+        {'op': 'edit_game', 'date': older['date'], 'day_of_week': older['day_of_week'],
+         'changes': {'day_of_week': 'Saturday'}},
+        {'op': 'remove_game', 'date': data['games'][8]['date'], 'day_of_week': data['games'][8]['day_of_week']},
+        {'op': 'save_teams', 'game': {'date': '2030-01-04', 'day_of_week': 'Saturday',
+                                      'teams': [names[:5], names[5:10], names[10:15]]}},
+        {'op': 'update_player', 'name': names[1], 'fields': {'rating': 4.5}},
+        {'op': 'update_player', 'name': 'brand new', 'fields': {'rating': 3.0}},
+    ]
+
+
+def test_delta_bundle_brings_a_client_up_to_date(backend):
+    path, storage = backend
+    server = storage.load(path)
+    client = copy.deepcopy(server)
+    since = journal.version(client)
+    storage.commit(server, _server_changes(server), path)
+
+    bundle = delta.export_delta(server, storage.changes_since(path, since), since)
+    assert bundle['format'] == delta.DELTA
+    assert (bundle['base'], bundle['version']) == (since, journal.version(server))
+    # Only what was touched travels
+    assert len(bundle['games']) < len(server['games'])
+    delta.apply_bundle(client, bundle)
+    assert canonical(client) == canonical(storage.load(path))
+
+
+@pytest.mark.parametrize('file_name', ['bundle.json', 'bundle.json.gz'])
+def test_bundle_survives_the_file_round_trip(backend, tmp_path, file_name):
+    path, storage = backend
+    server = storage.load(path)
+    client = copy.deepcopy(server)
+    storage.commit(server, _server_changes(server), path)
+    bundle = delta.export_delta(server, storage.changes_since(path, 0), 0)
+
+    bundle_path = str(tmp_path / file_name)
+    delta.write_bundle(bundle, bundle_path)
+    delta.apply_bundle(client, delta.read_bundle(bundle_path))
+    assert canonical(client) == canonical(server)
+
+
+def test_bundle_on_another_base_is_a_conflict(data_file):
+    server = journal.load(data_file)
+    client = copy.deepcopy(server)
+    journal.record(server, _server_changes(server)[0], data_file)
+    # The client moved on some other way (another server, a local edit)
+    client['journal_seq'] = 5
+    bundle = delta.export_delta(server, journal.changes_since(data_file, 0), 0)
+    with pytest.raises(journal.ConflictError):
+        delta.apply_bundle(client, bundle)
+
+
+def test_snapshot_bundle_when_the_change_log_is_gone(data_file, monkeypatch):
+    monkeypatch.setattr(journal, 'COMPACT_EVERY', 2)
+    monkeypatch.setattr(journal, 'RETAIN_SEGMENTS', 1)
+    server = journal.load(data_file)
+    for entry in _server_changes(server):
+        journal.record(server, entry, data_file)
+
+    bundle = delta.export_delta(server, journal.changes_since(data_file, 0), 0)
+    assert bundle['format'] == delta.SNAPSHOT
+    assert canonical(delta.apply_bundle({}, bundle)) == canonical(server)
+
+
+def test_file_client_pulls_a_snapshot_then_deltas(backend, tmp_path):
+    path, storage = backend
+    fetch = delta.local_fetch(path, storage)
+    client = delta.FileClient(str(tmp_path / 'client.json'))
+    assert client.pull(fetch)['format'] == delta.SNAPSHOT
+
+    server = storage.load(path)
+    storage.commit(server, _server_changes(server), path)
+    assert client.pull(fetch)['format'] == delta.DELTA
+    assert canonical(client.data) == canonical(storage.load(path))
+    # A fresh client object reads the copy it saved
+    assert canonical(delta.FileClient(client.path).data) == canonical(client.data)
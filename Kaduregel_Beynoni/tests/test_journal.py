@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+import journal
+from conftest import canonical
+
+
+def _changes(data):
+    # One of each kind of write, including a backfill below the newest game
+    names = list(data['players'])
+    newest = data['games'][0]
+    return [
+        {'op': 'add_game', 'game': {'date': '2030-01-01', 'day_of_week': 'Tuesday', 'players': names[:15]}},
+        {'op': 'add_game', 'game': {'date': '2001-01-02', 'day_of_week': 'Tuesday', 'players': names[5:20]}},
+        {'op': 'edit_game', 'date': newest['date'], 'day_of_week': newest['day_of_week'],
+         'changes': {'players': names[10:25]}},
+        {'op': 'set_teams', 'date': '2030-01-01', 'day_of_week': 'Tuesday',
+         'teams': [names[:5], names[5:10], names[10:15]]},
+        {'op': 'edit_game', 'date': '2030-01-01', 'day_of_week': 'Tuesday', 'changes': {'winner': 'draw'}},
+        {'op': 'update_player', 'name': names[0], 'fields': {'rating': 4.5, 'position': 'Defensive'}},
+        {'op': 'remove_game', 'date': data['games'][3]['date'], 'day_of_week': data['games'][3]['day_of_week']},
+    ]
+
+
+def test_load_replays_the_journal(data_file):
+    data = journal.load(data_file)
+    for entry in _changes(data):
+        journal.record(data, entry, data_file)
+
+    assert os.path.exists(journal.journal_path(data_file))
+    loaded = journal.load(data_file)
+    assert journal.version(loaded) == journal.version(data) == 7
+    assert canonical(loaded) == canonical(data)
+
+
+def test_replayed_counters_match_a_recount(data_file):
+    import stats
+
+    data = journal.load(data_file)
+    for entry in _changes(data):
+        journal.record(data, entry, data_file)
+    assert stats.verify_stats(journal.load(data_file)) == []
+
+
+def test_torn_last_line_is_dropped_and_repaired(data_file):
+    data = journal.load(data_file)
+    entries = _changes(data)
+    journal.record(data, entries[0], data_file)
+    with open(journal.journal_path(data_file), 'a', encoding='utf-8') as journal_file:
+        journal_file.write('{"seq": 2, "op": "add_ga')
+
+    assert canonical(journal.load(data_file)) == canonical(data)
+    # The next write cuts the torn line off before appending
+    journal.record(data, entries[1], data_file)
+    assert canonical(journal.load(data_file)) == canonical(data)
+
+
+def test_compact_folds_the_journal_into_the_snapshot(data_file):
+    data = journal.load(data_file)
+    for entry in _changes(data):
+        journal.record(data, entry, data_file)
+    journal.compact(data, data_file)
+
+    assert not os.path.exists(journal.journal_path(data_file))
+    assert [last for last, _ in journal.segment_paths(data_file)] == [7]
+    loaded = journal.load(data_file)
+    assert journal.version(loaded) == 7
+    assert canonical(loaded) == canonical(data)
+    # Writes after the compaction continue the sequence
+    journal.record(data, {'op': 'update_player', 'name': 'new player', 'fields': {'rating': 3.0}}, data_file)
+    assert [entry['seq'] for entry in journal.changes_since(data_file, 0)] == list(range(1, 9))
+
+
+def test_automatic_compaction_keeps_the_change_log(data_file, monkeypatch):
+    monkeypatch.setattr(journal, 'COMPACT_EVERY', 3)
+    data = journal.load(data_file)
+    name = next(iter(data['players']))
+    for rating in range(10):
+        journal.record(data, {'op': 'update_player', 'name': name, 'fields': {'rating': rating}}, data_file)
+
+    assert len(journal.segment_paths(data_file)) == 3
+    assert [entry['seq'] for entry in journal.changes_since(data_file, 2)] == list(range(3, 11))
+    assert journal.changes_since(data_file, 10) == []
+    assert canonical(journal.load(data_file)) == canonical(data)
+
+
+def test_changes_since_is_none_once_the_log_is_dropped(data_file, monkeypatch):
+    monkeypatch.setattr(journal, 'COMPACT_EVERY', 2)
+    monkeypatch.setattr(journal, 'RETAIN_SEGMENTS', 1)
+    data = journal.load(data_file)
+    name = next(iter(data['players']))
+    for rating in range(6):
+        journal.record(data, {'op': 'update_player', 'name': name, 'fields': {'rating': rating}}, data_file)
+
+    assert journal.changes_since(data_file, 0) is None
+    assert [entry['seq'] for entry in journal.changes_since(data_file, 4)] == [5, 6]
+
+
+def test_unknown_operation_is_rejected(data_file):
+    data = journal.load(data_file)
+    with pytest.raises(ValueError, match='Unknown journal operation'):
+        journal.record(data, {'op': 'rename_league'}, data_file)
+    assert journal.version(journal.load(data_file)) == 0
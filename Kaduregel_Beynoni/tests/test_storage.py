@@ -0,0 +1,36 @@
+import pytest
+
+import binary_snapshot
+import journal
+import sqlite_store
+from conftest import canonical
+
+
+def test_storage_for_picks_the_backend_by_extension():
+    assert journal.storage_for('soccer_team.json') is journal
+    assert journal.storage_for('soccer_team.db') is sqlite_store
+    assert journal.storage_for('soccer_team.kbs') is binary_snapshot
+
+
+def test_sqlite_round_trip(league, tmp_path):
+    path = str(tmp_path / 'soccer_team.db')
+    sqlite_store.write(league, path)
+    assert canonical(sqlite_store.load(path)) == canonical(league)
+
+
+def test_binary_snapshot_round_trip(league, tmp_path):
+    path = str(tmp_path / 'soccer_team.kbs')
+    binary_snapshot.write(league, path)
+    assert canonical(binary_snapshot.load(path)) == canonical(league)
+    with binary_snapshot.Snapshot(path) as snapshot:
+        assert snapshot.game_players(0) == league['games'][0]['players']
+        assert snapshot.player_index(next(iter(league['players']))) == 0
+
+
+def test_binary_snapshot_is_read_only(league, tmp_path):
+    path = str(tmp_path / 'soccer_team.kbs')
+    binary_snapshot.write(league, path)
+    data = binary_snapshot.load(path)
+    with pytest.raises(ValueError, match='read-only'):
+        binary_snapshot.record(data, {'op': 'update_player', 'name': 'x', 'fields': {}}, path)
+    assert binary_snapshot.changes_since(path, journal.version(data)) == []
@@ -0,0 +1,112 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+import journal
+
+# Single-writer queue: many clients (threads, request handlers) submit journal entries, and one writer
+# thread commits whatever has queued up as a batch - one lock, one catch-up and one fsync for the lot.
+#
+#   writes = WriteQueue(data, 'soccer_team.json')
+#   version = writes.write({'op': 'update_player', 'name': name, 'fields': {'rating': 4.0}})
+#   future = writes.submit(entry, expected_version=version)    # compare-and-swap, non-blocking
+#
+# Each entry succeeds or fails on its own: a ConflictError (or ValueError) for one entry is set on its
+# future and the rest of the batch still goes through. The data dict is only changed by the writer
+# thread, while holding `lock`; readers in other threads take the same lock for a consistent view.
+# The lock is released before the batch is fsynced, so readers may see changes a moment before they
+# are durable; futures resolve only once they are.
+
+MAX_BATCH = 100
+
+
+class WriteQueue:
+    def __init__(self, data, snapshot_path, max_batch=MAX_BATCH):
+        self.data = data
+        self.snapshot_path = snapshot_path
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='journal-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, entry, expected_version=None):
+        """
+        Queue a journal entry.
+        :param entry: A journal entry dict with an 'op' key
+        :param expected_version: Optional, fail with ConflictError unless the data is still at this version
+        :return: Future with the version after the entry was written
+        """
+        future = Future()
+        self._queue.put((entry, expected_version, future))
+        return future
+
+    def write(self, entry, expected_version=None):
+        return self.submit(entry, expected_version).result()
+
+    def close(self):
+        # Finish what was queued, then stop the writer thread
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._commit([item for item in batch if item is not None])
+            if stop:
+                return
+
+    def _commit(self, batch):
+        if not batch:
+            return
+        results = []
+        try:
+            with journal.locked(self.snapshot_path):
+                stamped = []
+                try:
+                    # Readers wait for the in-memory changes only, not for the disk write
+                    with self.lock:
+                        journal.catch_up(self.data, self.snapshot_path)
+                        self._apply(batch, stamped, results)
+                finally:
+                    # Only this thread changes the data, so it can be written out without the reader lock
+                    journal.flush(self.data, stamped, self.snapshot_path)
+        except Exception as error:
+            # The batch couldn't be stored (e.g. disk full): fail every entry that hadn't already failed
+            results = [(future, error if not isinstance(result, Exception) else result)
+                       for future, result in results]
+            done = {id(future) for future, _ in results}
+            results += [(future, error) for _, _, future in batch if id(future) not in done]
+
+        for future, result in results:
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _apply(self, batch, stamped, results):
+        for entry, expected_version, future in batch:
+            current = journal.version(self.data)
+            if expected_version is not None and expected_version != current:
+                results.append((future, journal.ConflictError(
+                    f"Expected version {expected_version}, the data is at version {current}",
+                    expected_version, current)))
+                continue
+            try:
+                stamped.append(journal.stamp(self.data, entry))
+            except ValueError as error:
+                results.append((future, error))
+                continue
+            results.append((future, journal.version(self.data)))